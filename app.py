@@ -1,49 +1,69 @@
 import os
 import sys
+import json
+import time
 import psycopg2
-import numpy as np
 from psycopg2.extras import RealDictCursor
-from sentence_transformers import SentenceTransformer
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 from dotenv import load_dotenv
-from pgvector.psycopg2 import register_vector
 from celery.result import AsyncResult
 
+# Pooled connections with pgvector already registered
+import db
+import search
+from embedding_cache import QueryEmbeddingCache
+from batch_encoder import MicroBatchEncoder
+from embedding_backends import (
+    embedding_model_loaded, warm_up_embedding_model, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+)
+from embedding_sidecar import get_encoder, sidecar_client
+from vector_store import MmapVectorIndex
+
 # Import the Celery task AND the celery app instance itself
-from tasks import summarize_email, celery as celery_app
+from tasks import (
+    summarize_email, summarize_emails, stream_summary,
+    get_cached_summary, get_cached_summaries, get_llm, llm_loaded, celery as celery_app
+)
 
 # --- Configuration ---
 load_dotenv()
 
-DB_NAME = os.getenv("DB_NAME", "email_db")
-DB_USER = os.getenv("DB_USER", "postgres")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "mysecretpassword")
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = os.getenv("DB_PORT", "5433")
-
-# --- Model Loading ---
-print("Loading sentence transformer model...")
-try:
-    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-    print("Model loaded successfully.")
-except Exception as e:
-    print(f"CRITICAL: Failed to load SentenceTransformer model: {e}", file=sys.stderr)
-    sys.exit(1)
+# The embedding model and the LLM client are created on first use, so
+# importing this module is fast. Set WARMUP_ON_STARTUP=true to load both
+# while the worker starts instead of on the first request (call
+# POST /api/warmup to do the same later, e.g. from a readiness probe).
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+
+# Concurrent requests share one encode() call instead of one each
+# With EMBEDDING_SIDECAR_SOCKET set, the vectors come from the host's shared
+# embedding sidecar (embedding_sidecar.py) and this worker only loads the
+# model itself while the sidecar is down.
+encoder = MicroBatchEncoder(lambda texts: get_encoder().encode(texts, batch_size=len(texts)))
+
+# Repeated queries skip the encoder entirely. The namespace keeps Redis
+# entries from different models and backends apart.
+query_cache = QueryEmbeddingCache(encoder.encode, namespace=f"query-embedding:{EMBEDDING_MODEL_NAME}:{EMBEDDING_BACKEND}")
+
+# 'mmap' ranks unfiltered vector searches in-process over the memory-mapped
+# export of the embeddings (vector_store.py) instead of with pgvector;
+# filtered and hybrid searches still use pgvector.
+SEARCH_BACKENDS = ("pgvector", "mmap")
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "pgvector")
+if SEARCH_BACKEND not in SEARCH_BACKENDS:
+    raise ValueError(f"Unknown SEARCH_BACKEND '{SEARCH_BACKEND}'. Use one of {', '.join(SEARCH_BACKENDS)}.")
+vector_index = MmapVectorIndex() if SEARCH_BACKEND == "mmap" else None
+
+def warm_up():
+    """Loads the embedding model and the LLM client. Returns the seconds each took."""
+    timings = {"embedding_model": round(warm_up_embedding_model(get_encoder()), 3)}
+    started = time.perf_counter()
+    get_llm()
+    timings["llm"] = round(time.perf_counter() - started, 3)
+    return timings
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
 
-def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
-        return conn
-    except psycopg2.OperationalError as e:
-        print(f"Error: Could not connect to the database: {e}", file=sys.stderr)
-        return None
-
 # --- API Endpoints ---
 
 @app.route('/')
@@ -54,43 +74,101 @@ def index():
 @app.route('/api/search', methods=['POST'])
 def search_emails():
     """Receives a query and performs a similarity search."""
-    data = request.get_json()
-    if not data or 'query' not in data:
-        return jsonify({"error": "Missing 'query' in request body"}), 400
-
-    query = data['query']
-    print(f"Received search query: '{query}'")
-    query_embedding = embedding_model.encode(query).tolist()
+    try:
+        options = search.parse_search_options(request.get_json(silent=True))
+    except search.SearchError as e:
+        return jsonify({"error": str(e)}), 400
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
-    
-    register_vector(conn)
+    print(f"Received search query: '{options['query']}'")
+    query_embedding = query_cache.get(options['query'])
 
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                "SELECT id, sender, subject, body, timestamp, tags, embedding <=> %s AS distance FROM emails ORDER BY distance ASC LIMIT 5;",
-                (np.array(query_embedding),)
-            )
-            results = cur.fetchall()
-            print(f"Found {len(results)} matching emails.")
-            return jsonify(results)
+        if vector_index is not None and search.local_index_supports(options):
+            vector_index.refresh_if_stale(db.connection)
+            plan = search.local_index_plan(vector_index, query_embedding, options)
+        else:
+            plan = search.search_plan(query_embedding, options)
+        with db.connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                results = search.run_plan(cur, plan)
+        print(f"Found {len(results)} matching emails.")
+        return jsonify(results)
+    except psycopg2.OperationalError as e:
+        print(f"Error: Could not connect to the database: {e}", file=sys.stderr)
+        return jsonify({"error": "Database connection failed"}), 500
     except Exception as e:
         print(f"An error occurred during search: {e}", file=sys.stderr)
         return jsonify({"error": "An internal error occurred during search."}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/summarize/<int:email_id>', methods=['POST'])
 def start_summarization_task(email_id):
-    """Starts the background task to summarize an email."""
+    """
+    Returns the cached summary right away (200) if there is one, otherwise
+    starts the background task to summarize the email (202).
+    """
     print(f"Received request to summarize email ID: {email_id}")
+    try:
+        cached = get_cached_summary(email_id)
+    except psycopg2.Error as e:
+        print(f"Could not read the summary cache: {e}", file=sys.stderr)
+        cached = None
+    if cached is not None:
+        return jsonify({"status": "success", "summary": cached, "cached": True}), 200
+
     task = summarize_email.delay(email_id)
     return jsonify({"task_id": task.id}), 202
 
+@app.route('/api/summarize/<int:email_id>/stream', methods=['GET'])
+def stream_summarization(email_id):
+    """
+    Streams the summary as Server-Sent Events: 'token' events while the LLM
+    generates, then a final 'done' (or 'error') event. Cached summaries are
+    sent as a single 'done' event.
+    """
+    print(f"Received request to stream summary of email ID: {email_id}")
+
+    fields = {"token": "text", "done": "summary", "error": "message"}
+
+    def events():
+        for event, text in stream_summary(email_id):
+            yield f"event: {event}\ndata: {json.dumps({fields[event]: text})}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route('/api/summarize', methods=['POST'])
+def start_batch_summarization_task():
+    """
+    Summarizes several emails, e.g. a whole result page. Returns 200 with all
+    summaries when every one is cached, otherwise starts one batch task (202).
+    """
+    data = request.get_json()
+    email_ids = data.get('ids') if data else None
+    if not isinstance(email_ids, list) or not email_ids:
+        return jsonify({"error": "Missing 'ids' list in request body"}), 400
+    try:
+        email_ids = [int(email_id) for email_id in email_ids]
+    except (TypeError, ValueError):
+        return jsonify({"error": "'ids' must be integers"}), 400
+    if len(email_ids) > search.MAX_SEARCH_LIMIT:
+        return jsonify({"error": f"At most {search.MAX_SEARCH_LIMIT} 'ids' per request"}), 400
+
+    print(f"Received request to summarize email IDs: {email_ids}")
+    try:
+        cached = get_cached_summaries(email_ids)
+    except psycopg2.Error as e:
+        print(f"Could not read the summary cache: {e}", file=sys.stderr)
+        cached = {}
+    if len(cached) == len(set(email_ids)):
+        summaries = {str(email_id): summary for email_id, summary in cached.items()}
+        return jsonify({"status": "success", "summaries": summaries, "errors": {}, "cached": True}), 200
+
+    task = summarize_emails.delay(email_ids)
+    return jsonify({"task_id": task.id}), 202
+
 @app.route('/api/task-status/<string:task_id>', methods=['GET'])
 def get_task_status(task_id):
     """Checks the status of a Celery task."""
@@ -103,6 +181,30 @@ def get_task_status(task_id):
     }
     return jsonify(result)
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Exposes in-process counters for monitoring."""
+    return jsonify({
+        "db_pool": db.pool_stats(),
+        "query_cache": query_cache.stats(),
+        "encoder": encoder.stats(),
+        "models_loaded": {"embedding": embedding_model_loaded(), "llm": llm_loaded()},
+        "embedding_sidecar": sidecar_client().stats() if sidecar_client() else None,
+        "vector_index": vector_index.stats() if vector_index is not None else None,
+    })
+
+@app.route('/api/warmup', methods=['POST'])
+def warm_up_models():
+    """Loads the models now instead of on the first request."""
+    try:
+        return jsonify({"status": "ready", "seconds": warm_up()})
+    except Exception as e:
+        print(f"Warmup failed: {e}", file=sys.stderr)
+        return jsonify({"status": "error", "error": str(e)}), 500
+
+
+if WARMUP_ON_STARTUP:
+    print(f"Warmed up in {warm_up()} seconds.")
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001, debug=True)
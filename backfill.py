@@ -0,0 +1,183 @@
+"""
+Embedding backfill for stored emails that have no vector yet, e.g. the mail
+written by fetch_email.save_emails_to_db. Until a row has an embedding and
+tags it does not show up in /api/search.
+
+Rows are claimed in id order with FOR UPDATE SKIP LOCKED, so any number of
+workers (processes, hosts, the periodic Celery task) can run at once without
+processing the same email twice. Each worker stores the last id it finished
+in backfill_checkpoints, in the same transaction as the update, so a stopped
+worker resumes where it left off.
+
+    python backfill.py                  # one worker
+    python backfill.py --workers 4      # four processes
+    python backfill.py --embed-workers 8 --batch-size 2048   # one claimer, eight encoders
+"""
+import os
+import sys
+import time
+import pickle
+import argparse
+import multiprocessing
+
+import psycopg2
+from pgvector.psycopg2 import register_vector
+from embedding_backends import load_embedding_model
+
+from embedding_pool import ParallelEncoder, EMBED_WORKERS
+from embedding_sidecar import sidecar_client
+from ingest import (
+    StageStats, classify_batch, embed_batch, write_batch,
+    CLASSIFIER_FILE, EMBEDDING_MODEL_NAME, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT,
+)
+
+# --- Configuration ---
+BACKFILL_BATCH_SIZE = int(os.environ.get("BACKFILL_BATCH_SIZE", "256"))
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", "1"))
+
+CLAIM_SQL = """
+    SELECT id, sender, recipient, subject, body FROM emails
+    WHERE embedding IS NULL AND id > %s
+    ORDER BY id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+CHECKPOINT_SQL = """
+    INSERT INTO backfill_checkpoints (worker, last_id, processed, updated_at)
+    VALUES (%s, %s, %s, NOW())
+    ON CONFLICT (worker) DO UPDATE
+    SET last_id = EXCLUDED.last_id,
+        processed = backfill_checkpoints.processed + EXCLUDED.processed,
+        updated_at = NOW()
+"""
+
+def load_models(embedding_model=None):
+    """
+    Returns (classifier, embedding_model), loading whichever is not given.
+    The embedding sidecar, when configured, stands in for loading the model.
+    """
+    with open(CLASSIFIER_FILE, 'rb') as f:
+        classifier_model = pickle.load(f)
+    if embedding_model is None:
+        embedding_model = sidecar_client() or load_embedding_model()
+    return classifier_model, embedding_model
+
+def load_checkpoint(cur, worker):
+    cur.execute("SELECT last_id FROM backfill_checkpoints WHERE worker = %s", (worker,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+def claim_batch(cur, after_id, batch_size):
+    """Locks and returns up to `batch_size` emails without an embedding, after `after_id`."""
+    cur.execute(CLAIM_SQL, (after_id, batch_size))
+    return [
+        {"id": email_id, "sender": sender, "recipient": recipient, "subject": subject, "body": body}
+        for email_id, sender, recipient, subject, body in cur.fetchall()
+    ]
+
+def run_backfill(conn, classifier_model, embedding_model, worker="main", batch_size=BACKFILL_BATCH_SIZE,
+                 max_seconds=None):
+    """
+    Backfills emails until none are left to claim (or `max_seconds` have
+    passed) and returns the number of rows processed. When the keyset cursor
+    reaches the end it wraps around once to pick up rows that were locked by
+    other workers on the way.
+    """
+    stats = StageStats()
+    started_at = time.perf_counter()
+    total = 0
+    with conn.cursor() as cur:
+        last_id = load_checkpoint(cur, worker)
+        conn.commit()
+        while max_seconds is None or time.perf_counter() - started_at < max_seconds:
+            batch = claim_batch(cur, last_id, batch_size)
+            if not batch:
+                conn.rollback()
+                if last_id == 0:
+                    break
+                last_id = 0  # start the next pass from the beginning
+                continue
+
+            started = time.perf_counter()
+            categories = classify_batch(classifier_model, batch)
+            stats.record("classify", started, len(batch))
+
+            started = time.perf_counter()
+            embeddings = embed_batch(embedding_model, batch)
+            stats.record("embed", started, len(batch))
+
+            started = time.perf_counter()
+            write_batch(cur, batch, categories, embeddings)
+            last_id = batch[-1]["id"]
+            cur.execute(CHECKPOINT_SQL, (worker, last_id, len(batch)))
+            conn.commit()  # releases the row locks
+            stats.record("write", started, len(batch))
+
+            total += len(batch)
+            elapsed = time.perf_counter() - started_at
+            print(f"[{worker}] Backfilled {total} emails up to id {last_id} ({total / elapsed:,.1f} emails/sec)")
+
+    if total:
+        stats.report()
+    return total
+
+def connect():
+    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+    register_vector(conn)
+    return conn
+
+def worker_main(worker, batch_size, torch_threads, embed_workers=1):
+    """
+    Entry point of one backfill process. Returns the number of rows processed.
+    With `embed_workers` > 1 the encoding is spread over that many processes.
+    """
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)  # avoids oversubscribing the cores across processes
+    encoder = ParallelEncoder(EMBEDDING_MODEL_NAME, workers=embed_workers) if embed_workers > 1 else None
+    try:
+        classifier_model, embedding_model = load_models(encoder)
+        conn = connect()
+        try:
+            return run_backfill(conn, classifier_model, embedding_model, worker, batch_size)
+        finally:
+            conn.close()
+    finally:
+        if encoder is not None:
+            encoder.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed and tag stored emails that have no embedding yet.")
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument('--embed-workers', type=int, default=EMBED_WORKERS,
+                        help="Single database worker that encodes with this many processes")
+    args = parser.parse_args()
+    if args.workers > 1 and args.embed_workers > 1:
+        parser.error("use either --workers or --embed-workers, not both")
+
+    started = time.perf_counter()
+    try:
+        if args.workers <= 1:
+            total = worker_main("worker-0", args.batch_size, None, args.embed_workers)
+        else:
+            torch_threads = max(1, (os.cpu_count() or 1) // args.workers)
+            print(f"Starting {args.workers} backfill workers, {torch_threads} thread(s) each...")
+            jobs = [(f"worker-{i}", args.batch_size, torch_threads) for i in range(args.workers)]
+            with multiprocessing.get_context("spawn").Pool(args.workers) as pool:
+                total = sum(pool.starmap(worker_main, jobs))
+    except FileNotFoundError as e:
+        print(f"Error: File not found: {e.filename}. Run train_classifier.py first if the classifier is missing.",
+              file=sys.stderr)
+        sys.exit(1)
+    except psycopg2.Error as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    elapsed = time.perf_counter() - started
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(f"\nBackfill complete: {total} emails in {elapsed:.2f}s ({rate:,.1f} emails/sec).")
+
+if __name__ == "__main__":
+    main()
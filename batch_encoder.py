@@ -0,0 +1,116 @@
+import os
+import time
+import queue
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+# --- Configuration ---
+ENCODER_MAX_BATCH = int(os.getenv("ENCODER_MAX_BATCH", "32"))
+ENCODER_MAX_WAIT_MS = float(os.getenv("ENCODER_MAX_WAIT_MS", "5"))
+LATENCY_SAMPLES = 10000  # most recent request latencies kept for percentiles
+
+
+class MicroBatchEncoder:
+    """
+    Collects texts submitted by concurrent callers for up to `max_wait_ms`
+    (or until `max_batch_size` are waiting), encodes them with one
+    `encode_batch(texts)` call on a background thread, and hands each caller
+    its own vector.
+
+    `encode()` accepts a string or a list of strings like
+    SentenceTransformer.encode, so it can replace the model in app.py and
+    ingest.py.
+    """
+
+    def __init__(self, encode_batch, max_batch_size=ENCODER_MAX_BATCH, max_wait_ms=ENCODER_MAX_WAIT_MS):
+        self._encode_batch = encode_batch
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._batch_sizes = Counter()
+        self._requests = 0
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so a forked web worker starts its own.
+        if self._worker is not None and self._worker_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._worker is None or self._worker_pid != os.getpid():
+                self._queue = queue.Queue()
+                self._worker = threading.Thread(target=self._run, name="micro-batch-encoder", daemon=True)
+                self._worker_pid = os.getpid()
+                self._worker.start()
+
+    def submit(self, text):
+        """Queues one text and returns a Future for its embedding."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def encode(self, sentences, batch_size=None, timeout=None):
+        """
+        Returns the embedding of a string, or a 2-D array for a list of strings.
+        `batch_size` is accepted for compatibility and ignored; batching is
+        governed by `max_batch_size`.
+        """
+        if isinstance(sentences, str):
+            return self.submit(sentences).result(timeout)
+        futures = [self.submit(text) for text in sentences]
+        return np.stack([future.result(timeout) for future in futures]) if futures else np.empty((0, 0), dtype=np.float32)
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Drain whatever is already queued, then wait out the window
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            texts = [text for text, _, _ in batch]
+            try:
+                vectors = self._encode_batch(texts)
+                if len(vectors) != len(batch):
+                    # zip() would leave the unmatched futures waiting forever
+                    raise RuntimeError(f"encode_batch returned {len(vectors)} vectors for {len(batch)} texts")
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            for (_, future, submitted), vector in zip(batch, vectors):
+                future.set_result(vector)
+            with self._stats_lock:
+                self._requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._latencies.extend(finished - submitted for _, _, submitted in batch)
+
+    def stats(self):
+        """Returns request counts, p50/p99 latency in ms and the batch-size histogram."""
+        with self._stats_lock:
+            latencies_ms = np.array(self._latencies) * 1000
+            histogram = dict(sorted(self._batch_sizes.items()))
+            requests = self._requests
+        return {
+            "requests": requests,
+            "batches": sum(histogram.values()),
+            "latency_ms_p50": float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else None,
+            "latency_ms_p99": float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else None,
+            "batch_size_histogram": histogram,
+        }
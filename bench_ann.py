@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+from pgvector.psycopg2 import register_vector
+
+# --- Configuration ---
+load_dotenv()
+
+DB_NAME = os.getenv("DB_NAME", "email_db")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "mysecretpassword")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5433")
+
+SEARCH_SQL = "SELECT id FROM emails ORDER BY embedding <=> %s LIMIT %s"
+
+def detect_index_method(cur):
+    """Returns 'hnsw', 'ivfflat' or None for the index on emails.embedding."""
+    cur.execute("SELECT indexdef FROM pg_indexes WHERE tablename = 'emails' AND indexdef ILIKE '%(embedding%'")
+    for (indexdef,) in cur.fetchall():
+        for method in ('hnsw', 'ivfflat'):
+            if f"USING {method}" in indexdef:
+                return method
+    return None
+
+def sample_queries(cur, count):
+    """Uses stored embeddings as query vectors so no model is needed."""
+    cur.execute("SELECT embedding FROM emails WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s", (count,))
+    return [row[0] for row in cur.fetchall()]
+
+def timed_search(conn, vector, k, settings):
+    """Runs one top-k search with the given SET LOCAL settings; returns (ids, seconds)."""
+    with conn.cursor() as cur:
+        for name, value in settings:
+            cur.execute(f"SET LOCAL {name} = {value}")
+        started = time.perf_counter()
+        cur.execute(SEARCH_SQL, (vector, k))
+        ids = [row[0] for row in cur.fetchall()]
+        elapsed = time.perf_counter() - started
+    conn.rollback()
+    return ids, elapsed
+
+def report_row(label, latencies, recall):
+    latencies_ms = np.array(latencies) * 1000
+    print(f"  {label:<22} recall@k={recall:6.3f}   p50={np.percentile(latencies_ms, 50):8.2f}ms   "
+          f"p95={np.percentile(latencies_ms, 95):8.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs. latency of the ANN index against an exact scan.")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--ef-search', default="10,20,40,80,160,320")
+    parser.add_argument('--probes', default="1,5,10,20,50,100")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+    register_vector(conn)
+    try:
+        with conn.cursor() as cur:
+            method = detect_index_method(cur)
+            queries = sample_queries(cur, args.queries)
+        conn.rollback()
+
+        if not queries:
+            print("No embedded emails found. Run ingest.py first.", file=sys.stderr)
+            return
+        if method is None:
+            print("No vector index on emails.embedding. Run setup_db.py first.", file=sys.stderr)
+            return
+
+        print(f"Benchmarking {method} index with {len(queries)} queries, k={args.k}\n")
+
+        # Ground truth: exact scan with index scans disabled
+        exact_results = []
+        exact_latencies = []
+        for vector in queries:
+            ids, elapsed = timed_search(conn, vector, args.k, [("enable_indexscan", "off")])
+            exact_results.append(set(ids))
+            exact_latencies.append(elapsed)
+        report_row("exact scan", exact_latencies, 1.0)
+
+        setting, values = ("hnsw.ef_search", args.ef_search) if method == 'hnsw' else ("ivfflat.probes", args.probes)
+        for value in (int(v) for v in values.split(',')):
+            latencies = []
+            hits = 0
+            for vector, expected in zip(queries, exact_results):
+                ids, elapsed = timed_search(conn, vector, args.k, [(setting, value)])
+                latencies.append(elapsed)
+                hits += len(expected.intersection(ids))
+            recall = hits / max(sum(len(expected) for expected in exact_results), 1)
+            report_row(f"{setting}={value}", latencies, recall)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
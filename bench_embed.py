@@ -0,0 +1,64 @@
+"""
+Embedding throughput by worker count, to size EMBED_WORKERS for backfills
+and reindexes on a CPU-only host:
+
+    python bench_embed.py --emails 20000 --workers 1,2,4,8
+
+The texts come from mails.csv (repeated up to --emails) and are prepared the
+way ingest.py prepares them. Every configuration is checked against the
+single-process model, so a speedup never comes from different vectors.
+"""
+import os
+import time
+import argparse
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from embedding_pool import ParallelEncoder, EMBEDDING_MODEL_NAME, EMBED_BATCH_SIZE
+from ingest import iter_csv_emails, preprocess_text, CSV_FILE
+
+def load_texts(path, count):
+    emails = list(iter_csv_emails(path))
+    texts = [
+        f"Subject: {preprocess_text(email['subject'])} Body: {preprocess_text(email['body'])}"
+        for email in emails
+    ]
+    return [texts[i % len(texts)] for i in range(count)]
+
+def timed(encode, texts):
+    started = time.perf_counter()
+    embeddings = encode(texts)
+    return embeddings, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Emails/sec of the embedding model by worker count.")
+    parser.add_argument('--csv-path', default=CSV_FILE)
+    parser.add_argument('--emails', type=int, default=10000)
+    parser.add_argument('--workers', default=",".join(str(n) for n in (1, 2, 4, 8)))
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help="Default: the host's cores divided by the worker count")
+    args = parser.parse_args()
+
+    texts = load_texts(args.csv_path, args.emails)
+    print(f"{len(texts)} emails, {os.cpu_count()} CPU(s), model '{EMBEDDING_MODEL_NAME}'\n")
+
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+    model.encode(texts[:EMBED_BATCH_SIZE], batch_size=EMBED_BATCH_SIZE)  # warm up
+    reference, seconds = timed(lambda batch: model.encode(batch, batch_size=EMBED_BATCH_SIZE), texts)
+    baseline = len(texts) / seconds
+
+    print(f"{'configuration':<28} {'emails/sec':>11} {'speedup':>8} {'max |diff|':>11}")
+    print(f"{'in-process':<28} {baseline:>11,.1f} {1.0:>7.2f}x {0.0:>11.2e}")
+    for workers in (int(n) for n in args.workers.split(',')):
+        with ParallelEncoder(EMBEDDING_MODEL_NAME, workers=workers,
+                             threads_per_worker=args.threads_per_worker) as encoder:
+            encoder.encode(texts[:workers * EMBED_BATCH_SIZE])  # loads the model in every worker
+            embeddings, seconds = timed(encoder.encode, texts)
+            rate = len(texts) / seconds
+            label = f"{workers} worker(s) x {encoder.threads_per_worker} thread(s)"
+            difference = np.abs(embeddings - reference).max()
+            print(f"{label:<28} {rate:>11,.1f} {rate / baseline:>7.2f}x {difference:>11.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Load test for /api/search, to compare the Flask and FastAPI servers at equal
+worker counts. Start both with the same number of workers, e.g.
+
+    gunicorn -w 4 --threads 8 -b :5001 app:app
+    uvicorn main:app --workers 4 --port 8000
+
+then run
+
+    python bench_http.py http://localhost:5001 http://localhost:8000 --concurrency 32
+"""
+import json
+import time
+import argparse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+QUERIES = [
+    "invoice",
+    "security alert",
+    "subscription renewal",
+    "project phoenix update",
+    "meeting notes from last week",
+    "password reset",
+    "shipping confirmation for my order",
+    "quarterly report",
+]
+
+def post_search(base_url, query, timeout):
+    """Sends one search and returns (ok, seconds)."""
+    request = urllib.request.Request(
+        f"{base_url}/api/search",
+        data=json.dumps({"query": query}).encode('utf-8'),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    return ok, time.perf_counter() - started
+
+def run_load(base_url, requests, concurrency, timeout):
+    """Fires `requests` searches with `concurrency` in flight and returns the measurements."""
+    queries = [QUERIES[i % len(QUERIES)] for i in range(requests)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda query: post_search(base_url, query, timeout), queries))
+    elapsed = time.perf_counter() - started
+
+    latencies_ms = np.array([seconds for ok, seconds in results if ok]) * 1000
+    errors = sum(1 for ok, _ in results if not ok)
+    return {
+        "throughput": (requests - errors) / elapsed,
+        "p50": np.percentile(latencies_ms, 50) if len(latencies_ms) else float('nan'),
+        "p99": np.percentile(latencies_ms, 99) if len(latencies_ms) else float('nan'),
+        "errors": errors,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare /api/search throughput and latency across servers.")
+    parser.add_argument('urls', nargs='+', help="Base URLs, e.g. http://localhost:5001 http://localhost:8000")
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}\n")
+    print(f"{'server':<30} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for url in args.urls:
+        run_load(url, args.warmup, min(args.concurrency, args.warmup), args.timeout)
+        result = run_load(url, args.requests, args.concurrency, args.timeout)
+        print(f"{url:<30} {result['throughput']:>9.1f} {result['p50']:>9.1f} {result['p99']:>9.1f} {result['errors']:>7}")
+
+if __name__ == "__main__":
+    main()
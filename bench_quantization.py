@@ -0,0 +1,109 @@
+"""
+Index size, latency and recall of the compact vector indexes (schema.py)
+against the full-precision one. Build the indexes to compare first:
+
+    python setup_db.py reindex --quantization halfvec
+    python setup_db.py reindex --quantization binary
+    python bench_quantization.py --queries 200
+
+Queries run through search.search_plan, so latency includes the exact
+re-rank of the shortlist. Recall@k is measured against an exact scan.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+from pgvector.psycopg2 import register_vector
+
+import search
+from schema import VECTOR_QUANTIZATIONS, vector_index_name
+
+# --- Configuration ---
+load_dotenv()
+
+DB_NAME = os.getenv("DB_NAME", "email_db")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "mysecretpassword")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5433")
+
+EXACT_SQL = "SELECT id FROM emails ORDER BY embedding <=> %s LIMIT %s"
+
+def index_size(cur, name):
+    """Bytes used by index `name`, including its per-partition indexes; None if it does not exist."""
+    cur.execute("SELECT to_regclass(%s)", (name,))
+    if cur.fetchone()[0] is None:
+        return None
+    cur.execute("SELECT COALESCE(SUM(pg_relation_size(relid)), 0) FROM pg_partition_tree(%s::regclass)", (name,))
+    return int(cur.fetchone()[0])
+
+def sample_queries(cur, count):
+    """Uses stored embeddings as query vectors so no model is needed."""
+    cur.execute("SELECT embedding FROM emails WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s", (count,))
+    return [row[0] for row in cur.fetchall()]
+
+def exact_ids(conn, vector, k):
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL enable_indexscan = off")
+        cur.execute(EXACT_SQL, (vector, k))
+        ids = [row[0] for row in cur.fetchall()]
+    conn.rollback()
+    return ids
+
+def timed_search(conn, vector, options):
+    """Runs one search plan; returns (ids, seconds)."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        started = time.perf_counter()
+        rows = search.run_plan(cur, search.search_plan(vector, options))
+        elapsed = time.perf_counter() - started
+    conn.rollback()
+    return [row['id'] for row in rows], elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Size, latency and recall@k of the compact vector indexes.")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--quantizations', default=",".join(VECTOR_QUANTIZATIONS))
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+    register_vector(conn)
+    try:
+        with conn.cursor() as cur:
+            queries = sample_queries(cur, args.queries)
+            cur.execute("SHOW shared_buffers")
+            shared_buffers = cur.fetchone()[0]
+            sizes = {quantization: index_size(cur, vector_index_name(quantization))
+                     for quantization in args.quantizations.split(',')}
+        conn.rollback()
+
+        if not queries:
+            print("No embedded emails found. Run ingest.py first.", file=sys.stderr)
+            return
+        print(f"{len(queries)} queries, k={args.k}, shared_buffers={shared_buffers}\n")
+
+        truth = [set(exact_ids(conn, vector, args.k)) for vector in queries]
+        print(f"{'quantization':<13} {'index MiB':>10} {'oversample':>11} {'p50 ms':>8} {'p95 ms':>8} {'recall@k':>9}")
+        for quantization, size in sizes.items():
+            if size is None:
+                print(f"{quantization:<13} no index (python setup_db.py reindex --quantization {quantization})")
+                continue
+            options = search.parse_search_options({"query": "benchmark", "limit": args.k, "quantization": quantization})
+            latencies = []
+            hits = 0
+            for vector, expected in zip(queries, truth):
+                ids, elapsed = timed_search(conn, vector, options)
+                latencies.append(elapsed * 1000)
+                hits += len(expected.intersection(ids))
+            recall = hits / max(sum(len(expected) for expected in truth), 1)
+            print(f"{quantization:<13} {size / 2**20:>10,.1f} {search.QUANTIZED_OVERSAMPLE[quantization]:>10}x "
+                  f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f} {recall:>9.3f}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Search latency benchmark against a synthetic mailbox.
+
+Point it at a scratch database so the real mailbox is untouched, e.g.
+
+    DB_NAME=email_db_bench python setup_db.py
+    DB_NAME=email_db_bench python bench_search.py --seed 1000000
+    DB_NAME=email_db_bench python setup_db.py reindex
+    DB_NAME=email_db_bench python bench_search.py --budget-ms 100
+
+Vectors are random, so absolute recall is pessimistic compared to real
+embeddings; latency is what this measures. Queries go through search.py,
+so the benchmark runs exactly the SQL the API runs.
+"""
+import os
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+from pgvector.psycopg2 import register_vector
+
+import search
+from schema import VECTOR_DIMENSION
+
+# --- Configuration ---
+load_dotenv()
+
+DB_NAME = os.getenv("DB_NAME", "email_db")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "mysecretpassword")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5433")
+
+SEED_CHUNK = 50000
+CATEGORIES = ['security', 'billing', 'newsletter', 'work', 'personal', 'shipping']
+
+# Synthetic rows: senders from a few thousand addresses, subjects and bodies
+# with invoice/order numbers, random unit-ish vectors generated server-side.
+SEED_SQL = f"""
+    INSERT INTO emails (sender, recipient, subject, body, "timestamp", tags, embedding)
+    SELECT
+        'user' || (g %% 5000) || '@example' || (g %% 50) || '.com',
+        'me@example.com',
+        (ARRAY['Invoice', 'Order', 'Security alert', 'Weekly digest', 'Meeting'])[1 + g %% 5] || ' INV-' || g,
+        'Reference ORD-' || (g * 7) || ' regarding project ' || (g %% 997) || '. Please review the attached details.',
+        NOW() - ((g %% 730) || ' days')::interval,
+        ARRAY[(ARRAY{CATEGORIES!r})[1 + g %% {len(CATEGORIES)}]],
+        ARRAY(SELECT random() - 0.5 FROM generate_series(1, {VECTOR_DIMENSION}) WHERE g > 0)::vector
+    FROM generate_series(%s, %s) AS g
+"""
+
+QUERY_TEXTS = [
+    "invoice INV-{n}",
+    "ORD-{n}",
+    "user{m}@example{k}.com",
+    "security alert",
+    "weekly digest project {m}",
+]
+
+def random_sender(rng):
+    n = rng.randrange(5000)
+    return f"user{n}@example{n % 50}.com"  # matches the seeded sender pattern
+
+# Filters from unselective (one tag in six, ANN + post-filter) to very
+# selective (one sender in 5000, exact pre-filter)
+FILTER_SCENARIOS = [
+    ("", lambda rng: {}),
+    (" +tag", lambda rng: {"tags": [rng.choice(CATEGORIES)]}),
+    (" +last-30-days", lambda rng: {"date_from": (datetime.now() - timedelta(days=30)).date().isoformat()}),
+    (" +sender", lambda rng: {"sender": random_sender(rng)}),
+]
+
+def seed(conn, rows):
+    """Appends `rows` synthetic emails in chunks."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM emails")
+        start = cur.fetchone()[0] + 1
+        for chunk_start in range(start, start + rows, SEED_CHUNK):
+            chunk_end = min(chunk_start + SEED_CHUNK, start + rows) - 1
+            cur.execute(SEED_SQL, (chunk_start, chunk_end))
+            conn.commit()
+            print(f"  Seeded rows up to {chunk_end}...")
+        cur.execute("ANALYZE emails")
+    conn.commit()
+
+def random_request(rng, row_count, **extra):
+    n = rng.randint(1, max(row_count, 1))
+    text = rng.choice(QUERY_TEXTS).format(n=n, m=n % 5000, k=n % 50)
+    return dict({"query": text}, **extra)
+
+def benchmark(conn, requests, rng):
+    """Runs each request through search.py and returns latencies in ms."""
+    latencies = []
+    for body in requests:
+        options = search.parse_search_options(body)
+        vector = np.random.default_rng(rng.getrandbits(32)).random(VECTOR_DIMENSION, dtype=np.float32) - 0.5
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            started = time.perf_counter()
+            search.run_plan(cur, search.search_plan(vector, options))
+            latencies.append((time.perf_counter() - started) * 1000)
+        conn.rollback()
+    return np.array(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description="Search latency on a synthetic mailbox.")
+    parser.add_argument('--seed', type=int, default=0, help="Append this many synthetic emails first")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--budget-ms', type=float, default=100.0, help="p95 latency budget")
+    parser.add_argument('--modes', default=",".join(search.SEARCH_MODES))
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+    register_vector(conn)
+    try:
+        if args.seed:
+            print(f"Seeding {args.seed} synthetic emails into '{DB_NAME}'...")
+            seed(conn, args.seed)
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = 'emails'")
+            row_count = cur.fetchone()[0]
+        conn.rollback()
+        print(f"\n~{row_count:,} emails, {args.queries} queries per mode, p95 budget {args.budget_ms:.0f}ms\n")
+
+        rng = random.Random(42)
+        print(f"{'scenario':<24} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  budget")
+        for mode in args.modes.split(','):
+            for label, filters in FILTER_SCENARIOS:
+                requests = [
+                    random_request(rng, row_count, mode=mode, **filters(rng))
+                    for _ in range(args.queries)
+                ]
+                benchmark(conn, requests[:10], rng)  # warm caches
+                latencies = benchmark(conn, requests, rng)
+                p95 = np.percentile(latencies, 95)
+                verdict = "OK" if p95 <= args.budget_ms else "OVER"
+                print(f"{mode + label:<24} {np.percentile(latencies, 50):>9.2f} {p95:>9.2f} "
+                      f"{np.percentile(latencies, 99):>9.2f}  {verdict}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+What the embedding sidecar saves and costs:
+
+    python bench_sidecar.py --web-workers 4
+
+  - memory: the RSS of a worker process (importing --module and encoding one
+    query) with its own model and with the sidecar, and the host total for
+    --web-workers such workers plus the sidecar
+  - latency: single-query and bulk encode through the socket compared with
+    the in-process model, i.e. the added IPC cost
+
+A sidecar is started on a temporary socket unless --socket names a running one.
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+from embedding_backends import get_embedding_model, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+from embedding_sidecar import SidecarEncoder, SidecarError
+from ingest import iter_csv_emails, preprocess_text, CSV_FILE
+
+QUERIES = [
+    "invoice",
+    "security alert",
+    "subscription renewal",
+    "project phoenix update",
+    "meeting notes from last week",
+    "password reset",
+    "shipping confirmation for my order",
+    "quarterly report",
+]
+BULK_SIZE = 256
+STARTUP_TIMEOUT = 300  # seconds for the sidecar to load its model
+
+# Run in a fresh interpreter: import the module, encode once, report peak RSS in KiB
+WORKER_SNIPPET = """
+import resource
+import {module}
+from embedding_sidecar import get_encoder
+get_encoder().encode("warm up")
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+def rss_mib(pid):
+    """Current resident set size of `pid` from /proc (Linux)."""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+def worker_rss_mib(module, socket_path):
+    env = dict(os.environ, EMBEDDING_SIDECAR_SOCKET=socket_path, WARMUP_ON_STARTUP="false")
+    result = subprocess.run([sys.executable, "-c", WORKER_SNIPPET.format(module=module)],
+                            env=env, capture_output=True, text=True, check=True)
+    return int(result.stdout.strip().splitlines()[-1]) / 1024
+
+def start_sidecar(socket_path):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_sidecar.py")
+    process = subprocess.Popen([sys.executable, script, "--socket", socket_path])
+    client = SidecarEncoder(socket_path, fallback=None)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while True:
+        try:
+            client.encode("ready")
+            return process
+        except SidecarError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise
+            time.sleep(0.5)
+
+def latencies_ms(encode, queries):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        encode(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return np.array(latencies)
+
+def bulk_rate(encode, texts):
+    started = time.perf_counter()
+    embeddings = encode(texts)
+    return embeddings, len(texts) / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory saved and latency added by the embedding sidecar.")
+    parser.add_argument('--socket', help="Use this running sidecar instead of starting one")
+    parser.add_argument('--module', default="app", help="What a worker imports: app, main, ingest, backfill")
+    parser.add_argument('--web-workers', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--csv-path', default=CSV_FILE)
+    args = parser.parse_args()
+
+    socket_path = args.socket or os.path.join(tempfile.mkdtemp(prefix="sidecar-bench-"), "embed.sock")
+    sidecar = None if args.socket else start_sidecar(socket_path)
+    try:
+        print(f"Model '{EMBEDDING_MODEL_NAME}' ({EMBEDDING_BACKEND} backend), workers import '{args.module}'\n")
+
+        # --- Memory ---
+        own_model = worker_rss_mib(args.module, "")
+        with_sidecar = worker_rss_mib(args.module, socket_path)
+        sidecar_mib = rss_mib(sidecar.pid) if sidecar else None
+        print(f"{'worker RSS, own model':<32} {own_model:>9,.0f} MiB")
+        print(f"{'worker RSS, sidecar client':<32} {with_sidecar:>9,.0f} MiB")
+        print(f"{'saved per worker':<32} {own_model - with_sidecar:>9,.0f} MiB")
+        if sidecar_mib is not None:
+            n = args.web_workers
+            print(f"{'sidecar RSS':<32} {sidecar_mib:>9,.0f} MiB")
+            print(f"{f'{n} workers, own models':<32} {n * own_model:>9,.0f} MiB")
+            print(f"{f'{n} workers + sidecar':<32} {n * with_sidecar + sidecar_mib:>9,.0f} MiB")
+
+        # --- Latency ---
+        model = get_embedding_model()
+        client = SidecarEncoder(socket_path, fallback=None)
+        queries = [QUERIES[i % len(QUERIES)] for i in range(args.queries)]
+        model.encode(QUERIES)  # warm up
+        local = latencies_ms(model.encode, queries)
+        remote = latencies_ms(client.encode, queries)
+        print(f"\n{'single query':<14} {'p50 ms':>8} {'p95 ms':>8}")
+        print(f"{'in-process':<14} {np.percentile(local, 50):>8.2f} {np.percentile(local, 95):>8.2f}")
+        print(f"{'sidecar':<14} {np.percentile(remote, 50):>8.2f} {np.percentile(remote, 95):>8.2f}")
+        print(f"{'added':<14} {np.percentile(remote, 50) - np.percentile(local, 50):>8.2f} "
+              f"{np.percentile(remote, 95) - np.percentile(local, 95):>8.2f}")
+
+        texts = [
+            f"Subject: {preprocess_text(email['subject'])} Body: {preprocess_text(email['body'])}"
+            for email in iter_csv_emails(args.csv_path)
+        ][:BULK_SIZE]
+        reference, local_rate = bulk_rate(lambda batch: model.encode(batch, batch_size=32), texts)
+        embeddings, remote_rate = bulk_rate(client.encode, texts)
+        print(f"\nbulk {len(texts)} emails: in-process {local_rate:,.1f}/s, sidecar {remote_rate:,.1f}/s, "
+              f"max |diff| {np.abs(embeddings - reference).max():.2e}")
+    finally:
+        if sidecar is not None:
+            sidecar.send_signal(signal.SIGINT)  # lets it remove its socket
+            sidecar.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Cold-start cost of importing the app modules, measured with
+`python -X importtime` in a fresh interpreter per module:
+
+    python bench_startup.py                      # this checkout
+    python bench_startup.py --baseline HEAD~1    # and an older revision, side by side
+
+The baseline revision is checked out into a temporary git worktree, so the
+working tree is not touched. Importing must not need the database, Redis or
+Ollama; in a revision that loads models at import that cost is included.
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+MODULES = ["app", "main", "tasks", "ingest", "backfill"]
+TOP_IMPORTS = 5
+
+def parse_importtime(stderr):
+    """Returns [(cumulative_us, depth, module)] from -X importtime output, in output order."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name[1:]  # one separator space, the rest is two spaces per nesting level
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((int(cumulative), depth, name.strip()))
+    return entries
+
+def direct_imports(entries, module):
+    """The (cumulative_us, name) imports made directly by `module`, heaviest first."""
+    index = next(i for i, (_, depth, name) in enumerate(entries) if depth == 0 and name == module)
+    children = []
+    # Children are printed before their parent, back to the previous top-level entry
+    for cumulative, depth, name in reversed(entries[:index]):
+        if depth == 0:
+            break
+        if depth == 1:
+            children.append((cumulative, name))
+    return sorted(children, reverse=True)
+
+def measure(module, cwd):
+    """Imports `module` in a new interpreter. Returns (import seconds, heaviest direct imports) or None."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True,
+        env=dict(os.environ, WARMUP_ON_STARTUP="false"),
+    )
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"
+        print(f"  {module}: import failed: {error}", file=sys.stderr)
+        return None
+    entries = parse_importtime(result.stderr)
+    total = next(cumulative for cumulative, depth, name in entries if depth == 0 and name == module)
+    return total / 1e6, direct_imports(entries, module)[:TOP_IMPORTS]
+
+def measure_all(cwd, modules):
+    return {module: measure(module, cwd) for module in modules}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare module import times, optionally against another revision.")
+    parser.add_argument('--baseline', help="git revision to compare with, e.g. HEAD~1")
+    parser.add_argument('--modules', default=",".join(MODULES))
+    args = parser.parse_args()
+    modules = args.modules.split(',')
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    current = measure_all(here, modules)
+    baseline = {}
+    if args.baseline:
+        worktree = tempfile.mkdtemp(prefix="startup-baseline-")
+        subprocess.run(["git", "worktree", "add", "--detach", worktree, args.baseline], cwd=here, check=True,
+                       capture_output=True)
+        try:
+            # Local files the imports may read (.env, a retrained classifier)
+            for name in ("category_classifier.pkl", "vectorizer.pkl", ".env"):
+                if os.path.exists(os.path.join(here, name)) and not os.path.exists(os.path.join(worktree, name)):
+                    shutil.copy(os.path.join(here, name), worktree)
+            baseline = measure_all(worktree, modules)
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", worktree], cwd=here, capture_output=True)
+
+    print(f"\n{'module':<10} {'import s':>9}" + (f" {'baseline s':>11} {'speedup':>8}" if args.baseline else ""))
+    for module in modules:
+        if current[module] is None:
+            continue
+        seconds, _ = current[module]
+        line = f"{module:<10} {seconds:>9.3f}"
+        if baseline.get(module):
+            before = baseline[module][0]
+            line += f" {before:>11.3f} {before / seconds:>7.1f}x"
+        print(line)
+
+    print("\nHeaviest direct imports (cumulative):")
+    for module in modules:
+        if current[module] is None:
+            continue
+        heaviest = ", ".join(f"{name} {cumulative / 1e6:.2f}s" for cumulative, name in current[module][1])
+        print(f"  {module:<10} {heaviest}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Peak memory and throughput of the in-memory TF-IDF training against the
+streaming (hashing + partial_fit) mode of train_classifier.py, on mails.csv
+repeated up to --rows records:
+
+    python bench_train.py --rows 1000000,3000000
+
+Each run is a fresh process in a temporary directory, so the peak memory is
+the run's own and the repository's model files are left alone.
+"""
+import os
+import re
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import pandas as pd
+
+from train_classifier import DATA_FILE, STREAM_CHUNK_SIZE
+
+REPORT_LINE = re.compile(r"Trained on (\d+) records in ([\d.]+)s \(([\d,.]+) records/sec\), peak memory ([\d,.]+) MB")
+
+def write_dataset(source, path, rows):
+    """Repeats `source` until the file at `path` holds `rows` records, writing chunk by chunk."""
+    records = pd.read_csv(source).dropna(subset=['text', 'category'])
+    written = 0
+    with open(path, 'w', newline='') as f:
+        while written < rows:
+            chunk = records.iloc[:rows - written]
+            chunk.to_csv(f, header=written == 0, index=False)
+            written += len(chunk)
+
+def run(directory, data_file, streaming, chunk_size):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train_classifier.py")
+    command = [sys.executable, script, "--data-file", data_file, "--chunk-size", str(chunk_size)]
+    if streaming:
+        command.append("--streaming")
+    result = subprocess.run(command, cwd=directory, capture_output=True, text=True)
+    match = REPORT_LINE.search(result.stdout)
+    if not match:
+        print(result.stdout[-500:] + result.stderr[-500:], file=sys.stderr)
+        return None
+    return float(match.group(2)), float(match.group(3).replace(',', '')), float(match.group(4).replace(',', ''))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare in-memory and streaming classifier training.")
+    parser.add_argument('--rows', default="100000,1000000")
+    parser.add_argument('--data-file', default=DATA_FILE)
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="train-bench-")
+    try:
+        print(f"{'records':>10} {'mode':<10} {'seconds':>8} {'records/sec':>12} {'peak MB':>9}")
+        for rows in (int(n) for n in args.rows.split(',')):
+            data_file = os.path.join(directory, f"mails_{rows}.csv")
+            write_dataset(args.data_file, data_file, rows)
+            for label, streaming in (("in-memory", False), ("streaming", True)):
+                result = run(directory, data_file, streaming, args.chunk_size)
+                if result is None:
+                    print(f"{rows:>10} {label:<10} failed")
+                    continue
+                seconds, rate, peak = result
+                print(f"{rows:>10} {label:<10} {seconds:>8.2f} {rate:>12,.1f} {peak:>9,.1f}")
+            os.remove(data_file)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
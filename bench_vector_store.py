@@ -0,0 +1,106 @@
+"""
+Latency and recall@k of the in-process memory-mapped index (vector_store.py)
+against the pgvector search path, on the same stored embeddings:
+
+    python vector_store.py export --dtype float16
+    python bench_vector_store.py --queries 200
+
+Both paths run the plans app.py runs, so both include the fetch of the page's
+rows. 'rank only' is the NumPy top-k alone. Recall@k is against an exact scan
+in Postgres.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+from pgvector.psycopg2 import register_vector
+
+import search
+from vector_store import MmapVectorIndex, VECTOR_STORE_PATH
+
+# --- Configuration ---
+load_dotenv()
+
+DB_NAME = os.getenv("DB_NAME", "email_db")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "mysecretpassword")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5433")
+
+EXACT_SQL = "SELECT id FROM emails ORDER BY embedding <=> %s LIMIT %s"
+
+def sample_queries(cur, count):
+    """Uses stored embeddings as query vectors so no model is needed."""
+    cur.execute("SELECT embedding FROM emails WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s", (count,))
+    return [row[0] for row in cur.fetchall()]
+
+def exact_ids(conn, vector, k):
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL enable_indexscan = off")
+        cur.execute(EXACT_SQL, (vector, k))
+        ids = [row[0] for row in cur.fetchall()]
+    conn.rollback()
+    return ids
+
+def timed(run, queries, truth):
+    """Runs `run(vector)` -> ids for every query; returns (latencies in ms, recall)."""
+    latencies = []
+    hits = 0
+    for vector, expected in zip(queries, truth):
+        started = time.perf_counter()
+        ids = run(vector)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += len(expected.intersection(ids))
+    return np.array(latencies), hits / max(sum(len(expected) for expected in truth), 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped NumPy search vs. pgvector.")
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--path', default=VECTOR_STORE_PATH)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+    register_vector(conn)
+    try:
+        with conn.cursor() as cur:
+            queries = sample_queries(cur, args.queries)
+        conn.rollback()
+        if not queries:
+            print("No embedded emails found. Run ingest.py first.", file=sys.stderr)
+            return
+
+        started = time.perf_counter()
+        index = MmapVectorIndex(args.path, refresh_interval=0)
+        stats = index.stats()
+        print(f"{len(queries)} queries, k={args.k}; mmap index of {stats['rows']} rows ({stats['dtype']}) "
+              f"mapped in {(time.perf_counter() - started) * 1000:.1f} ms\n")
+
+        truth = [set(exact_ids(conn, vector, args.k)) for vector in queries]
+        options = search.parse_search_options({"query": "benchmark", "limit": args.k})
+
+        def run_plan(plan):
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                rows = search.run_plan(cur, plan)
+            conn.rollback()
+            return [row['id'] for row in rows]
+
+        paths = [
+            ("pgvector", lambda vector: run_plan(search.search_plan(vector, options))),
+            ("mmap", lambda vector: run_plan(search.local_index_plan(index, vector, options))),
+            ("mmap rank only", lambda vector: [email_id for email_id, _ in index.search(vector, args.k)]),
+        ]
+        index.search(queries[0], args.k)  # page in the matrix
+        print(f"{'path':<16} {'p50 ms':>8} {'p95 ms':>8} {'recall@k':>9}")
+        for label, run in paths:
+            latencies, recall = timed(run, queries, truth)
+            print(f"{label:<16} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f} {recall:>9.3f}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from dotenv import load_dotenv
+from pgvector.psycopg2 import register_vector
+
+# --- Configuration ---
+load_dotenv()
+
+DB_NAME = os.getenv("DB_NAME", "email_db")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "mysecretpassword")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5433")
+
+# Pool sizing. Flask threads share one pool per process; each Celery prefork
+# child builds its own on first use. DB_POOL_MIN connections are opened up
+# front; up to DB_POOL_MAX are opened on demand and then kept.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))           # seconds to wait for a free connection
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "30"))  # idle seconds before a health check
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Raised when no pooled connection became free within the timeout."""
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of psycopg2 connections. Callers block for up to
+    `timeout` seconds when every connection is in use, pgvector types are
+    registered once per physical connection, and connections that sat idle for
+    longer than `check_after` seconds are pinged before being handed out.
+    Returned connections stay open (up to `maxconn`) and the most recently
+    used one is handed out first.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, check_after, **connect_kwargs):
+        self._connect_kwargs = connect_kwargs
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+        self._check_after = check_after
+        self._lock = threading.Lock()
+        # (conn, monotonic time it was returned) of the idle connections; the
+        # time is None until pgvector is registered on the connection. Each
+        # physical connection is either here or checked out, and a new one is
+        # only opened under a slot when this is empty, so at most maxconn exist.
+        self._idle = [(psycopg2.connect(**connect_kwargs), None) for _ in range(min(minconn, maxconn))]
+        self.maxconn = maxconn
+        self._stats = {
+            "checkouts": 0,
+            "in_use": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def _checkout(self):
+        """Returns (conn, last_used): the most recently returned idle connection, or a new one."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return psycopg2.connect(**self._connect_kwargs), None
+
+    def _prepare(self, conn, last_used):
+        """Registers pgvector on new connections and pings stale ones."""
+        try:
+            if last_used is None:
+                register_vector(conn)
+                conn.commit()
+            elif time.monotonic() - last_used >= self._check_after:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            return conn
+        except psycopg2.Error:
+            self._discard(conn)
+            if last_used is None:
+                raise
+            with self._lock:
+                self._stats["health_check_failures"] += 1
+            return self._prepare(*self._checkout())
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """Yields a pooled connection and returns it afterwards. Uncommitted work is rolled back."""
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self._timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(f"No database connection available within {self._timeout}s")
+        waited = time.perf_counter() - started
+
+        try:
+            conn = self._prepare(*self._checkout())
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+
+        broken = False
+        try:
+            yield conn
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        finally:
+            try:
+                if conn.closed or broken:
+                    self._discard(conn)
+                else:
+                    conn.rollback()
+                    with self._lock:
+                        self._idle.append((conn, time.monotonic()))
+            except psycopg2.Error:
+                self._discard(conn)
+            finally:
+                with self._lock:
+                    self._stats["in_use"] -= 1
+                self._slots.release()
+
+    def stats(self):
+        """Returns a snapshot of the pool metrics."""
+        with self._lock:
+            snapshot = dict(self._stats)
+        checkouts = snapshot["checkouts"]
+        snapshot["wait_seconds_avg"] = snapshot["wait_seconds_total"] / checkouts if checkouts else 0.0
+        snapshot["max_size"] = self.maxconn
+        with self._lock:
+            snapshot["idle"] = len(self._idle)
+        return snapshot
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# Pools inherited through fork. Their connections' sockets are shared with
+# the parent, and garbage-collecting them would close those connections
+# (PQfinish) under the parent, so they are kept referenced for the life of
+# the process and never used.
+_inherited_pools = []
+
+def get_pool():
+    """
+    Returns this process's pool, creating it on first use. A pool inherited
+    through fork (Celery prefork, gunicorn) is set aside in _inherited_pools
+    rather than released: freeing its connections would close the parent's
+    sessions.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                if _pool is not None:
+                    _inherited_pools.append(_pool)
+                _pool = ConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_CHECK_AFTER,
+                    dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+def connection():
+    """Shortcut for `get_pool().connection()`."""
+    return get_pool().connection()
+
+def pool_stats():
+    """Returns the metrics of this process's pool, or None if it was never used."""
+    if _pool is None or _pool_pid != os.getpid():
+        return None
+    return _pool.stats()
@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+
+from schema import VECTOR_DIMENSION
+
+# ==============================================================================
+# Embedding model backends, selected with EMBEDDING_BACKEND:
+#   torch      - SentenceTransformer on PyTorch (the reference)
+#   onnx       - the same model exported to ONNX, run by ONNX Runtime
+#   onnx-int8  - ONNX with int8 dynamically quantized weights
+# All of them return the same 384-d normalized vectors the emails.embedding
+# column holds; run eval_embedding_backends.py before switching a deployment.
+# The ONNX backends need: pip install "sentence-transformers[onnx]"
+# ==============================================================================
+
+# --- Configuration ---
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", 'all-MiniLM-L6-v2')
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+
+# Quantized file inside the model repository. The Hub repository of
+# all-MiniLM-L6-v2 ships several; pick the one matching the CPU
+# (model_qint8_avx512_vnni.onnx, model_qint8_arm64.onnx, ...).
+ONNX_INT8_FILE = os.getenv("ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+
+def load_embedding_model(backend=EMBEDDING_BACKEND, model_name=EMBEDDING_MODEL_NAME, threads=None):
+    """
+    Loads `model_name` on `backend` and returns a SentenceTransformer, so
+    callers keep using encode() as before. `threads` caps ONNX Runtime's
+    thread pool (torch is capped with torch.set_num_threads). Raises
+    ValueError for an unknown backend or a model whose output does not fit
+    the embedding column.
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Use one of {', '.join(EMBEDDING_BACKENDS)}.")
+
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        model = SentenceTransformer(model_name)
+    else:
+        model_kwargs = {}
+        if backend == "onnx-int8":
+            model_kwargs["file_name"] = ONNX_INT8_FILE
+        if threads:
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = threads
+            model_kwargs["session_options"] = session_options
+        model = SentenceTransformer(model_name, backend="onnx", device="cpu", model_kwargs=model_kwargs)
+
+    dimension = model.get_sentence_embedding_dimension()
+    if dimension != VECTOR_DIMENSION:
+        raise ValueError(
+            f"'{model_name}' ({backend}) produces {dimension}-d vectors, "
+            f"but the emails.embedding column holds {VECTOR_DIMENSION}-d vectors."
+        )
+    return model
+
+# --- Shared Model ---
+# The model of a web or worker process is loaded on first use rather than at
+# import, so processes that never encode start fast and stay small.
+_model = None
+_model_lock = threading.Lock()
+
+def get_embedding_model():
+    """
+    Returns this process's model for EMBEDDING_BACKEND, loading it on first
+    use. Concurrent first callers wait for a single load.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                print(f"Loading sentence transformer model '{EMBEDDING_MODEL_NAME}' ({EMBEDDING_BACKEND} backend)...")
+                _model = load_embedding_model()
+                print("Model loaded successfully.")
+    return _model
+
+def embedding_model_loaded():
+    return _model is not None
+
+def warm_up_embedding_model(model=None):
+    """
+    Loads the model and runs one encode, so the first query pays for neither.
+    `model` defaults to this process's own. Returns the seconds taken.
+    """
+    started = time.perf_counter()
+    (model or get_embedding_model()).encode("warm up")
+    return time.perf_counter() - started
+
+def export_int8_model(output_dir, model_name=EMBEDDING_MODEL_NAME, config="avx2"):
+    """
+    Quantizes the ONNX export of `model_name` into `output_dir`, for models
+    whose repository has no quantized file. Point EMBEDDING_MODEL_NAME at
+    `output_dir` and ONNX_INT8_FILE at the returned file name afterwards.
+    `config` is one of 'arm64', 'avx2', 'avx512' or 'avx512_vnni'.
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+    model.save(output_dir)
+    export_dynamic_quantized_onnx_model(model, config, output_dir, file_suffix=f"int8_{config}")
+    return f"onnx/model_int8_{config}.onnx"
@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# --- Configuration ---
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))    # entries kept in-process
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "86400"))   # seconds
+# Optional shared tier, e.g. the Celery broker "redis://localhost:6379/0".
+# Leave unset to keep the cache purely in-process.
+QUERY_CACHE_REDIS_URL = os.getenv("QUERY_CACHE_REDIS_URL")
+
+
+def normalize_query(query):
+    """Lowercases and collapses whitespace so trivially different queries share an entry."""
+    return " ".join(query.lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Size- and TTL-bounded LRU cache in front of an `encode(text)` function,
+    with an optional Redis tier shared by every web worker.
+    """
+
+    def __init__(self, encode, max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL,
+                 redis_url=QUERY_CACHE_REDIS_URL, namespace="query-embedding"):
+        self._encode = encode
+        self._max_size = max_size
+        self._ttl = ttl
+        self._namespace = namespace
+        self._entries = OrderedDict()  # normalized query -> (expires_at, vector)
+        self._lock = threading.Lock()
+        self._redis = self._connect_redis(redis_url) if redis_url else None
+        self._stats = {"hits": 0, "redis_hits": 0, "misses": 0, "evictions": 0, "redis_errors": 0}
+
+    def _connect_redis(self, url):
+        try:
+            import redis
+            client = redis.Redis.from_url(url, socket_timeout=0.05)
+            client.ping()
+            return client
+        except Exception as e:
+            print(f"Warning: Query cache Redis tier disabled: {e}", file=sys.stderr)
+            return None
+
+    def _redis_key(self, normalized):
+        return f"{self._namespace}:{hashlib.sha1(normalized.encode('utf-8')).hexdigest()}"
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _store_local(self, normalized, vector):
+        with self._lock:
+            self._entries[normalized] = (time.monotonic() + self._ttl, vector)
+            self._entries.move_to_end(normalized)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _get_local(self, normalized):
+        with self._lock:
+            entry = self._entries.get(normalized)
+            if entry is None:
+                return None
+            expires_at, vector = entry
+            if expires_at < time.monotonic():
+                del self._entries[normalized]
+                return None
+            self._entries.move_to_end(normalized)
+            self._stats["hits"] += 1
+            return vector
+
+    def _get_redis(self, normalized):
+        try:
+            payload = self._redis.get(self._redis_key(normalized))
+        except Exception:
+            self._count("redis_errors")
+            return None
+        if payload is None:
+            return None
+        self._count("redis_hits")
+        return np.frombuffer(payload, dtype=np.float32)
+
+    def _set_redis(self, normalized, vector):
+        try:
+            self._redis.setex(self._redis_key(normalized), int(self._ttl), vector.tobytes())
+        except Exception:
+            self._count("redis_errors")
+
+    def get(self, query):
+        """Returns the embedding for `query`, encoding it only on a miss."""
+        normalized = normalize_query(query)
+
+        vector = self._get_local(normalized)
+        if vector is not None:
+            return vector
+
+        if self._redis is not None:
+            vector = self._get_redis(normalized)
+            if vector is not None:
+                self._store_local(normalized, vector)
+                return vector
+
+        self._count("misses")
+        vector = np.asarray(self._encode(normalized), dtype=np.float32)
+        vector.setflags(write=False)  # shared between requests
+        self._store_local(normalized, vector)
+        if self._redis is not None:
+            self._set_redis(normalized, vector)
+        return vector
+
+    def stats(self):
+        """Returns hit/miss counters and the current size."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["size"] = len(self._entries)
+        lookups = snapshot["hits"] + snapshot["redis_hits"] + snapshot["misses"]
+        snapshot["hit_ratio"] = (snapshot["hits"] + snapshot["redis_hits"]) / lookups if lookups else 0.0
+        snapshot["redis_enabled"] = self._redis is not None
+        return snapshot
@@ -0,0 +1,106 @@
+import os
+import multiprocessing
+
+import numpy as np
+
+from embedding_backends import EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+
+# ==============================================================================
+# Multi-process embedding for large backfills and reindexes on CPU-only hosts.
+# A single SentenceTransformer process leaves most cores idle; ParallelEncoder
+# shards the texts across a pool of worker processes, each with its own copy
+# of the model and a limited number of torch threads so the workers do not
+# fight over the same cores.
+# ==============================================================================
+
+# --- Configuration ---
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+EMBED_CHUNK_SIZE = int(os.getenv("EMBED_CHUNK_SIZE", "256"))  # texts per task sent to a worker
+EMBED_BATCH_SIZE = 32  # texts per forward pass inside a worker
+
+# The model loaded by each worker process, see _init_worker
+_worker_model = None
+
+def _init_worker(model_name, backend, threads):
+    """Limits the worker's math libraries to `threads` threads, then loads the model."""
+    global _worker_model
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[variable] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+    import torch
+    from embedding_backends import load_embedding_model
+
+    torch.set_num_threads(threads)
+    _worker_model = load_embedding_model(backend, model_name, threads)
+
+def _encode_chunk(args):
+    texts, batch_size = args
+    return _worker_model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+
+def length_sorted_chunks(sentences, chunk_size):
+    """
+    Returns (order, chunks): the indices of `sentences` from longest to
+    shortest, and the texts in that order split into chunks. Texts of similar
+    length share a batch, so little compute goes into padding.
+    """
+    order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]), reverse=True)
+    ordered = [sentences[i] for i in order]
+    chunks = [ordered[start:start + chunk_size] for start in range(0, len(ordered), chunk_size)]
+    return order, chunks
+
+
+class ParallelEncoder:
+    """
+    A process pool with a SentenceTransformer-compatible encode(), so it can
+    be passed anywhere an embedding model is expected (ingest.ingest_data,
+    backfill.run_backfill). Output rows are in input order. Close it when
+    done, or use it as a context manager.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, workers=EMBED_WORKERS, threads_per_worker=None,
+                 chunk_size=EMBED_CHUNK_SIZE, batch_size=EMBED_BATCH_SIZE, backend=EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        # spawn, not fork: a forked copy of an initialized torch runtime can deadlock
+        self._pool = multiprocessing.get_context("spawn").Pool(
+            self.workers,
+            initializer=_init_worker,
+            initargs=(model_name, backend, self.threads_per_worker),
+        )
+
+    def encode(self, sentences, batch_size=None, **kwargs):
+        """
+        Encodes a string or a list of strings like SentenceTransformer.encode.
+        `batch_size` and other keyword arguments are accepted for
+        compatibility; the workers always run forward passes of the
+        configured batch_size.
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        # Enough chunks to keep every worker busy, but never larger than chunk_size
+        chunk_size = max(1, min(self.chunk_size, -(-len(texts) // self.workers)))
+        inner_batch = min(self.batch_size, chunk_size)
+        order, chunks = length_sorted_chunks(texts, chunk_size)
+        encoded = np.concatenate(self._pool.map(_encode_chunk, [(chunk, inner_batch) for chunk in chunks]))
+
+        embeddings = np.empty_like(encoded)
+        embeddings[order] = encoded
+        return embeddings[0] if single else embeddings
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,286 @@
+"""
+Shared embedding sidecar. Run one per host,
+
+    python embedding_sidecar.py --socket /tmp/mailmentor-embed.sock
+
+and set EMBEDDING_SIDECAR_SOCKET to the same path for the web workers
+(app.py, main.py), ingest.py and the backfill jobs. They then send their
+texts over the Unix socket instead of each loading a copy of the model and
+the PyTorch runtime. If the sidecar is not running, a client loads the model
+itself (see SidecarEncoder) and tries the sidecar again later.
+
+bench_sidecar.py reports the memory saved per worker and the added latency.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+
+import numpy as np
+
+from batch_encoder import MicroBatchEncoder, ENCODER_MAX_BATCH
+from embedding_backends import get_embedding_model, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+
+# --- Configuration ---
+# Unset (the default) keeps every process on its own model
+EMBEDDING_SIDECAR_SOCKET = os.getenv("EMBEDDING_SIDECAR_SOCKET", "")
+DEFAULT_SIDECAR_SOCKET = "/tmp/mailmentor-embed.sock"
+SIDECAR_TIMEOUT = float(os.getenv("EMBEDDING_SIDECAR_TIMEOUT", "30"))          # seconds per SIDECAR_BATCH_SIZE texts
+SIDECAR_RETRY_AFTER = float(os.getenv("EMBEDDING_SIDECAR_RETRY_AFTER", "30"))  # seconds on the fallback after a failure
+SIDECAR_BATCH_SIZE = 32  # texts per forward pass for bulk requests
+MAX_MESSAGE_BYTES = 256 * 1024 * 1024
+
+# --- Wire Format ---
+# Every message is a 4-byte big-endian length followed by that many bytes.
+# On connect the server sends a JSON hello with its model, backend and
+# dimension. A request is JSON {"texts": [...]}; the reply is JSON
+# {"rows": n, "dimension": d} followed by one message of n*d float32 values,
+# or JSON {"error": "..."} alone.
+
+class SidecarError(ConnectionError):
+    """The sidecar is unreachable, serves a different model, or could not encode."""
+
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise SidecarError("embedding sidecar connection closed")
+        received += count
+    return bytes(buffer)
+
+def send_message(sock, payload):
+    sock.sendall(struct.pack("!I", len(payload)) + payload)
+
+def recv_message(sock):
+    (size,) = struct.unpack("!I", _recv_exactly(sock, 4))
+    if size > MAX_MESSAGE_BYTES:
+        raise SidecarError(f"message of {size} bytes exceeds the {MAX_MESSAGE_BYTES} byte limit")
+    return _recv_exactly(sock, size)
+
+def send_json(sock, value):
+    send_message(sock, json.dumps(value).encode('utf-8'))
+
+def recv_json(sock):
+    return json.loads(recv_message(sock))
+
+# --- Server ---
+
+class EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    """Serves one client connection until the client closes it."""
+
+    def handle(self):
+        sidecar = self.server
+        send_json(self.request, sidecar.identity)
+        while True:
+            try:
+                request = recv_json(self.request)
+            except (OSError, ValueError):
+                return
+            texts = request.get("texts") if isinstance(request, dict) else None
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                send_json(self.request, {"error": "'texts' must be a list of strings"})
+                continue
+            try:
+                embeddings = sidecar.encode(texts)
+            except Exception as e:
+                print(f"Error: Encoding {len(texts)} text(s) failed: {e}", file=sys.stderr)
+                send_json(self.request, {"error": str(e)})
+                continue
+            send_json(self.request, {"rows": embeddings.shape[0], "dimension": embeddings.shape[1]})
+            send_message(self.request, embeddings.tobytes())
+
+
+class EmbeddingSidecar(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Owns the one model of the host. Small requests (search queries) from
+    concurrent clients are merged into one forward pass by a
+    MicroBatchEncoder; bulk requests (ingest, backfill) are encoded in
+    SIDECAR_BATCH_SIZE slices. The model runs one pass at a time, so a query
+    waits for at most one slice of a bulk request.
+    """
+    daemon_threads = True
+    request_queue_size = 128  # every thread of every web worker may connect at once
+
+    def __init__(self, socket_path, model):
+        self.model = model
+        self.identity = {
+            "model": EMBEDDING_MODEL_NAME,
+            "backend": EMBEDDING_BACKEND,
+            "dimension": model.get_sentence_embedding_dimension(),
+            "pid": os.getpid(),
+        }
+        # Fast tokenizers are not safe to call from several threads at once
+        self._model_lock = threading.Lock()
+        self.batcher = MicroBatchEncoder(self._encode_pass)
+        super().__init__(socket_path, EmbeddingRequestHandler)
+
+    def _encode_pass(self, texts):
+        with self._model_lock:
+            return self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False)
+
+    def encode(self, texts):
+        """Returns a float32 (len(texts), dimension) array."""
+        if not texts:
+            embeddings = np.empty((0, self.identity["dimension"]), dtype=np.float32)
+        elif len(texts) <= ENCODER_MAX_BATCH:
+            embeddings = self.batcher.encode(texts)
+        else:
+            embeddings = np.concatenate([
+                self._encode_pass(texts[start:start + SIDECAR_BATCH_SIZE])
+                for start in range(0, len(texts), SIDECAR_BATCH_SIZE)
+            ])
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+def serve(socket_path):
+    """Loads the model and serves it on `socket_path` until interrupted."""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # left behind by a previous run
+    model = get_embedding_model()
+    with EmbeddingSidecar(socket_path, model) as server:
+        print(f"Embedding sidecar (pid {os.getpid()}) serving '{EMBEDDING_MODEL_NAME}' "
+              f"({EMBEDDING_BACKEND} backend) on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("Shutting down.")
+        finally:
+            os.unlink(socket_path)
+
+# --- Client ---
+
+class SidecarEncoder:
+    """
+    SentenceTransformer-compatible encode() backed by the sidecar, so it can
+    be passed anywhere an embedding model is expected. Each thread keeps its
+    own connection. When the sidecar cannot be reached, serves another model
+    or fails, this process encodes with `fallback()` (by default its own
+    lazily loaded model) for the next `retry_after` seconds; with
+    fallback=None the error is raised instead. Keyword arguments other than
+    batch_size only reach the fallback.
+    """
+
+    def __init__(self, socket_path=None, fallback=get_embedding_model, timeout=SIDECAR_TIMEOUT,
+                 retry_after=SIDECAR_RETRY_AFTER):
+        self.socket_path = socket_path or EMBEDDING_SIDECAR_SOCKET or DEFAULT_SIDECAR_SOCKET
+        self._fallback = fallback
+        self._timeout = timeout
+        self._retry_after = retry_after
+        self._local = threading.local()
+        self._down_until = 0.0
+        self._stats_lock = threading.Lock()
+        self._stats = {"sidecar_requests": 0, "fallback_requests": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        # A forked child must not share its parent's socket
+        if sock is not None and self._local.pid == os.getpid():
+            return sock
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+        try:
+            sock.connect(self.socket_path)
+            identity = recv_json(sock)
+            if (identity.get("model"), identity.get("backend")) != (EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND):
+                raise SidecarError(
+                    f"sidecar serves '{identity.get('model')}' ({identity.get('backend')} backend), "
+                    f"expected '{EMBEDDING_MODEL_NAME}' ({EMBEDDING_BACKEND} backend)"
+                )
+        except BaseException:
+            sock.close()
+            raise
+        self._local.sock, self._local.pid = sock, os.getpid()
+        return sock
+
+    def _disconnect(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None and self._local.pid == os.getpid():
+            sock.close()
+        self._local.sock = None
+
+    def _request(self, texts):
+        sock = self._connection()
+        # Bulk requests get proportionally longer to come back
+        sock.settimeout(self._timeout * max(1, len(texts) / SIDECAR_BATCH_SIZE))
+        send_json(sock, {"texts": texts})
+        header = recv_json(sock)
+        if "error" in header:
+            raise SidecarError(f"sidecar could not encode: {header['error']}")
+        data = recv_message(sock)
+        return np.frombuffer(data, dtype=np.float32).reshape(header["rows"], header["dimension"])
+
+    def encode(self, sentences, batch_size=None, **kwargs):
+        single = isinstance(sentences, str)
+        if time.monotonic() >= self._down_until:
+            try:
+                embeddings = self._request([sentences] if single else list(sentences))
+                self._count("sidecar_requests")
+                return embeddings[0] if single else embeddings
+            except (OSError, ValueError) as e:
+                # A timed-out or failed exchange leaves the stream unusable
+                self._disconnect()
+                self._count("errors")
+                if self._fallback is None:
+                    raise SidecarError(f"embedding sidecar at {self.socket_path} unavailable: {e}") from e
+                self._down_until = time.monotonic() + self._retry_after
+                print(f"Warning: Embedding sidecar at {self.socket_path} unavailable ({e}); "
+                      f"encoding in-process for {self._retry_after:.0f}s.", file=sys.stderr)
+        elif self._fallback is None:
+            raise SidecarError(f"embedding sidecar at {self.socket_path} unavailable")
+
+        self._count("fallback_requests")
+        if batch_size is not None:
+            kwargs["batch_size"] = batch_size
+        return self._fallback().encode(sentences, **kwargs)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["socket"] = self.socket_path
+        stats["available"] = time.monotonic() >= self._down_until
+        return stats
+
+# --- Shared Client ---
+_client = None
+_client_lock = threading.Lock()
+
+def sidecar_client():
+    """This process's SidecarEncoder, or None when EMBEDDING_SIDECAR_SOCKET is unset."""
+    global _client
+    if not EMBEDDING_SIDECAR_SOCKET:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SidecarEncoder(EMBEDDING_SIDECAR_SOCKET)
+    return _client
+
+def get_encoder():
+    """The embedding model to use in this process: the sidecar client if configured, else the local model."""
+    client = sidecar_client()
+    return client if client is not None else get_embedding_model()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the embedding model to the other processes of this host.")
+    parser.add_argument('--socket', default=EMBEDDING_SIDECAR_SOCKET or DEFAULT_SIDECAR_SOCKET)
+    parser.add_argument('--threads', type=int, default=None, help="torch threads (default: all cores)")
+    args = parser.parse_args()
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+    serve(args.socket)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Accept-or-reject check for an embedding backend (see embedding_backends.py)
+against the PyTorch reference, on the emails in mails.csv:
+
+    python eval_embedding_backends.py --backends onnx,onnx-int8
+
+For each backend it reports
+  - batch throughput (emails/sec), as in ingest and backfill
+  - single-query latency (p50/p95 ms), as in /api/search
+  - cosine similarity to the PyTorch vector of the same email (mean, 1st
+    percentile, min)
+  - top-5 agreement: the share of each email's 5 nearest neighbours that
+    are the same as with PyTorch vectors, i.e. how much search results move
+
+Vectors already stored were made by the reference; a backend whose top-5
+agreement is high can share the index with them, otherwise re-embed
+(python backfill.py after clearing the embeddings).
+"""
+import time
+import argparse
+
+import numpy as np
+
+from embedding_backends import load_embedding_model, EMBEDDING_BACKENDS, EMBEDDING_MODEL_NAME
+from ingest import iter_csv_emails, preprocess_text, CSV_FILE
+
+BATCH_SIZE = 32
+QUERY_SAMPLES = 200
+TOP_K = 5
+
+def load_texts(path, limit):
+    texts = [
+        f"Subject: {preprocess_text(email['subject'])} Body: {preprocess_text(email['body'])}"
+        for email in iter_csv_emails(path)
+    ]
+    return texts[:limit] if limit else texts
+
+def measure(model, texts, queries):
+    """Returns (embeddings, emails/sec, single-query latencies in ms)."""
+    model.encode(texts[:BATCH_SIZE], batch_size=BATCH_SIZE)  # warm up
+    started = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=BATCH_SIZE, normalize_embeddings=True)
+    throughput = len(texts) / (time.perf_counter() - started)
+
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        model.encode(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+    return np.asarray(embeddings, dtype=np.float32), throughput, np.array(latencies)
+
+def nearest(embeddings, k=TOP_K):
+    """Indices of each row's k nearest other rows by cosine similarity (rows are normalized)."""
+    similarities = embeddings @ embeddings.T
+    np.fill_diagonal(similarities, -np.inf)
+    return np.argpartition(-similarities, k, axis=1)[:, :k]
+
+def top_k_agreement(reference_neighbours, candidate_neighbours):
+    overlaps = [
+        len(set(expected) & set(actual)) / len(expected)
+        for expected, actual in zip(reference_neighbours, candidate_neighbours)
+    ]
+    return float(np.mean(overlaps))
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends with the PyTorch reference.")
+    parser.add_argument('--csv-path', default=CSV_FILE)
+    parser.add_argument('--backends', default="onnx,onnx-int8")
+    parser.add_argument('--limit', type=int, default=0, help="Use only the first N emails")
+    parser.add_argument('--min-cosine', type=float, default=0.98, help="Required 1st-percentile cosine")
+    parser.add_argument('--min-agreement', type=float, default=0.9, help="Required top-5 agreement")
+    args = parser.parse_args()
+
+    texts = load_texts(args.csv_path, args.limit)
+    rng = np.random.default_rng(0)
+    queries = [texts[i][:200] for i in rng.integers(0, len(texts), QUERY_SAMPLES)]
+    print(f"{len(texts)} emails from '{args.csv_path}', model '{EMBEDDING_MODEL_NAME}'\n")
+
+    reference, reference_rate, reference_latencies = measure(load_embedding_model("torch"), texts, queries)
+    reference_neighbours = nearest(reference)
+
+    print(f"{'backend':<10} {'emails/sec':>11} {'speedup':>8} {'p50 ms':>7} {'p95 ms':>7} "
+          f"{'cos mean':>9} {'cos p1':>7} {'cos min':>8} {'top-5':>6}  verdict")
+    print(f"{'torch':<10} {reference_rate:>11,.1f} {1.0:>7.2f}x {np.percentile(reference_latencies, 50):>7.2f} "
+          f"{np.percentile(reference_latencies, 95):>7.2f} {1.0:>9.4f} {1.0:>7.4f} {1.0:>8.4f} {1.0:>6.3f}  reference")
+
+    for backend in args.backends.split(','):
+        if backend not in EMBEDDING_BACKENDS or backend == "torch":
+            print(f"{backend:<10} skipped (choose from {', '.join(EMBEDDING_BACKENDS[1:])})")
+            continue
+        embeddings, rate, latencies = measure(load_embedding_model(backend), texts, queries)
+        cosines = np.sum(embeddings * reference, axis=1)  # both sides are normalized
+        agreement = top_k_agreement(reference_neighbours, nearest(embeddings))
+        cosine_p1 = np.percentile(cosines, 1)
+        verdict = "ACCEPT" if cosine_p1 >= args.min_cosine and agreement >= args.min_agreement else "REJECT"
+        print(f"{backend:<10} {rate:>11,.1f} {rate / reference_rate:>7.2f}x {np.percentile(latencies, 50):>7.2f} "
+              f"{np.percentile(latencies, 95):>7.2f} {cosines.mean():>9.4f} {cosine_p1:>7.4f} "
+              f"{cosines.min():>8.4f} {agreement:>6.3f}  {verdict}")
+
+if __name__ == "__main__":
+    main()
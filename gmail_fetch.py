@@ -0,0 +1,190 @@
+import time
+import random
+import base64
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from googleapiclient.errors import HttpError
+
+# ==============================================================================
+# CONFIGURATION
+# ==============================================================================
+
+# Gmail accepts up to 100 calls per batch request, but larger batches are
+# likely to trip per-user rate limits, so Google recommends staying at 50.
+BATCH_SIZE = 50
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0    # seconds
+BACKOFF_MAX = 32.0    # seconds
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# ==============================================================================
+# PARSING
+# ==============================================================================
+
+def get_message_body(payload):
+    """Parses the email payload to find the plain text body."""
+    if 'parts' in payload:
+        for part in payload['parts']:
+            if part['mimeType'] == 'text/plain' and 'data' in part['body']:
+                return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
+            # Recursive call for multipart messages
+            if part.get('parts'):
+                body = get_message_body(part)
+                if body:
+                    return body
+    elif 'body' in payload and 'data' in payload['body']:
+         if payload['mimeType'] == 'text/plain':
+            return base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
+
+    return "(No plain text body found)"
+
+
+def parse_date_header(value):
+    """The Date header as an aware datetime (UTC when it has no offset), or None if unparseable."""
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+def internal_date(msg_data):
+    """Gmail's internalDate (ms since the epoch, when the message was received) as a UTC datetime."""
+    try:
+        return datetime.fromtimestamp(int(msg_data['internalDate']) / 1000, tz=timezone.utc)
+    except (KeyError, TypeError, ValueError, OverflowError, OSError):
+        return None
+
+
+def parse_message(msg_data):
+    """Turns a `format='full'` Gmail message resource into an email dictionary."""
+    headers = msg_data['payload'].get('headers', [])
+
+    email_dict = {
+        'message_id': msg_data.get('id'),
+        'recipient': '(not available)' # Recipient is often in the 'To' header
+    }
+
+    for header in headers:
+        name = header['name'].lower()
+        if name == 'subject':
+            email_dict['subject'] = header['value']
+        elif name == 'from':
+            email_dict['sender'] = header['value']
+        elif name == 'to':
+            email_dict['recipient'] = header['value']
+        elif name == 'date':
+            # Parse the date string into a timezone-aware datetime object
+            email_dict['received_date'] = parse_date_header(header['value'])
+
+    # Without a usable Date header, fall back to when Gmail received the
+    # message: unlike the fetch time it is the same on every resync, so the
+    # (message_id, "timestamp") unique index still catches the duplicate.
+    if not email_dict.get('received_date'):
+        email_dict['received_date'] = internal_date(msg_data)
+
+    email_dict['body'] = get_message_body(msg_data['payload'])
+    return email_dict
+
+# ==============================================================================
+# BATCHED FETCHING
+# ==============================================================================
+
+def _status(error):
+    """The HTTP status of a Gmail API error, or None."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error):
+    return _status(error) in RETRYABLE_STATUSES
+
+
+def _backoff_delay(attempt):
+    """Exponential backoff with jitter, capped at BACKOFF_MAX."""
+    return min(BACKOFF_BASE * (2 ** attempt), BACKOFF_MAX) + random.uniform(0, 1)
+
+
+def fetch_messages(service, message_ids, batch_size=BATCH_SIZE, max_retries=MAX_RETRIES, sleep=time.sleep):
+    """
+    Fetches full Gmail messages for `message_ids` using HTTP batch requests of
+    up to `batch_size` calls each. Returns (emails, failed): the parsed
+    messages in input order, and {message id: HTTP status of its last error}
+    for the ones that could not be fetched. A status outside
+    RETRYABLE_STATUSES will not change on a later try.
+
+    Calls that fail with 429/5xx (individually or as a whole batch) are retried
+    with exponential backoff until `max_retries` runs out; other errors fail
+    the affected message at once. A 404 means the message was deleted after it
+    was listed, so it is neither returned nor reported as failed. `service`
+    only needs `new_batch_http_request()` and `users().messages().get()`, so a
+    local fake can stand in for the discovery object.
+    """
+    message_ids = list(dict.fromkeys(message_ids))
+    if not message_ids:
+        return [], {}
+
+    fetched = {}
+    failed = {}
+    last_status = {}
+    pending = message_ids
+    attempt = 0
+    started = time.perf_counter()
+
+    while pending:
+        retry = []
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                fetched[request_id] = response
+            elif _is_retryable(exception):
+                retry.append(request_id)
+                last_status[request_id] = _status(exception)
+            elif _status(exception) == 404:
+                print(f"⚠️ Message {request_id} no longer exists. Skipping it.")
+            else:
+                print(f"❌ Gmail API error for message {request_id}: {exception}")
+                failed[request_id] = _status(exception)
+
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = service.new_batch_http_request()
+            for msg_id in chunk:
+                batch.add(
+                    service.users().messages().get(userId='me', id=msg_id, format='full'),
+                    callback=callback,
+                    request_id=msg_id,
+                )
+            try:
+                batch.execute()
+            except HttpError as error:
+                if not _is_retryable(error):
+                    raise
+                for msg_id in chunk:
+                    if msg_id not in fetched:
+                        retry.append(msg_id)
+                        last_status[msg_id] = _status(error)
+
+            elapsed = time.perf_counter() - started
+            rate = len(fetched) / elapsed if elapsed > 0 else 0.0
+            print(f"  Fetched {len(fetched)}/{len(message_ids)} message(s) ({rate:.1f} msgs/sec)")
+
+        if not retry:
+            break
+        if attempt >= max_retries:
+            print(f"❌ Giving up on {len(retry)} message(s) after {max_retries} retries.")
+            failed.update((msg_id, last_status.get(msg_id)) for msg_id in retry)
+            break
+
+        delay = _backoff_delay(attempt)
+        print(f"⏳ Rate limited or server error on {len(retry)} message(s). Retrying in {delay:.1f}s...")
+        sleep(delay)
+        attempt += 1
+        pending = retry
+
+    emails = [parse_message(fetched[msg_id]) for msg_id in message_ids if msg_id in fetched]
+    return emails, failed
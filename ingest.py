@@ -1,7 +1,15 @@
 import psycopg2
 import os
+import csv
+import time
+import argparse
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from itertools import islice
+from psycopg2.extras import execute_values
+from pgvector.psycopg2 import register_vector
+from embedding_backends import load_embedding_model, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+from embedding_pool import ParallelEncoder, EMBED_WORKERS
+from embedding_sidecar import sidecar_client
 import re
 import pickle
 
@@ -13,9 +21,12 @@ DB_HOST = os.environ.get("DB_HOST", "localhost")
 DB_PORT = os.environ.get("DB_PORT", "5433") # Use the updated port
 
 # --- Model Configuration ---
-EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 CLASSIFIER_FILE = 'category_classifier.pkl'
 
+# --- Pipeline Configuration ---
+BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "64"))
+CSV_FILE = 'mails.csv'
+
 # --- Sample Data ---
 SAMPLE_EMAILS = [
     {
@@ -45,8 +56,145 @@ def preprocess_text(text):
     text = re.sub(r'[^\w\s]', '', text)
     return text.strip()
 
-def ingest_data():
-    conn = None
+def split_subject_body(text):
+    """Splits a 'Subject: ... Body: ...' string (the mails.csv format) into its two parts."""
+    match = re.match(r'\s*Subject:\s*(.*?)\s*Body:\s*(.*)', text or "", re.DOTALL)
+    if not match:
+        return "", (text or "").strip()
+    return match.group(1).strip(), match.group(2).strip()
+
+# --- Email Sources ---
+# Every source yields dicts with sender/recipient/subject/body. Rows that already
+# exist in the database also carry their 'id' and are updated in place.
+
+def iter_sample_emails():
+    """Yields the built-in SAMPLE_EMAILS."""
+    yield from SAMPLE_EMAILS
+
+def iter_csv_emails(path=CSV_FILE):
+    """Yields emails from a CSV with a 'text' column like mails.csv."""
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            subject, body = split_subject_body(row.get('text'))
+            yield {
+                "sender": row.get('sender') or '(not available)',
+                "recipient": row.get('recipient') or '(not available)',
+                "subject": subject,
+                "body": body,
+            }
+
+def iter_db_emails(conn, batch_size=BATCH_SIZE):
+    """
+    Yields stored emails that have no embedding yet, e.g. the rows written by
+    fetch_email.save_emails_to_db. Uses a server-side cursor held across commits
+    so large mailboxes are streamed instead of loaded into memory.
+    """
+    with conn.cursor(name='ingest_source', withhold=True) as cur:
+        cur.itersize = batch_size
+        cur.execute(
+            "SELECT id, sender, recipient, subject, body FROM emails WHERE embedding IS NULL ORDER BY id"
+        )
+        for email_id, sender, recipient, subject, body in cur:
+            yield {"id": email_id, "sender": sender, "recipient": recipient, "subject": subject, "body": body}
+
+def iter_batches(iterable, size):
+    """Groups an iterable into lists of at most `size` items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+# --- Pipeline Stages ---
+
+class StageStats:
+    """Accumulates wall time and row counts per pipeline stage."""
+
+    def __init__(self):
+        self.seconds = {}
+        self.rows = {}
+
+    def record(self, stage, started, rows):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + (time.perf_counter() - started)
+        self.rows[stage] = self.rows.get(stage, 0) + rows
+
+    def report(self):
+        print("\nThroughput per stage:")
+        for stage, seconds in self.seconds.items():
+            rows = self.rows[stage]
+            rate = rows / seconds if seconds > 0 else float('inf')
+            print(f"  - {stage:<9} {rows:>8} rows in {seconds:8.2f}s  ({rate:,.1f} rows/sec)")
+
+def classify_batch(classifier_model, emails):
+    """Predicts one category per email with a single predict() call."""
+    texts = [f"Subject: {email.get('subject') or ''} Body: {email.get('body') or ''}" for email in emails]
+    return classifier_model.predict(texts)
+
+def embed_batch(embedding_model, emails):
+    """Encodes all emails of the batch with a single encode() call."""
+    texts = [
+        f"Subject: {preprocess_text(email.get('subject'))} Body: {preprocess_text(email.get('body'))}"
+        for email in emails
+    ]
+    return embedding_model.encode(texts, batch_size=len(texts))
+
+def write_batch(cur, emails, categories, embeddings):
+    """
+    Writes a processed batch with one bulk statement per kind of row: new emails
+    are inserted, emails that already have an id get their tags/embedding updated.
+    Returns the ids of the inserted rows.
+    """
+    new_rows = []
+    updated_rows = []
+    for email, category, embedding in zip(emails, categories, embeddings):
+        if email.get("id") is not None:
+            updated_rows.append((email["id"], [category], embedding))
+        else:
+            new_rows.append((
+                email["sender"],
+                email["recipient"],
+                email["subject"],
+                email["body"],
+                [category],
+                embedding,
+            ))
+
+    inserted_ids = []
+    if new_rows:
+        inserted_ids = [row[0] for row in execute_values(
+            cur,
+            "INSERT INTO emails (sender, recipient, subject, body, tags, embedding) VALUES %s RETURNING id",
+            new_rows,
+            page_size=len(new_rows),
+            fetch=True,
+        )]
+    if updated_rows:
+        execute_values(
+            cur,
+            """
+            UPDATE emails SET tags = v.tags, embedding = v.embedding
+            FROM (VALUES %s) AS v (id, tags, embedding)
+            WHERE emails.id = v.id
+            """,
+            updated_rows,
+            template="(%s, %s::text[], %s::vector)",
+            page_size=len(updated_rows),
+        )
+    return inserted_ids
+
+def ingest_data(source=None, batch_size=BATCH_SIZE, conn=None, embedding_model=None):
+    """
+    Classifies, embeds and stores emails from `source` in chunks of `batch_size`.
+    `source` may be any iterable of email dicts; it defaults to SAMPLE_EMAILS.
+    `embedding_model` may be anything with a SentenceTransformer-style
+    encode(), e.g. a shared batch_encoder.MicroBatchEncoder; by default it is
+    the embedding sidecar if EMBEDDING_SIDECAR_SOCKET is set, otherwise the
+    model is loaded here.
+    """
+    owns_connection = conn is None
+    stats = StageStats()
+    total = 0
     try:
         # Load the trained classifier model
         print(f"Loading classifier model from '{CLASSIFIER_FILE}'...")
@@ -55,64 +203,106 @@ def ingest_data():
         print("Classifier loaded successfully.")
 
         # Connect to the database
-        print("Connecting to the PostgreSQL database...")
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
-        cur = conn.cursor()
+        if owns_connection:
+            print("Connecting to the PostgreSQL database...")
+            conn = psycopg2.connect(
+                dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
+            )
+        register_vector(conn)
 
         # Load the sentence transformer model
-        print(f"Loading sentence transformer model: '{EMBEDDING_MODEL_NAME}'...")
-        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-        print("Embedding model loaded successfully.")
-
-        print("\nProcessing and ingesting emails...")
-        for email in SAMPLE_EMAILS:
-            subject = preprocess_text(email.get("subject", ""))
-            body = preprocess_text(email.get("body", ""))
-            
-            # Combine subject and body for both classification and embedding
-            full_text_for_classification = f"Subject: {email.get('subject', '')} Body: {email.get('body', '')}"
-            full_text_for_embedding = f"Subject: {subject} Body: {body}"
-
-            # Predict the category using the trained model
-            predicted_category = classifier_model.predict([full_text_for_classification])[0]
-            print(f"  - Email from '{email['sender']}' -> Predicted Category: '{predicted_category}'")
-            
-            # Generate the vector embedding
-            embedding = embedding_model.encode(full_text_for_embedding)
-            embedding_list = embedding.tolist()
-
-            # Insert into the database with the predicted tag
-            cur.execute(
-                """
-                INSERT INTO emails (sender, recipient, subject, body, tags, embedding)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    email["sender"],
-                    email["recipient"],
-                    email["subject"],
-                    email["body"],
-                    [predicted_category], # Add the predicted category as a tag
-                    embedding_list
-                )
-            )
+        if embedding_model is None and sidecar_client() is not None:
+            print(f"Encoding with the embedding sidecar at {sidecar_client().socket_path}.")
+            embedding_model = sidecar_client()
+        if embedding_model is None:
+            print(f"Loading sentence transformer model: '{EMBEDDING_MODEL_NAME}' ({EMBEDDING_BACKEND} backend)...")
+            embedding_model = load_embedding_model()
+            print("Embedding model loaded successfully.")
+
+        if source is None:
+            source = iter_sample_emails()
+
+        # New rows are summarized in the background so users rarely wait on
+        # the LLM. Optional: ingestion still works without the Celery/LLM stack.
+        try:
+            from tasks import enqueue_presummarization
+        except ImportError as e:
+            print(f"Background summarization unavailable: {e}")
+            enqueue_presummarization = None
+
+        print(f"\nProcessing and ingesting emails in batches of {batch_size}...")
+        pipeline_started = time.perf_counter()
+        with conn.cursor() as cur:
+            for batch in iter_batches(source, batch_size):
+                started = time.perf_counter()
+                categories = classify_batch(classifier_model, batch)
+                stats.record("classify", started, len(batch))
+
+                started = time.perf_counter()
+                embeddings = embed_batch(embedding_model, batch)
+                stats.record("embed", started, len(batch))
+
+                started = time.perf_counter()
+                inserted_ids = write_batch(cur, batch, categories, embeddings)
+                conn.commit()
+                stats.record("write", started, len(batch))
 
-        conn.commit()
-        print("\nData ingestion complete.")
+                if enqueue_presummarization:
+                    enqueue_presummarization(inserted_ids)
 
-    except FileNotFoundError:
-        print(f"Error: Model file '{CLASSIFIER_FILE}' not found. Please run train_classifier.py first.")
+                total += len(batch)
+                print(f"  - Ingested {total} emails so far...")
+
+        elapsed = time.perf_counter() - pipeline_started
+        print(f"\nData ingestion complete: {total} emails in {elapsed:.2f}s.")
+        stats.report()
+
+    except FileNotFoundError as e:
+        print(f"Error: File not found: {e.filename}. Run train_classifier.py first if the classifier is missing.")
     except psycopg2.Error as e:
         print(f"Database error: {e}")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
     finally:
-        if conn:
-            cur.close()
+        if conn and owns_connection:
             conn.close()
             print("Database connection closed.")
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify, embed and store emails in batches.")
+    parser.add_argument('--source', choices=['sample', 'csv', 'db'], default='sample',
+                        help="sample: SAMPLE_EMAILS, csv: a mails.csv-style file, db: stored emails without embeddings")
+    parser.add_argument('--csv-path', default=CSV_FILE)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--embed-workers', type=int, default=EMBED_WORKERS,
+                        help="Encode with this many processes (see embedding_pool.py); use a large --batch-size")
+    args = parser.parse_args()
+
+    embedding_model = None
+    if args.embed_workers > 1:
+        print(f"Starting {args.embed_workers} embedding worker processes...")
+        embedding_model = ParallelEncoder(EMBEDDING_MODEL_NAME, workers=args.embed_workers)
+
+    try:
+        if args.source == 'csv':
+            ingest_data(iter_csv_emails(args.csv_path), batch_size=args.batch_size, embedding_model=embedding_model)
+        elif args.source == 'db':
+            # The source cursor and the writer share one connection so the
+            # WITH HOLD cursor survives the per-batch commits.
+            conn = psycopg2.connect(
+                dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
+            )
+            try:
+                ingest_data(iter_db_emails(conn, args.batch_size), batch_size=args.batch_size, conn=conn,
+                            embedding_model=embedding_model)
+            finally:
+                conn.close()
+        else:
+            ingest_data(batch_size=args.batch_size, embedding_model=embedding_model)
+    finally:
+        if embedding_model is not None:
+            embedding_model.close()
 
 if __name__ == "__main__":
-    ingest_data()
+    main()
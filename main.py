@@ -1,21 +1,113 @@
 import os
-from fastapi import FastAPI
+import sys
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, Body
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from pgvector.psycopg import register_vector_async
+from celery.result import AsyncResult
+
+import search
+from embedding_cache import QueryEmbeddingCache
+from batch_encoder import MicroBatchEncoder
+from embedding_backends import (
+    embedding_model_loaded, warm_up_embedding_model, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+)
+from embedding_sidecar import get_encoder, sidecar_client
+
+# Import the Celery tasks and the summary cache query shared with app.py
+from tasks import (
+    summarize_email, summarize_emails, current_summaries, get_llm, llm_loaded,
+    CACHED_SUMMARIES_SQL, LLM_MODEL_NAME, PROMPT_VERSION, celery as celery_app
+)
 
 # Load environment variables from the .env file
 load_dotenv()
 
 # --- Configuration ---
 # Fetching configuration from environment variables
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME", "email_db")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "mysecretpassword")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5433")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
 QDRANT_URL = os.getenv("QDRANT_URL")
 OLLAMA_URL = os.getenv("OLLAMA_BASE_URL")
 
+# Threads that wait on the encoder and on blocking Celery/Redis calls, so the
+# event loop itself never blocks
+EXECUTOR_THREADS = int(os.getenv("EXECUTOR_THREADS", "8"))
+
+# The embedding model and the LLM client are created on first use; with
+# WARMUP_ON_STARTUP=true the lifespan handler loads them before serving
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+
+# With EMBEDDING_SIDECAR_SOCKET set, the vectors come from the host's shared
+# embedding sidecar (embedding_sidecar.py) and this worker only loads the
+# model itself while the sidecar is down.
+encoder = MicroBatchEncoder(lambda texts: get_encoder().encode(texts, batch_size=len(texts)))
+query_cache = QueryEmbeddingCache(encoder.encode, namespace=f"query-embedding:{EMBEDDING_MODEL_NAME}:{EMBEDDING_BACKEND}")
+executor = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS, thread_name_prefix="blocking")
+
+# --- Database Pool ---
+
+async def configure_connection(conn):
+    """Registers pgvector once per physical connection."""
+    await register_vector_async(conn)
+    await conn.commit()
+
+pool = AsyncConnectionPool(
+    make_conninfo(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT),
+    min_size=DB_POOL_MIN,
+    max_size=DB_POOL_MAX,
+    open=False,
+    configure=configure_connection,
+    check=AsyncConnectionPool.check_connection,
+)
+
+def warm_up():
+    """Loads the embedding model and the LLM client. Returns the seconds each took."""
+    timings = {"embedding_model": round(warm_up_embedding_model(get_encoder()), 3)}
+    started = time.perf_counter()
+    get_llm()
+    timings["llm"] = round(time.perf_counter() - started, 3)
+    return timings
+
+@asynccontextmanager
+async def lifespan(app):
+    await pool.open()
+    if WARMUP_ON_STARTUP:
+        print(f"Warmed up in {await run_blocking(warm_up)} seconds.")
+    try:
+        yield
+    finally:
+        await pool.close()
+        executor.shutdown(wait=False)
+
+async def run_blocking(func, *args):
+    """Runs a blocking call on the executor."""
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+async def fetch_cached_summaries(email_ids):
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=dict_row) as cur:
+            await cur.execute(CACHED_SUMMARIES_SQL, (LLM_MODEL_NAME, PROMPT_VERSION, list(email_ids)))
+            return current_summaries(await cur.fetchall())
+
 # Create an instance of the FastAPI class
 app = FastAPI(
     title="MailMentor API",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 @app.get("/")
@@ -32,11 +124,97 @@ def read_root():
         "ollama_url": OLLAMA_URL
     }
 
-# Next, you will add your API endpoints for search, summary, etc.
-# For example:
-# from your_email_module import search_emails
-#
-# @app.post("/api/search")
-# async def api_search(query: str):
-#     results = await search_emails(query)
-#     return {"results": results}
+@app.post("/api/search")
+async def search_emails(payload: dict = Body(None)):
+    """Receives a query and performs a similarity search."""
+    try:
+        options = search.parse_search_options(payload)
+    except search.SearchError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    query_embedding = await run_blocking(query_cache.get, options['query'])
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                results = await search.run_plan_async(cur, search.search_plan(query_embedding, options))
+        return results
+    except Exception as e:
+        print(f"An error occurred during search: {e}", file=sys.stderr)
+        return JSONResponse({"error": "An internal error occurred during search."}, status_code=500)
+
+@app.post("/api/summarize/{email_id}")
+async def start_summarization_task(email_id: int):
+    """
+    Returns the cached summary right away (200) if there is one, otherwise
+    starts the background task to summarize the email (202).
+    """
+    try:
+        cached = (await fetch_cached_summaries([email_id])).get(email_id)
+    except Exception as e:
+        print(f"Could not read the summary cache: {e}", file=sys.stderr)
+        cached = None
+    if cached is not None:
+        return {"status": "success", "summary": cached, "cached": True}
+
+    task = await run_blocking(summarize_email.delay, email_id)
+    return JSONResponse({"task_id": task.id}, status_code=202)
+
+@app.post("/api/summarize")
+async def start_batch_summarization_task(payload: dict = Body(None)):
+    """
+    Summarizes several emails. Returns 200 with all summaries when every one
+    is cached, otherwise starts one batch task (202).
+    """
+    email_ids = payload.get('ids') if payload else None
+    if not isinstance(email_ids, list) or not email_ids:
+        return JSONResponse({"error": "Missing 'ids' list in request body"}, status_code=400)
+    try:
+        email_ids = [int(email_id) for email_id in email_ids]
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "'ids' must be integers"}, status_code=400)
+    if len(email_ids) > search.MAX_SEARCH_LIMIT:
+        return JSONResponse({"error": f"At most {search.MAX_SEARCH_LIMIT} 'ids' per request"}, status_code=400)
+
+    try:
+        cached = await fetch_cached_summaries(email_ids)
+    except Exception as e:
+        print(f"Could not read the summary cache: {e}", file=sys.stderr)
+        cached = {}
+    if len(cached) == len(set(email_ids)):
+        summaries = {str(email_id): summary for email_id, summary in cached.items()}
+        return {"status": "success", "summaries": summaries, "errors": {}, "cached": True}
+
+    task = await run_blocking(summarize_emails.delay, email_ids)
+    return JSONResponse({"task_id": task.id}, status_code=202)
+
+@app.get("/api/task-status/{task_id}")
+async def get_task_status(task_id: str):
+    """Checks the status of a Celery task."""
+    def read_status():
+        task_result = AsyncResult(task_id, app=celery_app)
+        return {
+            "task_id": task_id,
+            "status": task_result.status,
+            "result": task_result.result if task_result.ready() else None
+        }
+    return await run_blocking(read_status)
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Exposes in-process counters for monitoring."""
+    return {
+        "db_pool": pool.get_stats(),
+        "query_cache": query_cache.stats(),
+        "encoder": encoder.stats(),
+        "models_loaded": {"embedding": embedding_model_loaded(), "llm": llm_loaded()},
+        "embedding_sidecar": sidecar_client().stats() if sidecar_client() else None,
+    }
+
+@app.post("/api/warmup")
+async def warm_up_models():
+    """Loads the models now instead of on the first request."""
+    try:
+        return {"status": "ready", "seconds": await run_blocking(warm_up)}
+    except Exception as e:
+        print(f"Warmup failed: {e}", file=sys.stderr)
+        return JSONResponse({"status": "error", "error": str(e)}, status_code=500)
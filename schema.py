@@ -0,0 +1,545 @@
+import os
+import sys
+from datetime import date, datetime, timezone
+
+import psycopg2
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+# ==============================================================================
+# The single definition of the MailMentor database schema, as an ordered list
+# of migrations. setup_db.py applies them; the fetcher (fetch_email.py), the
+# ingest pipeline and the search apps only read and write the tables.
+#
+# Every migration is idempotent (IF NOT EXISTS), so a database created before
+# the schema was versioned - by an older setup_db.py or by the fetcher's old
+# create_all - is brought up to date by running all of them once.
+# ==============================================================================
+
+# --- Load environment variables from .env file ---
+load_dotenv()
+
+# --- Configuration ---
+# The dimension should match your embedding model output
+VECTOR_DIMENSION = 384
+
+# --- Vector Index Configuration ---
+# 'hnsw' gives the best speed/recall trade-off; 'ivfflat' builds faster and
+# uses less memory but should be rebuilt once the table holds representative data.
+VECTOR_INDEX_NAME = "emails_embedding_idx"
+VECTOR_INDEX_METHOD = os.getenv("VECTOR_INDEX_METHOD", "hnsw")
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "100"))
+INDEX_BUILD_MEMORY = os.getenv("INDEX_BUILD_MEMORY", "512MB")
+
+# --- Compact Vector Indexes ---
+# Optional, much smaller indexes over the same embedding column, for archives
+# whose full-precision index no longer fits in shared_buffers (pgvector 0.7+).
+# 'halfvec' indexes 16-bit floats (half the size); 'binary' keeps one bit per
+# dimension (1/32) and ranks by Hamming distance. Searches using them re-rank
+# a shortlist against the full-precision column (see search.py), so the
+# column itself is unchanged. Build one with
+#   python setup_db.py reindex --quantization halfvec
+VECTOR_QUANTIZATIONS = ("none", "halfvec", "binary")
+QUANTIZED_INDEXES = {
+    # quantization: (index name, indexed expression, operator class)
+    "halfvec": ("emails_embedding_halfvec_idx", f"(embedding::halfvec({VECTOR_DIMENSION}))", "halfvec_cosine_ops"),
+    "binary": ("emails_embedding_binary_idx", f"(binary_quantize(embedding)::bit({VECTOR_DIMENSION}))", "bit_hamming_ops"),
+}
+
+# --- Partitioning Configuration ---
+# Large archives can keep emails in monthly range partitions on "timestamp".
+# Every partition gets its own vector index, and searches with a date filter
+# only touch the matching months. New databases are partitioned when
+# PARTITIONED_EMAILS=true; an existing table is moved over with
+#   python setup_db.py partition
+# Partitions exist from the current month on; the fetcher creates older
+# months on demand, in a short transaction of its own, before writing
+# historical mail. Rows that still ended up in emails_default are moved into
+# monthly partitions with
+#   python setup_db.py split-default
+# Months are UTC months, whatever the session time zone.
+PARTITIONED_EMAILS = os.getenv("PARTITIONED_EMAILS", "false").lower() == "true"
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+# Mail from before this month (YYYY-MM) stays in emails_default rather than
+# getting a partition per month, so a decades-old archive does not create
+# hundreds of tiny ones. Empty partitions every month.
+PARTITION_OLDEST_MONTH = os.getenv("PARTITION_OLDEST_MONTH", "")
+
+# Secondary indexes used by hybrid search and the search filters
+SEARCH_INDEXES = [
+    ("emails_search_tsv_idx", "USING GIN (search_tsv)"),
+    ("emails_tags_idx", "USING GIN (tags)"),
+    ("emails_sender_idx", "(lower(sender))"),
+    ("emails_timestamp_idx", '("timestamp")'),
+]
+
+# When each row got its current embedding; vector_store.py appends by it
+EMBEDDED_AT_INDEX_NAME = "emails_embedded_at_idx"
+
+# Deduplicates fetched Gmail messages. Mail from other sources has no message_id (NULL).
+MESSAGE_ID_INDEX_NAME = "emails_message_id_key"
+
+# Arbitrary key for the advisory lock that serializes concurrent migrations
+MIGRATION_LOCK_ID = 7_305_117
+
+
+# --- DDL Helpers ---
+
+def vector_index_name(quantization="none"):
+    return VECTOR_INDEX_NAME if quantization == "none" else QUANTIZED_INDEXES[quantization][0]
+
+def vector_index_sql(name=VECTOR_INDEX_NAME, method=VECTOR_INDEX_METHOD, m=HNSW_M,
+                     ef_construction=HNSW_EF_CONSTRUCTION, lists=IVFFLAT_LISTS, concurrently=False,
+                     table="emails", only=False, quantization="none"):
+    """
+    Builds the CREATE INDEX statement for the cosine index on
+    `table`.embedding, or for one of the QUANTIZED_INDEXES expressions.
+    """
+    if method == "hnsw":
+        options = sql.SQL("WITH (m = {}, ef_construction = {})").format(sql.Literal(m), sql.Literal(ef_construction))
+    elif method == "ivfflat":
+        options = sql.SQL("WITH (lists = {})").format(sql.Literal(lists))
+    else:
+        raise ValueError(f"Unknown vector index method '{method}'. Use 'hnsw' or 'ivfflat'.")
+    if quantization == "none":
+        key = "embedding vector_cosine_ops"
+    elif quantization in QUANTIZED_INDEXES:
+        _, expression, opclass = QUANTIZED_INDEXES[quantization]
+        key = f"{expression} {opclass}"
+    else:
+        raise ValueError(f"Unknown quantization '{quantization}'. Use one of {', '.join(VECTOR_QUANTIZATIONS)}.")
+
+    return sql.SQL("CREATE INDEX {concurrently} IF NOT EXISTS {name} ON {only} {table} USING {method} ({key}) {options}").format(
+        concurrently=sql.SQL("CONCURRENTLY" if concurrently else ""),
+        name=sql.Identifier(name),
+        only=sql.SQL("ONLY" if only else ""),
+        table=sql.Identifier(table),
+        method=sql.SQL(method),
+        key=sql.SQL(key),
+        options=options,
+    )
+
+def emails_table_sql(partitioned=False):
+    """The CREATE TABLE statement for 'emails', optionally range-partitioned by month."""
+    if partitioned:
+        # The partition key has to be part of the primary key, so it cannot be NULL
+        timestamp_column = 'TIMESTAMPTZ NOT NULL DEFAULT NOW()'
+        primary_key = 'PRIMARY KEY (id, "timestamp")'
+        partitioning = 'PARTITION BY RANGE ("timestamp")'
+    else:
+        timestamp_column = 'TIMESTAMPTZ DEFAULT NOW()'
+        primary_key = 'PRIMARY KEY (id)'
+        partitioning = ''
+    return f"""
+        CREATE TABLE IF NOT EXISTS emails (
+            id SERIAL,
+            message_id VARCHAR(255),
+            sender VARCHAR(255) NOT NULL,
+            recipient VARCHAR(255) NOT NULL,
+            subject TEXT,
+            body TEXT,
+            "timestamp" {timestamp_column},
+            tags TEXT[],
+            embedding VECTOR({VECTOR_DIMENSION}),
+            {primary_key}
+        ) {partitioning};
+    """
+
+def create_search_indexes(cur, table="emails", suffix=""):
+    """Creates the full-text and filter indexes on `table`, with `suffix` appended to their names."""
+    for name, definition in SEARCH_INDEXES:
+        cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} {}").format(
+            sql.Identifier(name + suffix), sql.Identifier(table), sql.SQL(definition)))
+
+def create_message_id_index(cur, table="emails", suffix=""):
+    """
+    Unique index on message_id. A unique index on a partitioned table must
+    include the partition key, so there it covers (message_id, "timestamp").
+    That only catches a resynced duplicate because the timestamp is stable:
+    gmail_fetch.parse_message takes it from the Date header or else Gmail's
+    internalDate, never from the fetch time.
+    """
+    columns = 'message_id, "timestamp"' if is_partitioned(cur, table) else 'message_id'
+    cur.execute(sql.SQL("CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} ({})").format(
+        sql.Identifier(MESSAGE_ID_INDEX_NAME + suffix), sql.Identifier(table), sql.SQL(columns)))
+
+def create_embedded_at_tracking(cur, table="emails", suffix=""):
+    """
+    Stamps emails.embedded_at with the writing transaction's start time
+    (now()) whenever a row is inserted with an embedding or its embedding
+    changes. An insert that already carries embedded_at (a copy between
+    tables) keeps it. Expects the column to exist.
+    """
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION emails_set_embedded_at() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                IF NEW.embedding IS NULL THEN
+                    NEW.embedded_at := NULL;
+                ELSIF NEW.embedded_at IS NULL THEN
+                    NEW.embedded_at := now();
+                END IF;
+            ELSIF NEW.embedding IS DISTINCT FROM OLD.embedding THEN
+                NEW.embedded_at := CASE WHEN NEW.embedding IS NULL THEN NULL ELSE now() END;
+            END IF;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+    """)
+    cur.execute(sql.SQL("DROP TRIGGER IF EXISTS emails_embedded_at ON {}").format(sql.Identifier(table)))
+    cur.execute(sql.SQL("""
+        CREATE TRIGGER emails_embedded_at BEFORE INSERT OR UPDATE OF embedding ON {}
+        FOR EACH ROW EXECUTE FUNCTION emails_set_embedded_at()
+    """).format(sql.Identifier(table)))
+    cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (embedded_at)").format(
+        sql.Identifier(EMBEDDED_AT_INDEX_NAME + suffix), sql.Identifier(table)))
+
+def quantized_indexes_present(cur, table="emails"):
+    """The quantizations whose compact index exists on `table`."""
+    cur.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s", (table,))
+    names = {row[0] for row in cur.fetchall()}
+    return [quantization for quantization, (name, _, _) in QUANTIZED_INDEXES.items() if name in names]
+
+def table_columns(cur, table):
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+    """, (table,))
+    return {row[0] for row in cur.fetchall()}
+
+
+# --- Partition Helpers ---
+
+def add_months(day, months):
+    """The first day of the month `months` after `day`'s month."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def utc_month(ts):
+    """The first day of the UTC month of a datetime (naive ones are taken as UTC)."""
+    return add_months((ts.astimezone(timezone.utc) if ts.tzinfo else ts).date(), 0)
+
+def month_start(month):
+    """The instant `month` starts in UTC, as a literal that ignores the session time zone."""
+    return f"{month.isoformat()} 00:00:00+00"
+
+def oldest_partition_month():
+    """The first month that gets its own partition (PARTITION_OLDEST_MONTH), or None."""
+    if not PARTITION_OLDEST_MONTH:
+        return None
+    return date.fromisoformat(f"{PARTITION_OLDEST_MONTH}-01")
+
+def partition_name(month):
+    """Partitions are named after the final table, e.g. emails_y2024m05."""
+    return f"emails_y{month:%Y}m{month:%m}"
+
+def is_partitioned(cur, table="emails"):
+    cur.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", (table,))
+    return cur.fetchone() is not None
+
+def list_partitions(cur, table="emails"):
+    cur.execute("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname
+    """, (table,))
+    return [row[0] for row in cur.fetchall()]
+
+def create_partition(cur, month, table="emails"):
+    """Creates the partition of `table` for `month` unless it exists. Returns True if it was created."""
+    name = partition_name(month)
+    cur.execute("SELECT to_regclass(%s)", (name,))
+    if cur.fetchone()[0] is not None:
+        return False
+    cur.execute("SAVEPOINT create_partition")
+    try:
+        cur.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})").format(
+            sql.Identifier(name), sql.Identifier(table),
+            sql.Literal(month_start(month)), sql.Literal(month_start(add_months(month, 1)))))
+        cur.execute("RELEASE SAVEPOINT create_partition")
+        return True
+    except psycopg2.Error as e:
+        # Rows for that month already sit in the default partition
+        cur.execute("ROLLBACK TO SAVEPOINT create_partition")
+        print(f"⚠️ Could not create partition '{name}': {e}. "
+              "Run 'python setup_db.py split-default' to move those rows out.", file=sys.stderr)
+        return False
+
+def ensure_partitions(cur, table="emails", first_month=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    Creates the monthly partitions from `first_month` (default: the current
+    month; never before PARTITION_OLDEST_MONTH) through `months_ahead` months
+    from now, plus a default partition for anything outside them. Indexes defined on the parent are created on
+    each new partition automatically. Returns the names of the new partitions.
+    """
+    if not is_partitioned(cur, table):
+        return []
+
+    created = []
+    cur.execute(sql.SQL("CREATE TABLE IF NOT EXISTS emails_default PARTITION OF {} DEFAULT").format(sql.Identifier(table)))
+    month = utc_month(first_month) if isinstance(first_month, datetime) else add_months(first_month or date.today(), 0)
+    oldest = oldest_partition_month()
+    if oldest and month < oldest:
+        month = oldest
+    last = add_months(date.today(), months_ahead)
+    while month <= last:
+        if create_partition(cur, month, table):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+def ensure_partitions_for(cur, timestamps, table="emails"):
+    """
+    Creates the partitions for the months of `timestamps` before they are
+    inserted, so historical mail (old_mail.py, a full Gmail resync) does not
+    land in the default partition. Months before PARTITION_OLDEST_MONTH are
+    left to the default partition. Each new partition locks the whole table
+    until commit, so run this in a short transaction of its own, not in the
+    one that inserts the rows. Returns the names of the new partitions.
+    """
+    if not is_partitioned(cur, table):
+        return []
+    oldest = oldest_partition_month()
+    months = {utc_month(ts) for ts in timestamps if ts is not None}
+    months = {month for month in months if not oldest or month >= oldest}
+    return [partition_name(month) for month in sorted(months) if create_partition(cur, month, table)]
+
+def split_default_partition(cur, table="emails"):
+    """
+    Moves the rows of the default partition into monthly partitions (from
+    PARTITION_OLDEST_MONTH on; older mail stays where it is). For
+    each month found there, its rows are set aside in a temporary table, the
+    partition is created (which Postgres refuses while the default partition
+    holds rows of that month), and the rows are inserted back with their ids.
+    Run it in one transaction: creating a partition locks the whole table
+    until commit.
+    Returns the names of the partitions created.
+    """
+    if not is_partitioned(cur, table):
+        return []
+    cur.execute("SELECT to_regclass('emails_default') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return []
+
+    # Generated columns (search_tsv) are recomputed on insert
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """, (table,))
+    columns = sql.SQL(", ").join(sql.Identifier(row[0]) for row in cur.fetchall())
+
+    cur.execute("""
+        SELECT DISTINCT date_trunc('month', "timestamp" AT TIME ZONE 'UTC')::date FROM emails_default ORDER BY 1
+    """)
+    oldest = oldest_partition_month()
+    months = [row[0] for row in cur.fetchall() if not oldest or row[0] >= oldest]
+    created = []
+    for month in months:
+        bounds = (month_start(month), month_start(add_months(month, 1)))
+        cur.execute(sql.SQL("CREATE TEMP TABLE emails_split AS SELECT {} FROM emails_default WITH NO DATA")
+                    .format(columns))
+        cur.execute(sql.SQL("""
+            WITH moved AS (
+                DELETE FROM emails_default WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING {columns}
+            )
+            INSERT INTO emails_split SELECT * FROM moved
+        """).format(columns=columns), bounds)
+        moved = cur.rowcount
+        if create_partition(cur, month, table):
+            created.append(partition_name(month))
+            print(f"  Moved {moved} row(s) into '{partition_name(month)}'.")
+        # Into the new partition, or back into the default one if it could not be created
+        cur.execute(sql.SQL("INSERT INTO {table} ({columns}) SELECT {columns} FROM emails_split").format(
+            table=sql.Identifier(table), columns=columns))
+        cur.execute("DROP TABLE emails_split")
+    return created
+
+
+# --- Migrations ---
+# Each migration takes a cursor plus the index options passed to migrate().
+# Append new ones at the end; never edit or renumber one that has shipped.
+
+def create_emails_table(cur, partitioned=PARTITIONED_EMAILS, **options):
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+    cur.execute("SELECT to_regclass('emails') IS NOT NULL")
+    existed = cur.fetchone()[0]
+    cur.execute(emails_table_sql(partitioned=partitioned and not existed))
+
+    # A table created by the fetcher's old SQLAlchemy create_all() has
+    # received_date instead of "timestamp", a NOT NULL message_id and lacks
+    # the search columns
+    columns = table_columns(cur, "emails")
+    if "received_date" in columns:
+        if "timestamp" in columns:
+            cur.execute('UPDATE emails SET "timestamp" = received_date WHERE received_date IS NOT NULL')
+            cur.execute("ALTER TABLE emails DROP COLUMN received_date")
+        else:
+            cur.execute('ALTER TABLE emails RENAME COLUMN received_date TO "timestamp"')
+            cur.execute('ALTER TABLE emails ALTER COLUMN "timestamp" TYPE TIMESTAMPTZ')
+            cur.execute('ALTER TABLE emails ALTER COLUMN "timestamp" SET DEFAULT NOW()')
+    if "message_id" in columns:
+        relax_message_id(cur)
+    cur.execute(f"""
+        ALTER TABLE emails
+            ADD COLUMN IF NOT EXISTS message_id VARCHAR(255),
+            ADD COLUMN IF NOT EXISTS "timestamp" TIMESTAMPTZ DEFAULT NOW(),
+            ADD COLUMN IF NOT EXISTS tags TEXT[],
+            ADD COLUMN IF NOT EXISTS embedding VECTOR({VECTOR_DIMENSION});
+    """)
+
+    if partitioned and existed and not is_partitioned(cur):
+        print("ℹ️ 'emails' already exists unpartitioned. Run 'python setup_db.py partition' to migrate it.")
+    created = ensure_partitions(cur)
+    if created:
+        print(f"  Created {len(created)} monthly partition(s).")
+
+def create_vector_index(cur, method=VECTOR_INDEX_METHOD, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION,
+                        lists=IVFFLAT_LISTS, **options):
+    # On a partitioned table this creates one index per partition
+    cur.execute(sql.SQL("SET LOCAL maintenance_work_mem = {}").format(sql.Literal(INDEX_BUILD_MEMORY)))
+    cur.execute(vector_index_sql(method=method, m=m, ef_construction=ef_construction, lists=lists))
+
+def create_full_text_search(cur, **options):
+    # The 'simple' configuration keeps addresses and IDs as exact tokens
+    cur.execute("""
+        ALTER TABLE emails ADD COLUMN IF NOT EXISTS search_tsv tsvector
+        GENERATED ALWAYS AS (
+            to_tsvector('simple', coalesce(sender, '') || ' ' || coalesce(subject, '') || ' ' || coalesce(body, ''))
+        ) STORED;
+    """)
+    create_search_indexes(cur)
+
+def create_message_id_key(cur, **options):
+    create_message_id_index(cur)
+    # Indexes left behind by the old create_all(), made redundant by the above and the primary key
+    cur.execute("DROP INDEX IF EXISTS ix_emails_message_id")
+    cur.execute("DROP INDEX IF EXISTS ix_emails_id")
+
+def create_summaries_table(cur, **options):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS summaries (
+            email_id INTEGER NOT NULL,
+            content_hash CHAR(64) NOT NULL,
+            model_name TEXT NOT NULL,
+            prompt_version TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            PRIMARY KEY (email_id, content_hash, model_name, prompt_version)
+        );
+    """)
+
+def create_sync_state_table(cur, **options):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            account VARCHAR(255) PRIMARY KEY,
+            history_id VARCHAR(64) NOT NULL,
+            updated_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'utc')
+        );
+    """)
+
+def create_backfill_checkpoints_table(cur, **options):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+            worker TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            processed BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        );
+    """)
+
+def create_email_labels_table(cur, **options):
+    # Confirmed categories, the training data of train_classifier.py --source db.
+    # Relabeling an email moves labeled_at forward so the next update sees it.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS email_labels (
+            email_id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL,
+            labeled_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS email_labels_labeled_at_idx ON email_labels (labeled_at, email_id)")
+
+def relax_message_id(cur, **options):
+    # Mail from ingest.py and other non-Gmail sources has no message_id. Also
+    # fixes tables from the old create_all() that already passed migration 1.
+    cur.execute("ALTER TABLE emails ALTER COLUMN message_id DROP NOT NULL")
+
+def create_embedded_at_column(cur, **options):
+    # Rows embedded before this migration keep NULL; a vector store export
+    # reads every embedded row regardless, appends only what comes after it.
+    cur.execute("ALTER TABLE emails ADD COLUMN IF NOT EXISTS embedded_at TIMESTAMPTZ")
+    create_embedded_at_tracking(cur)
+
+def create_sync_failures_table(cur, **options):
+    # Gmail messages the fetcher could not fetch or store. A row is 'dead'
+    # once the failure is permanent or repeated too often; the history sync
+    # then moves its checkpoint past the message instead of retrying forever.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sync_failures (
+            account VARCHAR(255) NOT NULL,
+            message_id VARCHAR(255) NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            dead BOOLEAN NOT NULL DEFAULT FALSE,
+            last_error TEXT,
+            first_failed_at TIMESTAMPTZ DEFAULT NOW(),
+            last_failed_at TIMESTAMPTZ DEFAULT NOW(),
+            PRIMARY KEY (account, message_id)
+        );
+    """)
+
+MIGRATIONS = [
+    (1, "emails table", create_emails_table),
+    (2, "vector index on emails.embedding", create_vector_index),
+    (3, "full-text search column and filter indexes", create_full_text_search),
+    (4, "unique index on emails.message_id", create_message_id_key),
+    (5, "summaries table", create_summaries_table),
+    (6, "sync_state table", create_sync_state_table),
+    (7, "backfill_checkpoints table", create_backfill_checkpoints_table),
+    (8, "email_labels table", create_email_labels_table),
+    (9, "nullable emails.message_id", relax_message_id),
+    (10, "emails.embedded_at column and trigger", create_embedded_at_column),
+    (11, "sync_failures table", create_sync_failures_table),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def applied_versions(cur):
+    """The set of migration versions recorded in the database."""
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return set()
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+def pending_migrations(cur):
+    """The (version, description) pairs not yet applied to the database."""
+    applied = applied_versions(cur)
+    return [(version, description) for version, description, _ in MIGRATIONS if version not in applied]
+
+def migrate(conn, **options):
+    """
+    Applies the pending migrations in one transaction and returns their
+    versions. `options` (method, m, ef_construction, lists, partitioned) are
+    passed to every migration.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ DEFAULT NOW()
+            );
+        """)
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        applied = applied_versions(cur)
+        done = []
+        for version, description, migration in MIGRATIONS:
+            if version in applied:
+                continue
+            print(f"--- Migration {version}: {description} ---")
+            migration(cur, **options)
+            cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)", (version, description))
+            done.append(version)
+    conn.commit()
+    return done
@@ -0,0 +1,402 @@
+import os
+import json
+from datetime import datetime, timedelta, timezone
+
+from schema import VECTOR_DIMENSION, VECTOR_QUANTIZATIONS
+
+# ==============================================================================
+# Search logic shared by the Flask app (app.py, psycopg2) and the async
+# FastAPI app (main.py, psycopg 3). A search is a "plan": a generator that
+# yields (sql, params) statements and receives each statement's rows back, so
+# the same SQL and decision logic runs on either driver.
+# ==============================================================================
+
+# --- Configuration ---
+# Per-query ANN search settings (see schema.py for the index itself).
+# Higher values trade latency for recall.
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+SEARCH_LIMIT = 5  # default page size
+MAX_SEARCH_LIMIT = 100
+MAX_SEARCH_OFFSET = 1000
+
+# 'vector' ranks by embedding distance only; 'hybrid' fuses it with full-text
+# matches (sender addresses, invoice numbers, order IDs) using reciprocal
+# rank fusion.
+SEARCH_MODES = ("vector", "hybrid")
+DEFAULT_SEARCH_MODE = os.getenv("DEFAULT_SEARCH_MODE", "vector")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))  # per ranking, before fusion
+RRF_K = 60  # the usual reciprocal rank fusion constant
+TEXT_SEARCH_CONFIG = "simple"  # must match the search_tsv column in schema.py
+
+# Filtered search strategy. When the planner expects at most
+# PREFILTER_MAX_ROWS matching emails, they are filtered first (tag, sender
+# and timestamp indexes) and ranked exactly. Otherwise the ANN index is
+# scanned for POSTFILTER_OVERSAMPLE times more rows than needed and filtered
+# afterwards, doubling the scan until the page is full. hnsw.ef_search caps
+# an index scan at MAX_ANN_CANDIDATES rows, beyond that the exact path takes
+# over; so does any search (filtered or not, any mode or quantization) whose
+# offset + limit needs more rows than that from the index.
+PREFILTER_MAX_ROWS = int(os.getenv("PREFILTER_MAX_ROWS", "20000"))
+POSTFILTER_OVERSAMPLE = 4
+MAX_ANN_CANDIDATES = 1000
+
+# Compact vector indexes (see schema.py). With quantization 'halfvec' or
+# 'binary' the index scan ranks QUANTIZED_OVERSAMPLE times more rows than
+# needed by the compact distance, and that shortlist is re-ranked by the exact
+# distance on the full-precision column. 'none' uses the full-precision index.
+DEFAULT_QUANTIZATION = os.getenv("DEFAULT_QUANTIZATION", "none")
+QUANTIZED_OVERSAMPLE = {
+    "none": 1,
+    "halfvec": int(os.getenv("HALFVEC_OVERSAMPLE", "2")),
+    "binary": int(os.getenv("BINARY_OVERSAMPLE", "10")),
+}
+# ORDER BY of the index scan; must match the indexed expressions in schema.py
+INDEX_DISTANCES = {
+    "none": "embedding <=> %s",
+    "halfvec": f"embedding::halfvec({VECTOR_DIMENSION}) <=> %s::halfvec({VECTOR_DIMENSION})",
+    "binary": f"binary_quantize(embedding)::bit({VECTOR_DIMENSION}) <~> binary_quantize(%s::vector)",
+}
+
+RESULT_COLUMNS = "id, sender, subject, body, timestamp, tags"
+
+
+class SearchError(ValueError):
+    """An invalid search request. The message is safe to return to the client."""
+
+
+def _int_option(data, name, default, low, high):
+    try:
+        value = int(data.get(name, default))
+    except (TypeError, ValueError):
+        raise SearchError(f"'{name}' must be an integer")
+    if not low <= value <= high:
+        raise SearchError(f"'{name}' must be between {low} and {high}")
+    return value
+
+
+def _date_option(data, name, end_of_day=False):
+    """
+    Parses an ISO date or datetime; one without a UTC offset is taken as UTC,
+    so every bound is offset-aware and they compare. A bare date used as an
+    upper bound covers that whole day.
+    """
+    value = data.get(name)
+    if value in (None, ""):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise SearchError(f"'{name}' must be an ISO date such as 2024-05-31")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def _parse_filters(data):
+    filters = {}
+
+    tags = data.get('tags')
+    if isinstance(tags, str):
+        tags = [tags]
+    if tags:
+        if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+            raise SearchError("'tags' must be a list of strings")
+        filters['tags'] = tags
+
+    sender = data.get('sender')
+    if sender:
+        if not isinstance(sender, str):
+            raise SearchError("'sender' must be a string")
+        filters['sender'] = sender
+
+    date_from = _date_option(data, 'date_from')
+    date_to = _date_option(data, 'date_to', end_of_day=True)
+    if date_from and date_to and date_from >= date_to:
+        raise SearchError("'date_from' must be before 'date_to'")
+    if date_from:
+        filters['date_from'] = date_from
+    if date_to:
+        filters['date_to'] = date_to
+    return filters
+
+
+def parse_search_options(data):
+    """Validates a search request body and returns the normalized options."""
+    if not data or not isinstance(data.get('query'), str) or not data['query'].strip():
+        raise SearchError("Missing 'query' in request body")
+    mode = data.get('mode', DEFAULT_SEARCH_MODE)
+    if mode not in SEARCH_MODES:
+        raise SearchError(f"'mode' must be one of {', '.join(SEARCH_MODES)}")
+    quantization = data.get('quantization', DEFAULT_QUANTIZATION)
+    if quantization not in VECTOR_QUANTIZATIONS:
+        raise SearchError(f"'quantization' must be one of {', '.join(VECTOR_QUANTIZATIONS)}")
+    return {
+        "query": data['query'],
+        "mode": mode,
+        "quantization": quantization,
+        "filters": _parse_filters(data),
+        "limit": _int_option(data, 'limit', SEARCH_LIMIT, 1, MAX_SEARCH_LIMIT),
+        "offset": _int_option(data, 'offset', 0, 0, MAX_SEARCH_OFFSET),
+        "ef_search": _int_option(data, 'ef_search', HNSW_EF_SEARCH, 1, 1000),
+        "probes": _int_option(data, 'probes', IVFFLAT_PROBES, 1, 10000),
+    }
+
+
+def filter_clause(filters):
+    """Returns (sql, params) for the WHERE conditions of `filters`; sql is '' without filters."""
+    conditions = []
+    params = []
+    if 'tags' in filters:
+        conditions.append("tags && %s::text[]")  # any of the tags, served by the GIN index
+        params.append(filters['tags'])
+    if 'sender' in filters:
+        conditions.append("lower(sender) = lower(%s)")
+        params.append(filters['sender'])
+    date_sql, date_params = date_range_clause(filters)
+    if date_sql:
+        conditions.append(date_sql)
+        params.extend(date_params)
+    return " AND ".join(conditions), params
+
+
+def date_range_clause(filters):
+    """
+    Returns (sql, params) for the date range of `filters` alone. On a table
+    partitioned by month (see schema.py) it limits a scan to the matching
+    partitions.
+    """
+    conditions = []
+    params = []
+    if 'date_from' in filters:
+        conditions.append('"timestamp" >= %s')
+        params.append(filters['date_from'])
+    if 'date_to' in filters:
+        conditions.append('"timestamp" < %s')
+        params.append(filters['date_to'])
+    return " AND ".join(conditions), params
+
+
+def index_settings_statement(ef_search, probes):
+    """
+    set_config(..., true) is SET LOCAL: it lasts for this transaction only.
+    Whichever setting does not match the current index type is ignored.
+    """
+    return (
+        "SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+        (str(ef_search), str(probes)),
+    )
+
+
+def estimate_statement(filters_sql, filter_params):
+    """Asks the planner how many emails match the filters, without running the query."""
+    return f"EXPLAIN (FORMAT JSON) SELECT 1 FROM emails WHERE {filters_sql}", filter_params
+
+
+def _estimated_rows(rows):
+    plan = rows[0]['QUERY PLAN']
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+def semantic_candidates(query_embedding, count, filters_sql="", filter_params=(), strategy="ann", scan=None,
+                        date_sql="", date_params=(), quantization="none"):
+    """
+    Returns (sql, params) selecting the `count` nearest (id, distance) rows
+    that pass the filters, using either strategy. `date_sql` (part of the
+    filters) is also applied to the index scan itself so that partitions
+    outside the date range are skipped. With a compact `quantization` the
+    index scan returns a shortlist of `scan` rows, which is re-ranked exactly.
+    """
+    if strategy == "exact":
+        # OFFSET 0 stops the planner from serving the ORDER BY with the ANN
+        # index, which would filter after the index scan (or stop at
+        # ef_search rows) and lose rows.
+        where = f"WHERE {filters_sql}" if filters_sql else ""
+        return (
+            f"""
+            SELECT id, distance FROM (
+                SELECT id, embedding <=> %s AS distance FROM emails {where} OFFSET 0
+            ) filtered
+            ORDER BY distance LIMIT %s
+            """,
+            [query_embedding, *filter_params, count],
+        )
+    if quantization != "none":
+        outer_filter = f"WHERE {filters_sql}" if filters_sql else ""
+        scan_filter = f"WHERE {date_sql}" if date_sql else ""
+        return (
+            f"""
+            SELECT id, embedding <=> %s AS distance FROM (
+                SELECT id, sender, tags, "timestamp", embedding
+                FROM emails {scan_filter} ORDER BY {INDEX_DISTANCES[quantization]} LIMIT %s
+            ) shortlist
+            {outer_filter}
+            ORDER BY distance LIMIT %s
+            """,
+            [query_embedding, *date_params, query_embedding, scan, *filter_params, count],
+        )
+    if not filters_sql:
+        return (
+            "SELECT id, embedding <=> %s AS distance FROM emails ORDER BY distance LIMIT %s",
+            [query_embedding, count],
+        )
+    scan_filter = f"WHERE {date_sql}" if date_sql else ""
+    return (
+        f"""
+        SELECT id, distance FROM (
+            SELECT id, sender, tags, "timestamp", embedding <=> %s AS distance
+            FROM emails {scan_filter} ORDER BY distance LIMIT %s
+        ) nearest
+        WHERE {filters_sql}
+        ORDER BY distance LIMIT %s
+        """,
+        [query_embedding, *date_params, scan, *filter_params, count],
+    )
+
+
+def vector_statement(candidates, limit, offset):
+    candidates_sql, params = candidates
+    return (
+        f"""
+        SELECT {RESULT_COLUMNS}, candidates.distance
+        FROM ({candidates_sql}) candidates JOIN emails USING (id)
+        ORDER BY candidates.distance ASC
+        LIMIT %s OFFSET %s
+        """,
+        (*params, limit, offset),
+    )
+
+
+def hybrid_statement(candidates, query_embedding, query_text, limit, offset, filters_sql="", filter_params=(),
+                     lexical_count=HYBRID_CANDIDATES):
+    """
+    One round trip: the semantic candidates (served by the ANN index) and the
+    top full-text matches (served by the GIN index) are fused with reciprocal
+    rank fusion.
+    """
+    candidates_sql, candidate_params = candidates
+    lexical_filter = f"AND {filters_sql}" if filters_sql else ""
+    return (
+        f"""
+        WITH semantic AS (
+            SELECT id, row_number() OVER (ORDER BY distance) AS semantic_rank
+            FROM ({candidates_sql}) nearest
+        ),
+        lexical AS (
+            SELECT id, row_number() OVER (ORDER BY text_rank DESC) AS lexical_rank
+            FROM (
+                SELECT id, ts_rank_cd(search_tsv, text_query) AS text_rank
+                FROM emails, websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', %s) AS text_query
+                WHERE search_tsv @@ text_query {lexical_filter}
+                ORDER BY text_rank DESC
+                LIMIT %s
+            ) matches
+        ),
+        fused AS (
+            SELECT id,
+                   COALESCE(1.0 / (%s + semantic_rank), 0) + COALESCE(1.0 / (%s + lexical_rank), 0) AS score
+            FROM semantic FULL OUTER JOIN lexical USING (id)
+        )
+        SELECT {RESULT_COLUMNS}, embedding <=> %s AS distance, fused.score
+        FROM fused JOIN emails USING (id)
+        ORDER BY fused.score DESC, distance ASC
+        LIMIT %s OFFSET %s
+        """,
+        (*candidate_params, query_text, *filter_params, lexical_count, RRF_K, RRF_K, query_embedding, limit, offset),
+    )
+
+
+def search_plan(query_embedding, options):
+    """Yields the statements for one search and returns the result rows."""
+    limit = options['limit']
+    offset = options['offset']
+    needed = limit + offset
+    hybrid = options['mode'] == "hybrid"
+    count = max(needed, HYBRID_CANDIDATES) if hybrid else needed
+    filters_sql, filter_params = filter_clause(options['filters'])
+    date_sql, date_params = date_range_clause(options['filters'])
+    quantization = options.get('quantization', "none")
+
+    strategy = "ann"
+    if filters_sql:
+        rows = yield estimate_statement(filters_sql, filter_params)
+        if _estimated_rows(rows) <= PREFILTER_MAX_ROWS:
+            strategy = "exact"
+    # A deep page needs more rows than an index scan returns, which would
+    # leave it short or empty
+    if count * QUANTIZED_OVERSAMPLE[quantization] > MAX_ANN_CANDIDATES:
+        strategy = "exact"
+    scan = min(count * POSTFILTER_OVERSAMPLE, MAX_ANN_CANDIDATES)
+
+    while True:
+        # Rows the index scan has to return: the post-filter scan, or just the
+        # page, times the shortlist factor of a compact index
+        index_rows = min((scan if filters_sql else count) * QUANTIZED_OVERSAMPLE[quantization], MAX_ANN_CANDIDATES)
+        # The ANN index returns at most ef_search rows, so it must cover the scan
+        ef_search = max(options['ef_search'], index_rows)
+        yield index_settings_statement(min(ef_search, MAX_ANN_CANDIDATES), options['probes'])
+
+        candidates = semantic_candidates(query_embedding, count, filters_sql, filter_params, strategy,
+                                         max(index_rows, count), date_sql, date_params, quantization)
+        if hybrid:
+            statement = hybrid_statement(candidates, query_embedding, options['query'], limit, offset,
+                                         filters_sql, filter_params, max(needed, HYBRID_CANDIDATES))
+        else:
+            statement = vector_statement(candidates, limit, offset)
+        rows = yield statement
+
+        # A short page after post-filtering may just mean the scan was too
+        # small; widen it, and fall back to the exact path once it cannot grow.
+        if strategy == "exact" or not filters_sql or len(rows) >= limit:
+            return rows
+        if index_rows >= MAX_ANN_CANDIDATES:
+            strategy = "exact"
+        else:
+            scan = min(scan * 2, MAX_ANN_CANDIDATES)
+
+
+def local_index_supports(options):
+    """Whether an in-process vector index (vector_store.py) can serve the search: vector mode, no filters."""
+    return options['mode'] == "vector" and not options['filters']
+
+
+def local_index_plan(index, query_embedding, options):
+    """
+    Ranks with an in-process vector index such as vector_store.MmapVectorIndex
+    and only fetches the rows of the page from the database, by id.
+    """
+    hits = index.search(query_embedding, options['limit'] + options['offset'])[options['offset']:]
+    if not hits:
+        return []
+    rows = yield f"SELECT {RESULT_COLUMNS} FROM emails WHERE id = ANY(%s)", ([email_id for email_id, _ in hits],)
+    by_id = {row['id']: row for row in rows}
+    # Emails deleted since the index was exported are skipped
+    return [dict(by_id[email_id], distance=distance) for email_id, distance in hits if email_id in by_id]
+
+
+def run_plan(cur, plan):
+    """Executes a plan on a synchronous (psycopg2) cursor and returns its result."""
+    try:
+        statement = next(plan)
+        while True:
+            cur.execute(*statement)
+            rows = cur.fetchall() if cur.description is not None else None
+            statement = plan.send(rows)
+    except StopIteration as finished:
+        return finished.value
+
+
+async def run_plan_async(cur, plan):
+    """Executes a plan on an async (psycopg 3) cursor and returns its result."""
+    try:
+        statement = next(plan)
+        while True:
+            await cur.execute(*statement)
+            rows = await cur.fetchall() if cur.description is not None else None
+            statement = plan.send(rows)
+    except StopIteration as finished:
+        return finished.value
@@ -1,9 +1,20 @@
 import psycopg2
 import os
 import sys
+import argparse
 from psycopg2 import sql
 from dotenv import load_dotenv
 
+# The schema itself (tables, indexes, migrations) is defined in schema.py
+import schema
+from schema import (
+    VECTOR_INDEX_NAME, VECTOR_INDEX_METHOD, HNSW_M, HNSW_EF_CONSTRUCTION,
+    IVFFLAT_LISTS, INDEX_BUILD_MEMORY, PARTITIONED_EMAILS, PARTITION_MONTHS_AHEAD, SEARCH_INDEXES,
+    MESSAGE_ID_INDEX_NAME, EMBEDDED_AT_INDEX_NAME, VECTOR_QUANTIZATIONS, vector_index_name, vector_index_sql, create_search_indexes,
+    create_message_id_index, quantized_indexes_present, is_partitioned, list_partitions, ensure_partitions,
+    split_default_partition, create_embedded_at_tracking,
+)
+
 # --- Load environment variables from .env file ---
 load_dotenv()
 
@@ -14,13 +25,28 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "mysecretpassword")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5433")
 
-# The dimension should match your embedding model output
-VECTOR_DIMENSION = 384
+# --- Partition Migration Configuration ---
+# See migrate_to_partitioned below; the partitioned layout itself is in schema.py
+PARTITION_COPY_BATCH = int(os.getenv("PARTITION_COPY_BATCH", "10000"))
+MIGRATION_TABLE = "emails_partitioned"
+MIGRATION_LOG_TABLE = "emails_migration_log"
+
+def get_connection(dbname=DB_NAME):
+    """Opens a connection to `dbname` with the configured credentials."""
+    return psycopg2.connect(
+        dbname=dbname,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
 
-def setup_database():
+def setup_database(method=VECTOR_INDEX_METHOD, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, lists=IVFFLAT_LISTS,
+                   partitioned=PARTITIONED_EMAILS):
     """
-    Connects to PostgreSQL, creates the database if it doesn't exist,
-    enables the pgvector extension, and creates the necessary table.
+    Connects to PostgreSQL, creates the database if it doesn't exist, and
+    applies the schema migrations from schema.py (pgvector extension,
+    tables, and the vector and search indexes).
     """
     try:
         # Step 1: Connect to the default 'postgres' database
@@ -61,29 +87,15 @@ def setup_database():
         cur = conn.cursor()
         print("✅ Connection to database successful.")
 
-        # Step 4: Enable pgvector extension
-        print("--- Step 4: Enabling 'vector' extension ---")
-        cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-        print("✅ 'vector' extension enabled.")
-
-        # Step 5: Create 'emails' table
-        print("--- Step 5: Creating 'emails' table ---")
-        table_creation_query = f"""
-            CREATE TABLE IF NOT EXISTS emails (
-                id SERIAL PRIMARY KEY,
-                sender VARCHAR(255) NOT NULL,
-                recipient VARCHAR(255) NOT NULL,
-                subject TEXT,
-                body TEXT,
-                "timestamp" TIMESTAMPTZ DEFAULT NOW(),
-                tags TEXT[],
-                embedding VECTOR({VECTOR_DIMENSION})
-            );
-        """
-        cur.execute(table_creation_query)
-        print("✅ 'emails' table created or already exists.")
+        # Step 4: Bring the schema up to date (tables, vector index, search indexes)
+        print(f"--- Step 4: Applying schema migrations (target version {schema.SCHEMA_VERSION}) ---")
+        applied = schema.migrate(conn, method=method, m=m, ef_construction=ef_construction, lists=lists,
+                                 partitioned=partitioned)
+        if applied:
+            print(f"✅ Applied migration(s) {', '.join(map(str, applied))}.")
+        else:
+            print("✅ Schema already up to date.")
 
-        conn.commit()
         print("\n🎉 Database setup complete! 🎉")
 
     except psycopg2.OperationalError as e:
@@ -106,5 +118,282 @@ def setup_database():
             conn.close()
             print("Database connection closed.")
 
+def rebuild_vector_index(method=VECTOR_INDEX_METHOD, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, lists=IVFFLAT_LISTS,
+                         quantization="none"):
+    """
+    Rebuilds the embedding index, e.g. after a large ingest or to try new
+    parameters, or builds one of the compact (halfvec/binary) indexes from
+    schema.py. The new index is built concurrently under a temporary name and
+    swapped in, so searches keep working during the rebuild.
+    """
+    index_name = vector_index_name(quantization)
+    temp_name = f"{index_name}_rebuild"
+    conn = None
+    try:
+        conn = get_connection()
+        conn.autocommit = True  # CREATE/DROP INDEX CONCURRENTLY cannot run in a transaction
+        with conn.cursor() as cur:
+            print(f"--- Rebuilding '{index_name}' ({method}, m={m}, ef_construction={ef_construction}, lists={lists}) ---")
+            cur.execute(sql.SQL("SET maintenance_work_mem = {}").format(sql.Literal(INDEX_BUILD_MEMORY)))
+            if is_partitioned(cur):
+                rebuild_partitioned_vector_index(cur, temp_name, method, m, ef_construction, lists, quantization)
+            else:
+                cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(temp_name)))
+                cur.execute(vector_index_sql(temp_name, method, m, ef_construction, lists, concurrently=True,
+                                             quantization=quantization))
+                cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(index_name)))
+                cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(sql.Identifier(temp_name), sql.Identifier(index_name)))
+            cur.execute("ANALYZE emails")
+        print(f"✅ Index '{index_name}' rebuilt.")
+
+    except psycopg2.Error as e:
+        print(f"\n❌ Index rebuild failed: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    finally:
+        if conn:
+            conn.close()
+
+def rebuild_partitioned_vector_index(cur, temp_name, method, m, ef_construction, lists, quantization="none"):
+    """
+    CONCURRENTLY is not supported on a partitioned table, so the new index is
+    created ON ONLY the parent (invalid until complete), then each partition's
+    index is built concurrently and attached. Only the final drop and rename
+    lock the table, briefly.
+    """
+    index_name = vector_index_name(quantization)
+    child_suffix = "embedding" if quantization == "none" else f"embedding_{quantization}"
+    cur.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(temp_name)))
+    cur.execute(vector_index_sql(temp_name, method, m, ef_construction, lists, only=True, quantization=quantization))
+    partitions = list_partitions(cur)
+    for partition in partitions:
+        child = f"{partition}_{child_suffix}_rebuild"
+        print(f"  Building index on '{partition}'...")
+        cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(child)))
+        cur.execute(vector_index_sql(child, method, m, ef_construction, lists, concurrently=True, table=partition,
+                                     quantization=quantization))
+        cur.execute(sql.SQL("ALTER INDEX {} ATTACH PARTITION {}").format(sql.Identifier(temp_name), sql.Identifier(child)))
+
+    # Dropping the old parent index drops its per-partition indexes too
+    cur.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(index_name)))
+    cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(sql.Identifier(temp_name), sql.Identifier(index_name)))
+    for partition in partitions:
+        cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+            sql.Identifier(f"{partition}_{child_suffix}_rebuild"), sql.Identifier(f"{partition}_{child_suffix}_idx")))
+
+# --- Partition Migration ---
+# Moves an unpartitioned 'emails' table into monthly partitions while the app
+# keeps running. A trigger records the ids of rows written during the copy,
+# the bulk of the data is copied in id batches, the indexes are built on the
+# new table, and only the final catch-up and rename hold a lock that blocks
+# writes (reads continue). The old table is kept as 'emails_unpartitioned'.
+
+CAPTURE_CHANGES_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {MIGRATION_LOG_TABLE} (id INTEGER PRIMARY KEY);
+
+    CREATE OR REPLACE FUNCTION emails_migration_capture() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO {MIGRATION_LOG_TABLE} (id) VALUES (OLD.id) ON CONFLICT DO NOTHING;
+        ELSE
+            INSERT INTO {MIGRATION_LOG_TABLE} (id) VALUES (NEW.id) ON CONFLICT DO NOTHING;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS emails_migration_capture ON emails;
+    CREATE TRIGGER emails_migration_capture
+        AFTER INSERT OR UPDATE OR DELETE ON emails
+        FOR EACH ROW EXECUTE FUNCTION emails_migration_capture();
+"""
+
+def copyable_columns(cur, table="emails"):
+    """The columns of `table` that can be copied (generated columns are recomputed)."""
+    cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+    """, (table,))
+    return [row[0] for row in cur.fetchall()]
+
+def copy_rows_sql(columns, condition):
+    """INSERT ... SELECT from the old table into the new one for rows matching `condition`."""
+    select_list = [
+        sql.SQL('COALESCE("timestamp", NOW())') if column == "timestamp" else sql.Identifier(column)
+        for column in columns
+    ]
+    return sql.SQL("INSERT INTO {new} ({columns}) SELECT {select_list} FROM emails WHERE {condition}").format(
+        new=sql.Identifier(MIGRATION_TABLE),
+        columns=sql.SQL(", ").join(sql.Identifier(column) for column in columns),
+        select_list=sql.SQL(", ").join(select_list),
+        condition=sql.SQL(condition),
+    )
+
+def replay_changes(cur, columns):
+    """Re-copies the rows written since they were copied. Returns how many ids were replayed."""
+    cur.execute(f"DELETE FROM {MIGRATION_LOG_TABLE} RETURNING id")
+    changed_ids = [row[0] for row in cur.fetchall()]
+    if changed_ids:
+        cur.execute(sql.SQL("DELETE FROM {} WHERE id = ANY(%s)").format(sql.Identifier(MIGRATION_TABLE)), (changed_ids,))
+        cur.execute(copy_rows_sql(columns, "id = ANY(%s)"), (changed_ids,))
+    return len(changed_ids)
+
+def migrate_to_partitioned(method=VECTOR_INDEX_METHOD, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION,
+                           lists=IVFFLAT_LISTS, batch_size=PARTITION_COPY_BATCH):
+    """Converts the existing 'emails' table into a monthly partitioned one, see above."""
+    conn = None
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        if is_partitioned(cur):
+            print("✅ 'emails' is already partitioned.")
+            return
+
+        print("--- Step 1: Recording concurrent changes to 'emails' ---")
+        cur.execute(CAPTURE_CHANGES_SQL)
+        conn.commit()
+        columns = copyable_columns(cur)
+
+        print(f"--- Step 2: Creating partitioned table '{MIGRATION_TABLE}' ---")
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(MIGRATION_TABLE)))
+        cur.execute(sql.SQL("""
+            CREATE TABLE {} (LIKE emails INCLUDING DEFAULTS INCLUDING GENERATED)
+            PARTITION BY RANGE ("timestamp")
+        """).format(sql.Identifier(MIGRATION_TABLE)))
+        cur.execute(sql.SQL('ALTER TABLE {} ADD PRIMARY KEY (id, "timestamp")').format(sql.Identifier(MIGRATION_TABLE)))
+        cur.execute('SELECT MIN("timestamp") FROM emails')
+        first_month = cur.fetchone()[0]
+        created = ensure_partitions(cur, MIGRATION_TABLE, first_month=first_month)
+        conn.commit()
+        print(f"✅ Created {len(created)} monthly partition(s).")
+
+        print("--- Step 3: Copying rows ---")
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM emails")
+        max_id = cur.fetchone()[0]
+        for start in range(0, max_id, batch_size):
+            cur.execute(copy_rows_sql(columns, "id > %s AND id <= %s"), (start, start + batch_size))
+            conn.commit()
+            print(f"  Copied ids up to {min(start + batch_size, max_id)} of {max_id}...")
+        print(f"✅ Caught up on {replay_changes(cur, columns)} row(s) changed during the copy.")
+        conn.commit()
+
+        print("--- Step 4: Building indexes on the new table ---")
+        cur.execute(sql.SQL("SET maintenance_work_mem = {}").format(sql.Literal(INDEX_BUILD_MEMORY)))
+        cur.execute(vector_index_sql(f"{VECTOR_INDEX_NAME}_new", method, m, ef_construction, lists, table=MIGRATION_TABLE))
+        quantized = quantized_indexes_present(cur)
+        for quantization in quantized:
+            cur.execute(vector_index_sql(f"{vector_index_name(quantization)}_new", method, m, ef_construction, lists,
+                                         table=MIGRATION_TABLE, quantization=quantization))
+        create_search_indexes(cur, MIGRATION_TABLE, suffix="_new")
+        create_message_id_index(cur, MIGRATION_TABLE, suffix="_new")
+        if "embedded_at" in columns:
+            create_embedded_at_tracking(cur, MIGRATION_TABLE, suffix="_new")
+        conn.commit()
+        print(f"✅ Caught up on {replay_changes(cur, columns)} row(s) changed during the index build.")
+        conn.commit()
+
+        print("--- Step 5: Swapping tables ---")
+        cur.execute("SET LOCAL lock_timeout = '10s'")
+        cur.execute("LOCK TABLE emails IN SHARE ROW EXCLUSIVE MODE")  # blocks writes, not reads
+        replayed = replay_changes(cur, columns)
+        cur.execute("DROP TRIGGER emails_migration_capture ON emails")
+        cur.execute("SELECT pg_get_serial_sequence('emails', 'id')")
+        sequence = cur.fetchone()[0]
+
+        cur.execute("ALTER TABLE emails RENAME TO emails_unpartitioned")
+        cur.execute("ALTER INDEX IF EXISTS emails_pkey RENAME TO emails_unpartitioned_pkey")
+        cur.execute(sql.SQL("ALTER TABLE {} RENAME TO emails").format(sql.Identifier(MIGRATION_TABLE)))
+        cur.execute(sql.SQL("ALTER INDEX {} RENAME TO emails_pkey").format(sql.Identifier(f"{MIGRATION_TABLE}_pkey")))
+        renamed = [VECTOR_INDEX_NAME, MESSAGE_ID_INDEX_NAME, EMBEDDED_AT_INDEX_NAME] + [name for name, _ in SEARCH_INDEXES]
+        for name in renamed + [vector_index_name(quantization) for quantization in quantized]:
+            cur.execute(sql.SQL("ALTER INDEX IF EXISTS {} RENAME TO {}").format(
+                sql.Identifier(name), sql.Identifier(f"{name}_unpartitioned")))
+            cur.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                sql.Identifier(f"{name}_new"), sql.Identifier(name)))
+        if sequence:
+            # Keeps the id sequence alive if the old table is dropped later
+            cur.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY emails.id").format(sql.SQL(sequence)))
+
+        cur.execute(f"DROP TABLE {MIGRATION_LOG_TABLE}")
+        cur.execute("DROP FUNCTION emails_migration_capture()")
+        conn.commit()
+        print(f"✅ Swapped in the partitioned table ({replayed} row(s) replayed under lock).")
+
+        cur.execute("ANALYZE emails")
+        conn.commit()
+        print("\n🎉 Migration complete! The old table is kept as 'emails_unpartitioned'; drop it once you are satisfied.")
+
+    except psycopg2.Error as e:
+        if conn:
+            conn.rollback()
+        print(f"\n❌ Partition migration failed: {e}", file=sys.stderr)
+        print("   The original 'emails' table is unchanged; it is safe to run the migration again.", file=sys.stderr)
+        sys.exit(1)
+
+    finally:
+        if conn:
+            conn.close()
+
+def create_future_partitions(months_ahead=PARTITION_MONTHS_AHEAD):
+    """Creates the partitions for the coming months. Returns the names created."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            created = ensure_partitions(cur, months_ahead=months_ahead)
+        conn.commit()
+        return created
+    finally:
+        conn.close()
+
+def split_default():
+    """Moves the rows of the default partition into monthly ones. Returns the names created."""
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET lock_timeout = '10s'")
+            created = split_default_partition(cur)
+            if created:
+                cur.execute("ANALYZE emails")
+        conn.commit()
+        return created
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Set up the MailMentor database or manage its vector index.")
+    parser.add_argument('command', nargs='?', choices=['setup', 'reindex', 'partition', 'ensure-partitions', 'split-default'],
+                        default='setup',
+                        help="'partition' migrates an existing table to monthly partitions, "
+                             "'ensure-partitions' creates the partitions for the coming months, "
+                             "'split-default' moves rows out of the default partition into monthly ones")
+    parser.add_argument('--method', choices=['hnsw', 'ivfflat'], default=VECTOR_INDEX_METHOD)
+    parser.add_argument('--m', type=int, default=HNSW_M)
+    parser.add_argument('--ef-construction', type=int, default=HNSW_EF_CONSTRUCTION)
+    parser.add_argument('--lists', type=int, default=IVFFLAT_LISTS)
+    parser.add_argument('--quantization', choices=VECTOR_QUANTIZATIONS, default="none",
+                        help="With 'reindex': build the compact halfvec or binary index instead (see schema.py)")
+    args = parser.parse_args()
+
+    if args.command == 'reindex':
+        rebuild_vector_index(args.method, args.m, args.ef_construction, args.lists, args.quantization)
+    elif args.command == 'partition':
+        migrate_to_partitioned(args.method, args.m, args.ef_construction, args.lists)
+    elif args.command == 'ensure-partitions':
+        created = create_future_partitions()
+        print(f"✅ Created {len(created)} partition(s): {', '.join(created) or 'none needed'}")
+    elif args.command == 'split-default':
+        try:
+            created = split_default()
+        except psycopg2.Error as e:
+            print(f"\n❌ Splitting the default partition failed: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"✅ Created {len(created)} partition(s): {', '.join(created) or 'none needed'}")
+    else:
+        setup_database(args.method, args.m, args.ef_construction, args.lists)
+
 if __name__ == "__main__":
-    setup_database()
+    main()
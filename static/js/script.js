@@ -48,15 +48,62 @@ document.addEventListener('DOMContentLoaded', () => {
     };
 
     // --- Summarization Functionality ---
-    const startSummarization = async (emailId, button) => {
+    const startSummarization = (emailId, button) => {
         button.disabled = true;
         button.textContent = 'Summarizing...';
         const summaryContainer = document.getElementById(`summary-for-${emailId}`);
         summaryContainer.style.display = 'block';
         summaryContainer.innerHTML = 'Generating summary, please wait...';
 
+        if (window.EventSource) {
+            streamSummary(emailId, summaryContainer, button);
+        } else {
+            requestSummary(emailId, summaryContainer, button);
+        }
+    };
+
+    // Streams tokens over Server-Sent Events as the LLM generates them.
+    // Falls back to the task + polling flow if the stream fails before any text arrives.
+    const streamSummary = (emailId, summaryContainer, button) => {
+        const source = new EventSource(`/api/summarize/${emailId}/stream`);
+        let text = '';
+
+        source.addEventListener('token', (event) => {
+            text += JSON.parse(event.data).text;
+            summaryContainer.innerHTML = `<strong>Summary:</strong> ${escapeHTML(text)}`;
+        });
+        source.addEventListener('done', (event) => {
+            source.close();
+            summaryContainer.innerHTML = `<strong>Summary:</strong> ${escapeHTML(JSON.parse(event.data).summary)}`;
+            button.style.display = 'none';
+        });
+        source.addEventListener('error', (event) => {
+            source.close();
+            if (event.data) {
+                summaryContainer.innerHTML = `<strong>Error:</strong> ${escapeHTML(JSON.parse(event.data).message)}`;
+                button.disabled = false;
+                button.textContent = 'Retry Summarize';
+            } else if (!text) {
+                // Connection-level failure: use the polling flow instead
+                requestSummary(emailId, summaryContainer, button);
+            } else {
+                summaryContainer.innerHTML += ' <em>(stream interrupted)</em>';
+                button.disabled = false;
+                button.textContent = 'Retry Summarize';
+            }
+        });
+    };
+
+    const requestSummary = async (emailId, summaryContainer, button) => {
         try {
             const response = await fetch(`/api/summarize/${emailId}`, { method: 'POST' });
+            if (response.status === 200) {
+                // Cached summary, no task to wait for
+                const data = await response.json();
+                summaryContainer.innerHTML = `<strong>Summary:</strong> ${escapeHTML(data.summary)}`;
+                button.style.display = 'none';
+                return;
+            }
             if (response.status !== 202) throw new Error('Failed to start summarization task.');
             
             const data = await response.json();
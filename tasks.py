@@ -1,12 +1,16 @@
 import os
+import re
+import json
+import hashlib
+import threading
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from celery import Celery
+from celery.signals import worker_process_init
 from dotenv import load_dotenv
 
-# --- LlamaIndex Imports ---
-from llama_index.llms.ollama import Ollama
-from llama_index.core import Document, Settings
+# Pooled connections, one pool per worker process
+import db
 
 # --- Configuration ---
 load_dotenv()
@@ -15,34 +19,156 @@ load_dotenv()
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
 
-# Database configuration
-DB_NAME = os.getenv("DB_NAME", "email_db")
-DB_USER = os.getenv("DB_USER", "postgres")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "mysecretpassword")
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = os.getenv("DB_PORT", "5433")
+# Background pre-summarization of newly stored mail. It runs on its own queue
+# so it never delays interactive summaries; run a dedicated, rate-limited
+# worker for it, e.g.:
+#   celery -A tasks worker -Q celery                          (interactive)
+#   celery -A tasks worker -Q presummarize --concurrency 1    (background)
+PRESUMMARIZE_ENABLED = os.getenv("PRESUMMARIZE_ENABLED", "true").lower() == "true"
+PRESUMMARIZE_QUEUE = os.getenv("PRESUMMARIZE_QUEUE", "presummarize")
+PRESUMMARIZE_RATE_LIMIT = os.getenv("PRESUMMARIZE_RATE_LIMIT", "6/m")  # tasks per worker
+PRESUMMARIZE_BATCH_SIZE = int(os.getenv("PRESUMMARIZE_BATCH_SIZE", "20"))  # emails per task
+
+# Periodic embedding backfill of stored mail without vectors (see backfill.py).
+# It loads the embedding model, so give it its own worker:
+#   celery -A tasks worker -Q backfill --concurrency 1
+BACKFILL_QUEUE = os.getenv("BACKFILL_QUEUE", "backfill")
+BACKFILL_INTERVAL = int(os.getenv("BACKFILL_INTERVAL", "300"))  # seconds between runs
 
 # Ollama LLM configuration
 LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "llama3")
 OLLAMA_REQUEST_TIMEOUT = 120.0 # Increased timeout for potentially long summaries
 
+# Create the LLM client when a worker process starts instead of on its first task
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+
+# Context window used to pack several emails into one batch prompt. Roughly
+# four characters per token; part of the window is reserved for the answer.
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "4096"))
+CHARS_PER_TOKEN = 4
+SUMMARY_TOKENS_PER_EMAIL = 80
+
+# Summarization prompts. Cached summaries are keyed by the model name and
+# PROMPT_VERSION, a hash of the prompts as rendered (see below), so editing
+# these texts or the templates around them invalidates the cache automatically.
+SUMMARY_PROMPT = "Provide a concise, one-sentence summary of the following email."
+BATCH_SUMMARY_PROMPT = (
+    "Provide a concise, one-sentence summary of each of the following emails. "
+    "Reply with only a JSON object that maps each email's ID to its summary, "
+    'for example {"12": "...", "15": "..."}.'
+)
+
 # --- Initialize Celery ---
 celery = Celery(__name__, broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+celery.conf.task_routes = {
+    'tasks.presummarize_email': {'queue': PRESUMMARIZE_QUEUE},
+    'tasks.presummarize_emails': {'queue': PRESUMMARIZE_QUEUE},
+    'tasks.backfill_embeddings': {'queue': BACKFILL_QUEUE},
+}
+
+# Periodic maintenance, run with: celery -A tasks beat
+celery.conf.beat_schedule = {
+    'ensure-email-partitions': {'task': 'tasks.ensure_email_partitions', 'schedule': 24 * 60 * 60},
+    # A run that has not started before the next one is due is dropped
+    'backfill-embeddings': {
+        'task': 'tasks.backfill_embeddings',
+        'schedule': BACKFILL_INTERVAL,
+        'options': {'expires': BACKFILL_INTERVAL},
+    },
+}
 
 # --- Initialize LlamaIndex LLM ---
-# This sets up our connection to the local Ollama model
-llm = Ollama(model=LLM_MODEL_NAME, request_timeout=OLLAMA_REQUEST_TIMEOUT)
-Settings.llm = llm # Set the LLM globally for LlamaIndex components
+# Created on first use: importing LlamaIndex alone takes seconds, and most
+# processes that import this module (the web apps, ingest) never call the LLM.
+_llm = None
+_llm_lock = threading.Lock()
 
-def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    try:
-        return psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT
-        )
-    except psycopg2.OperationalError as e:
-        print(f"Error: Could not connect to the database: {e}")
-        return None
+def get_llm():
+    """Returns the connection to the local Ollama model, importing LlamaIndex on first use."""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                from llama_index.llms.ollama import Ollama
+                from llama_index.core import Settings
+
+                llm = Ollama(model=LLM_MODEL_NAME, request_timeout=OLLAMA_REQUEST_TIMEOUT)
+                Settings.llm = llm # Set the LLM globally for LlamaIndex components
+                _llm = llm
+    return _llm
+
+def llm_loaded():
+    return _llm is not None
+
+@worker_process_init.connect
+def warm_up_worker(**kwargs):
+    if WARMUP_ON_STARTUP:
+        get_llm()
+
+# --- Summary Cache ---
+
+def format_email_content(email):
+    """The text that is summarized, and hashed to detect content changes."""
+    return f"Subject: {email['subject']}\n\nBody: {email['body']}"
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def build_summary_prompt(email_content):
+    return f"{SUMMARY_PROMPT}\n\n---\n{email_content}\n---"
+
+# Emails joined with their summaries for the current model and prompt version.
+# Rows whose content hash no longer matches are filtered by current_summaries.
+CACHED_SUMMARIES_SQL = """
+    SELECT e.id, e.subject, e.body, s.content_hash, s.summary
+    FROM emails e
+    JOIN summaries s ON s.email_id = e.id AND s.model_name = %s AND s.prompt_version = %s
+    WHERE e.id = ANY(%s)
+"""
+
+def current_summaries(rows):
+    """Keeps the CACHED_SUMMARIES_SQL rows that match the email's current content."""
+    return {
+        row['id']: row['summary']
+        for row in rows
+        if row['content_hash'] == content_hash(format_email_content(row))
+    }
+
+def get_cached_summaries(email_ids):
+    """
+    Returns {email_id: summary} for the emails whose current content already
+    has a stored summary for the current model and prompt version.
+    """
+    with db.connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(CACHED_SUMMARIES_SQL, (LLM_MODEL_NAME, PROMPT_VERSION, list(email_ids)))
+            return current_summaries(cur.fetchall())
+
+def get_cached_summary(email_id):
+    """Returns the cached summary for one email, or None if there is none."""
+    return get_cached_summaries([email_id]).get(email_id)
+
+def store_summaries(entries):
+    """Saves (email_id, content_hash, summary) tuples for the current model and prompt version."""
+    if not entries:
+        return
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                """
+                INSERT INTO summaries (email_id, content_hash, model_name, prompt_version, summary)
+                VALUES %s
+                ON CONFLICT (email_id, content_hash, model_name, prompt_version)
+                DO UPDATE SET summary = EXCLUDED.summary, created_at = NOW()
+                """,
+                [(email_id, digest, LLM_MODEL_NAME, PROMPT_VERSION, summary) for email_id, digest, summary in entries]
+            )
+        conn.commit()
+
+def store_summary(email_id, digest, summary):
+    """Saves one summary, see store_summaries."""
+    store_summaries([(email_id, digest, summary)])
 
 @celery.task(name='tasks.summarize_email')
 def summarize_email(email_id):
@@ -51,40 +177,295 @@ def summarize_email(email_id):
     using LlamaIndex, and returns the summary.
     """
     print(f"Celery task started: Summarize email with ID {email_id}")
-    conn = get_db_connection()
-    if not conn:
+    try:
+        # The same email may have been queued twice before the first run finished
+        cached = get_cached_summary(email_id)
+        if cached is not None:
+            return {"status": "success", "summary": cached}
+
+        with db.connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT subject, body FROM emails WHERE id = %s", (email_id,))
+                email = cur.fetchone()
+    except psycopg2.OperationalError as e:
+        print(f"Error: Could not connect to the database: {e}")
         return {"status": "error", "message": "Database connection failed in Celery task."}
 
+    # The connection goes back to the pool before the (slow) LLM call
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT subject, body FROM emails WHERE id = %s", (email_id,))
-            email = cur.fetchone()
-
         if not email:
             return {"status": "error", "message": f"Email with ID {email_id} not found."}
 
         # Prepare the content for LlamaIndex
-        email_content = f"Subject: {email['subject']}\n\nBody: {email['body']}"
-        
+        email_content = format_email_content(email)
+        llm = get_llm()
+        from llama_index.core import Document
+
         # Create a LlamaIndex Document object
         document = Document(text=email_content)
         
-        # Define a clear, specific prompt for the LLM
-        prompt = f"Provide a concise, one-sentence summary of the following email."
-        
         print("Sending prompt to Ollama via LlamaIndex...")
         
         # Use the LLM to get a direct completion for the summarization task
-        response = llm.complete(f"{prompt}\n\n---\n{document.text}\n---")
+        response = llm.complete(build_summary_prompt(document.text))
         
         summary = response.text.strip()
         print(f"Received summary from LlamaIndex/Ollama: {summary}")
+
+        # Cache it so the next request for this email is answered without the LLM
+        try:
+            store_summary(email_id, content_hash(email_content), summary)
+        except psycopg2.Error as e:
+            print(f"Warning: Could not cache the summary: {e}")
         
         return {"status": "success", "summary": summary}
 
     except Exception as e:
         print(f"An error occurred in the Celery task: {e}")
         return {"status": "error", "message": f"An internal error occurred: {str(e)}"}
-    finally:
-        if conn:
-            conn.close()
+
+def stream_summary(email_id):
+    """
+    Generator behind the SSE endpoint: yields ("token", text) for each piece
+    of the streamed completion, then ("done", summary) or ("error", message).
+    The finished summary is cached like summarize_email's.
+    """
+    try:
+        cached = get_cached_summary(email_id)
+        if cached is not None:
+            yield "done", cached
+            return
+        with db.connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT subject, body FROM emails WHERE id = %s", (email_id,))
+                email = cur.fetchone()
+    except psycopg2.Error as e:
+        print(f"Error: Could not read email {email_id}: {e}")
+        yield "error", "Database connection failed."
+        return
+
+    if not email:
+        yield "error", f"Email with ID {email_id} not found."
+        return
+
+    email_content = format_email_content(email)
+    parts = []
+    try:
+        print("Streaming prompt to Ollama via LlamaIndex...")
+        for chunk in get_llm().stream_complete(build_summary_prompt(email_content)):
+            if chunk.delta:
+                parts.append(chunk.delta)
+                yield "token", chunk.delta
+    except Exception as e:
+        print(f"An error occurred while streaming the summary: {e}")
+        yield "error", f"An internal error occurred: {str(e)}"
+        return
+
+    summary = "".join(parts).strip()
+    try:
+        store_summary(email_id, content_hash(email_content), summary)
+    except psycopg2.Error as e:
+        print(f"Warning: Could not cache the summary: {e}")
+    yield "done", summary
+
+# --- Batch Summarization ---
+
+def pack_emails(emails, context_tokens=LLM_CONTEXT_TOKENS):
+    """
+    Greedily groups emails so each group's prompt plus the expected answers fit
+    in the model context. An email too large for any group is sent on its own.
+    """
+    budget = context_tokens * CHARS_PER_TOKEN - len(BATCH_SUMMARY_PROMPT)
+    groups = []
+    current = []
+    used = 0
+    for email in emails:
+        cost = len(format_email_content(email)) + SUMMARY_TOKENS_PER_EMAIL * CHARS_PER_TOKEN
+        if current and used + cost > budget:
+            groups.append(current)
+            current = []
+            used = 0
+        current.append(email)
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
+def build_batch_prompt(emails):
+    sections = [f"=== EMAIL ID {email['id']} ===\n{format_email_content(email)}" for email in emails]
+    return f"{BATCH_SUMMARY_PROMPT}\n\n" + "\n\n".join(sections)
+
+# Both prompts rendered for a placeholder email, so a change anywhere in what
+# is sent (instructions, format_email_content, the templates) gives a new version
+_PROMPT_SAMPLE = {'id': 0, 'subject': '<subject>', 'body': '<body>'}
+PROMPT_VERSION = hashlib.sha256("\n".join([
+    build_summary_prompt(format_email_content(_PROMPT_SAMPLE)),
+    build_batch_prompt([_PROMPT_SAMPLE]),
+]).encode('utf-8')).hexdigest()[:16]
+
+def parse_batch_summaries(text, expected_ids):
+    """
+    Extracts {email_id: summary} from the model's JSON answer. Ids that are
+    missing or have an empty summary are left out so the caller can retry them.
+    """
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        return {}
+    try:
+        parsed = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+
+    summaries = {}
+    for email_id in expected_ids:
+        summary = parsed.get(str(email_id))
+        if isinstance(summary, str) and summary.strip():
+            summaries[email_id] = summary.strip()
+    return summaries
+
+@celery.task(name='tasks.summarize_emails')
+def summarize_emails(email_ids):
+    """
+    Summarizes several emails with as few LLM calls as possible: cached
+    summaries are reused, the rest are fetched in one query and packed into
+    batch prompts. Emails whose summary cannot be parsed from a batch answer
+    fall back to summarize_email.
+    """
+    email_ids = list(dict.fromkeys(int(email_id) for email_id in email_ids))
+    print(f"Celery task started: Summarize {len(email_ids)} emails")
+    try:
+        summaries = get_cached_summaries(email_ids)
+        missing = [email_id for email_id in email_ids if email_id not in summaries]
+        emails = []
+        if missing:
+            with db.connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    cur.execute("SELECT id, subject, body FROM emails WHERE id = ANY(%s)", (missing,))
+                    emails = cur.fetchall()
+    except psycopg2.Error as e:
+        print(f"Error: Could not read emails {email_ids}: {e}")
+        return {"status": "error", "message": "Database connection failed in Celery task."}
+
+    errors = {}
+    found_ids = {email['id'] for email in emails}
+    for email_id in missing:
+        if email_id not in found_ids:
+            errors[str(email_id)] = f"Email with ID {email_id} not found."
+
+    fallback = []
+    for group in pack_emails(emails):
+        group_ids = [email['id'] for email in group]
+        if len(group) == 1:
+            fallback.extend(group_ids)
+            continue
+        try:
+            print(f"Sending batch of {len(group)} emails to Ollama via LlamaIndex...")
+            response = get_llm().complete(build_batch_prompt(group))
+            parsed = parse_batch_summaries(response.text, group_ids)
+        except Exception as e:
+            print(f"Batch summarization failed, falling back to single requests: {e}")
+            parsed = {}
+
+        summaries.update(parsed)
+        fallback.extend(email_id for email_id in group_ids if email_id not in parsed)
+        try:
+            store_summaries([
+                (email['id'], content_hash(format_email_content(email)), parsed[email['id']])
+                for email in group if email['id'] in parsed
+            ])
+        except psycopg2.Error as e:
+            print(f"Warning: Could not cache the summaries: {e}")
+
+    for email_id in fallback:
+        result = summarize_email(email_id)
+        if result.get("status") == "success":
+            summaries[email_id] = result["summary"]
+        else:
+            errors[str(email_id)] = result.get("message")
+
+    return {
+        "status": "success" if not errors else "partial",
+        "summaries": {str(email_id): summary for email_id, summary in summaries.items()},
+        "errors": errors,
+    }
+
+@celery.task(name='tasks.presummarize_email', rate_limit=PRESUMMARIZE_RATE_LIMIT, ignore_result=True)
+def presummarize_email(email_id):
+    """
+    Low-priority summarization of a newly stored email, so that a later
+    click on Summarize is a cache hit. Kept for messages queued before
+    presummarize_emails took over.
+    """
+    result = summarize_email(email_id)
+    if result.get("status") != "success":
+        print(f"Pre-summarization of email {email_id} failed: {result.get('message')}")
+
+@celery.task(name='tasks.presummarize_emails', rate_limit=PRESUMMARIZE_RATE_LIMIT, ignore_result=True)
+def presummarize_emails(email_ids):
+    """Low-priority summarization of a chunk of newly stored emails, packed into batch prompts."""
+    result = summarize_emails(email_ids)
+    if result.get("status") == "error":
+        print(f"Pre-summarization of {len(email_ids)} emails failed: {result.get('message')}")
+    elif result.get("errors"):
+        print(f"Pre-summarization failed for {len(result['errors'])} of {len(email_ids)} emails: {result['errors']}")
+
+def enqueue_presummarization(email_ids):
+    """Queues background summaries for newly stored emails, PRESUMMARIZE_BATCH_SIZE per task. Never raises."""
+    if not PRESUMMARIZE_ENABLED or not email_ids:
+        return
+    email_ids = list(email_ids)
+    try:
+        for start in range(0, len(email_ids), PRESUMMARIZE_BATCH_SIZE):
+            presummarize_emails.apply_async((email_ids[start:start + PRESUMMARIZE_BATCH_SIZE],),
+                                            queue=PRESUMMARIZE_QUEUE)
+        print(f"Queued {len(email_ids)} email(s) for background summarization.")
+    except Exception as e:
+        print(f"Warning: Could not queue background summaries: {e}")
+
+
+@celery.task(name='tasks.ensure_email_partitions', ignore_result=True)
+def ensure_email_partitions():
+    """
+    Creates the monthly partitions for the coming months ahead of time, so new
+    mail never lands in the default partition. Does nothing when the emails
+    table is not partitioned.
+    """
+    from schema import ensure_partitions
+
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                created = ensure_partitions(cur)
+            conn.commit()
+    except psycopg2.Error as e:
+        print(f"Error: Could not create email partitions: {e}")
+        return
+    if created:
+        print(f"Created email partition(s): {', '.join(created)}")
+
+# Loaded on the first backfill run and kept for the worker's lifetime
+_backfill_models = None
+
+@celery.task(name='tasks.backfill_embeddings', ignore_result=True)
+def backfill_embeddings():
+    """
+    Embeds and tags stored emails that have no embedding yet, stopping a
+    little before the next scheduled run. Safe to run alongside
+    `python backfill.py` workers.
+    """
+    global _backfill_models
+    import backfill
+
+    try:
+        if _backfill_models is None:
+            _backfill_models = backfill.load_models()
+        with db.connection() as conn:
+            total = backfill.run_backfill(conn, *_backfill_models, worker="celery",
+                                          max_seconds=BACKFILL_INTERVAL * 0.8)
+    except (OSError, psycopg2.Error) as e:
+        print(f"Error: Embedding backfill failed: {e}")
+        return
+    if total:
+        print(f"Backfilled embeddings for {total} email(s).")
@@ -0,0 +1,167 @@
+"""
+Batching and backoff of gmail_fetch.fetch_messages against a local fake of
+the Gmail service, so no credentials or network are needed:
+
+    python -m pytest test_gmail_fetch.py
+"""
+import base64
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from googleapiclient.errors import HttpError
+
+from gmail_fetch import fetch_messages, parse_message
+
+
+def http_error(status):
+    return HttpError(SimpleNamespace(status=status, reason="fake"), b"")
+
+
+def message_resource(msg_id):
+    return {
+        'id': msg_id,
+        'internalDate': '1704067200000',  # 2024-01-01T00:00:00Z
+        'payload': {
+            'mimeType': 'text/plain',
+            'headers': [{'name': 'Subject', 'value': f"subject {msg_id}"}],
+            'body': {'data': base64.urlsafe_b64encode(f"body {msg_id}".encode()).decode()},
+        },
+    }
+
+
+class FakeBatch:
+    def __init__(self, service):
+        self.service = service
+        self.calls = []
+
+    def add(self, request, callback, request_id):
+        self.calls.append((request['id'], callback, request_id))
+
+    def execute(self):
+        self.service.batches.append([msg_id for msg_id, _, _ in self.calls])
+        if self.service.batch_errors:
+            status = self.service.batch_errors.pop(0)
+            if status is not None:
+                raise http_error(status)
+        for msg_id, callback, request_id in self.calls:
+            outcomes = self.service.outcomes.get(msg_id, [])
+            status = outcomes.pop(0) if outcomes else 200
+            if status == 200:
+                callback(request_id, message_resource(msg_id), None)
+            else:
+                callback(request_id, None, http_error(status))
+
+
+class FakeGmailService:
+    """
+    Stands in for the discovery object. `outcomes` maps a message id to the
+    HTTP statuses of its successive calls (200 once they run out);
+    `batch_errors` lists the status of each whole batch execute(), None for
+    success.
+    """
+
+    def __init__(self, outcomes=None, batch_errors=None):
+        self.outcomes = {msg_id: list(statuses) for msg_id, statuses in (outcomes or {}).items()}
+        self.batch_errors = list(batch_errors or [])
+        self.batches = []
+
+    def new_batch_http_request(self):
+        return FakeBatch(self)
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, userId, id, format):
+        return {'id': id}
+
+
+class FetchMessagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.delays = []
+
+    def fetch(self, service, message_ids, **kwargs):
+        return fetch_messages(service, message_ids, sleep=self.delays.append, **kwargs)
+
+    def test_batches_and_keeps_input_order(self):
+        service = FakeGmailService()
+        ids = [str(n) for n in range(120)] + ['0']  # the duplicate is fetched once
+        emails, failed = self.fetch(service, ids, batch_size=50)
+
+        self.assertEqual([len(batch) for batch in service.batches], [50, 50, 20])
+        self.assertEqual([email['message_id'] for email in emails], ids[:120])
+        self.assertEqual(emails[7]['subject'], "subject 7")
+        self.assertEqual(emails[7]['body'], "body 7")
+        self.assertEqual(failed, {})
+        self.assertEqual(self.delays, [])
+
+    def test_partial_failure(self):
+        service = FakeGmailService(outcomes={'b': [429], 'c': [400], 'd': [404], 'e': [503, 500]})
+        emails, failed = self.fetch(service, ['a', 'b', 'c', 'd', 'e'])
+
+        # 429/5xx are retried (only those ids), 400 fails, 404 is skipped as deleted
+        self.assertEqual(service.batches, [['a', 'b', 'c', 'd', 'e'], ['b', 'e'], ['e']])
+        self.assertEqual([email['message_id'] for email in emails], ['a', 'b', 'e'])
+        self.assertEqual(failed, {'c': 400})
+        self.assertEqual(len(self.delays), 2)
+
+    def test_retries_whole_batch_on_server_error(self):
+        service = FakeGmailService(batch_errors=[503, None])
+        emails, failed = self.fetch(service, ['a', 'b'])
+
+        self.assertEqual(service.batches, [['a', 'b'], ['a', 'b']])
+        self.assertEqual(len(emails), 2)
+        self.assertEqual(failed, {})
+        self.assertEqual(len(self.delays), 1)
+
+    def test_raises_on_non_retryable_batch_error(self):
+        service = FakeGmailService(batch_errors=[403])
+        with self.assertRaises(HttpError):
+            self.fetch(service, ['a'])
+
+    def test_gives_up_after_max_retries(self):
+        service = FakeGmailService(outcomes={'b': [503] * 10})
+        emails, failed = self.fetch(service, ['a', 'b'], max_retries=3)
+
+        self.assertEqual([email['message_id'] for email in emails], ['a'])
+        self.assertEqual(failed, {'b': 503})
+        self.assertEqual(len(service.batches), 4)  # the first try and 3 retries
+        self.assertEqual(len(self.delays), 3)
+        # Exponential: each delay's base doubles; the jitter adds less than a second
+        self.assertLess(self.delays[0], self.delays[1])
+        self.assertLess(self.delays[1], self.delays[2])
+
+    def test_empty_input(self):
+        service = FakeGmailService()
+        self.assertEqual(self.fetch(service, []), ([], {}))
+        self.assertEqual(service.batches, [])
+
+
+class ParseMessageTest(unittest.TestCase):
+
+    def with_date(self, value):
+        resource = message_resource('a')
+        resource['payload']['headers'].append({'name': 'Date', 'value': value})
+        return parse_message(resource)
+
+    def test_date_header(self):
+        email = self.with_date('Tue, 05 Mar 2024 10:00:00 +0100')
+        self.assertEqual(email['received_date'], datetime(2024, 3, 5, 9, tzinfo=timezone.utc))
+
+    def test_date_header_without_offset_is_utc(self):
+        email = self.with_date('Tue, 05 Mar 2024 10:00:00 -0000')
+        self.assertEqual(email['received_date'], datetime(2024, 3, 5, 10, tzinfo=timezone.utc))
+
+    def test_falls_back_to_internal_date(self):
+        # The same value on every resync, unlike the fetch time
+        expected = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(parse_message(message_resource('a'))['received_date'], expected)
+        self.assertEqual(self.with_date('not a date')['received_date'], expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,16 @@
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import resource
+from datetime import datetime, timezone
+
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import make_pipeline
-import pickle
 
 # --- Configuration ---
 # The user's log shows the file is named 'mails.csv'.
@@ -10,14 +18,35 @@ DATA_FILE = 'mails.csv'
 VECTORIZER_FILE = 'vectorizer.pkl'
 CLASSIFIER_FILE = 'category_classifier.pkl'
 
-def train_model():
+# --- Streaming Configuration ---
+# The streaming mode never holds the whole training set: it reads the CSV (or
+# the email_labels table) in chunks, turns text into features with a
+# stateless HashingVectorizer, and updates MultinomialNB with partial_fit.
+# The saved pipeline is used by ingest.py exactly like the TF-IDF one, and
+# can later be updated with newly labeled mail (--update) without retraining.
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "10000"))
+HASHING_FEATURES = int(os.getenv("HASHING_FEATURES", str(2 ** 18)))
+STREAMING_ALPHA = 0.01  # the hashed features are l2-normalized, so the usual alpha=1 would swamp them
+STATE_FILE = 'classifier_state.json'  # classes, row count, CSV offsets and the email_labels checkpoint
+
+def peak_memory_mb():
+    """Peak resident memory of this process so far (ru_maxrss is in KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def report(rows, started):
+    seconds = time.perf_counter() - started
+    print(f"Trained on {rows} records in {seconds:.2f}s ({rows / seconds if seconds else 0:,.1f} records/sec), "
+          f"peak memory {peak_memory_mb():,.1f} MB")
+
+def train_model(data_file=DATA_FILE):
     """
     Loads email data, cleans it, trains a classification model, and saves it.
     """
     try:
+        started = time.perf_counter()
         # Load the dataset
-        print(f"Loading data from '{DATA_FILE}'...")
-        df = pd.read_csv(DATA_FILE)
+        print(f"Loading data from '{data_file}'...")
+        df = pd.read_csv(data_file)
 
         # --- FIX: Handle missing values ---
         # The "Input contains NaN" error means there are empty cells in your CSV.
@@ -30,7 +59,7 @@ def train_model():
         if 'text' not in df.columns or 'category' not in df.columns:
             print("Error: CSV file must contain 'text' and 'category' columns.")
             return
-        
+
         if len(df) == 0:
             print("Error: No valid data left after cleaning. Please check your CSV file.")
             return
@@ -38,7 +67,7 @@ def train_model():
         # Separate features (X) and target (y)
         X = df['text']
         y = df['category']
-        
+
         # Create a model pipeline: TF-IDF Vectorizer -> Multinomial Naive Bayes Classifier
         print("Building model pipeline...")
         model = make_pipeline(TfidfVectorizer(), MultinomialNB())
@@ -47,21 +76,247 @@ def train_model():
         print("Training the model...")
         model.fit(X, y)
         print("Model training complete.")
+        report(len(df), started)
 
         # Save the trained pipeline (vectorizer and classifier)
         with open(CLASSIFIER_FILE, 'wb') as f:
             pickle.dump(model, f)
         print(f"Model saved to '{CLASSIFIER_FILE}'")
-        
+
         # For demonstration, let's also save the vectorizer separately
         with open(VECTORIZER_FILE, 'wb') as f:
             pickle.dump(model.named_steps['tfidfvectorizer'], f)
         print(f"Vectorizer saved to '{VECTORIZER_FILE}'")
 
+        # The streaming state described the model this one replaced
+        if os.path.exists(STATE_FILE):
+            os.remove(STATE_FILE)
+            print(f"Removed '{STATE_FILE}'; --update needs a new --streaming run.")
+
     except FileNotFoundError:
-        print(f"Error: The data file '{DATA_FILE}' was not found. Make sure it's in the same directory.")
+        print(f"Error: The data file '{data_file}' was not found. Make sure it's in the same directory.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
+# --- Streaming Sources ---
+# Each yields (texts, categories) chunks of at most chunk_size records.
+
+def iter_csv_chunks(path, chunk_size=STREAM_CHUNK_SIZE, offsets=None):
+    """
+    The CSV's records. With `offsets` ({absolute path: data rows read}), the
+    rows read by earlier runs are skipped and the count is moved past each
+    chunk, so an update only sees rows appended to the file since.
+    """
+    key = os.path.abspath(path)
+    skip = offsets.get(key, 0) if offsets is not None else 0
+    for chunk in pd.read_csv(path, usecols=['text', 'category'], chunksize=chunk_size,
+                             skiprows=range(1, skip + 1)):
+        rows = len(chunk)
+        chunk = chunk.dropna(subset=['text', 'category'])
+        if len(chunk):
+            yield chunk['text'].tolist(), chunk['category'].tolist()
+        if offsets is not None:
+            offsets[key] = offsets.get(key, 0) + rows
+
+def csv_classes(path, chunk_size=STREAM_CHUNK_SIZE):
+    """Every category in the CSV, from a pass over that column alone."""
+    classes = set()
+    for chunk in pd.read_csv(path, usecols=['category'], chunksize=chunk_size):
+        classes.update(chunk['category'].dropna())
+    return sorted(classes)
+
+# labeled_at is the start time of the labeling transaction (NOW()), which
+# may commit after a later one. As in vector_store.py, each run reads from a
+# watermark: the start of the oldest transaction open just before the
+# previous read. The rows at or after it that were already trained on are
+# listed in the checkpoint and skipped when read again.
+LABELED_EMAILS_SQL = """
+    SELECT l.labeled_at, l.email_id, e.subject, e.body, l.category
+    FROM email_labels l JOIN emails e ON e.id = l.email_id
+    WHERE l.labeled_at >= %s::timestamptz
+    ORDER BY l.labeled_at, l.email_id
+"""
+
+def _label_key(email_id, labeled_at):
+    return (email_id, labeled_at.astimezone(timezone.utc).isoformat())
+
+def new_db_checkpoint():
+    return {"watermark": datetime.min.isoformat() + "+00:00", "seen": []}
+
+def iter_db_chunks(conn, checkpoint, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Labeled emails not yet trained on, in labeling order. `checkpoint`
+    ({"watermark", "seen": [[email_id, labeled_at ISO string], ...]}) is
+    replaced by the next one once every row was read, so the caller saves it
+    with the model trained on them.
+    """
+    from vector_store import WATERMARK_SQL
+
+    with conn.cursor() as cur:
+        cur.execute(WATERMARK_SQL)
+        watermark = cur.fetchone()[0]
+    conn.rollback()  # the rows are read in a later transaction, i.e. a later snapshot
+
+    seen = {tuple(key) for key in checkpoint["seen"]}
+    overlap = []  # rows the next run will read again
+    with conn.cursor(name='classifier_training') as cur:
+        cur.itersize = chunk_size
+        cur.execute(LABELED_EMAILS_SQL, (checkpoint["watermark"],))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            overlap.extend(_label_key(email_id, labeled_at) for labeled_at, email_id, *_ in rows
+                           if labeled_at >= watermark)
+            rows = [row for row in rows if _label_key(row[1], row[0]) not in seen]
+            if rows:
+                # The same text ingest.classify_batch classifies
+                texts = [f"Subject: {subject or ''} Body: {body or ''}" for _, _, subject, body, _ in rows]
+                yield texts, [category for *_, category in rows]
+    conn.rollback()
+    checkpoint.update(watermark=watermark.isoformat(), seen=overlap)
+
+def db_classes(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT category FROM email_labels ORDER BY category")
+        return [row[0] for row in cur.fetchall()]
+
+def connect():
+    import psycopg2
+    from ingest import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+    return psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+
+# --- Streaming Training ---
+
+def make_streaming_model():
+    """HashingVectorizer -> MultinomialNB; the vectorizer needs no fitting, so any chunk can be transformed alone."""
+    vectorizer = HashingVectorizer(n_features=HASHING_FEATURES, alternate_sign=False)
+    return make_pipeline(vectorizer.fit([]), MultinomialNB(alpha=STREAMING_ALPHA))
+
+def is_streaming_model(model):
+    """Whether `model` is the HashingVectorizer -> MultinomialNB pipeline partial_fit_chunks updates."""
+    steps = getattr(model, 'named_steps', {})
+    return isinstance(steps.get('hashingvectorizer'), HashingVectorizer) and \
+        isinstance(steps.get('multinomialnb'), MultinomialNB)
+
+def partial_fit_chunks(model, chunks, classes=None):
+    """
+    Updates `model` with every chunk. `classes` is required for a new model.
+    Categories the model was not created with are skipped and reported, since
+    MultinomialNB cannot add classes. Returns the number of records used.
+    """
+    vectorizer = model.named_steps['hashingvectorizer']
+    classifier = model.named_steps['multinomialnb']
+    known = set(classes if classes is not None else classifier.classes_)
+    rows = 0
+    skipped = {}
+    for texts, categories in chunks:
+        kept = [(text, category) for text, category in zip(texts, categories) if category in known]
+        for category in categories:
+            if category not in known:
+                skipped[category] = skipped.get(category, 0) + 1
+        if not kept:
+            continue
+        texts, categories = zip(*kept)
+        classifier.partial_fit(vectorizer.transform(texts), categories, classes=classes)
+        classes = None  # only needed on the first call
+        rows += len(kept)
+        print(f"  ...{rows} records", end='\r')
+    print()
+    if skipped:
+        print(f"Warning: Skipped records with categories the model does not know: {skipped}. "
+              "Retrain with --streaming to add them.", file=sys.stderr)
+    return rows
+
+def load_state():
+    try:
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_model(model, state):
+    """Writes the model (atomically, ingest may be loading it) and the training state."""
+    with open(f"{CLASSIFIER_FILE}.tmp", 'wb') as f:
+        pickle.dump(model, f)
+    os.replace(f"{CLASSIFIER_FILE}.tmp", CLASSIFIER_FILE)
+    with open(VECTORIZER_FILE, 'wb') as f:
+        pickle.dump(model.named_steps['hashingvectorizer'], f)
+    with open(STATE_FILE, 'w') as f:
+        json.dump(state, f, indent=2)
+    print(f"Model saved to '{CLASSIFIER_FILE}', state to '{STATE_FILE}'")
+
+def train_streaming(source, data_file=DATA_FILE, chunk_size=STREAM_CHUNK_SIZE, update=False):
+    """
+    Trains a new hashing model from `source` ('csv' or 'db'), or with
+    update=True continues the saved one: with the rows of `data_file` past
+    the offset recorded for it for 'csv', from the email_labels checkpoint
+    for 'db'.
+    """
+    started = time.perf_counter()
+    state = load_state() if update else None
+    conn = connect() if source == 'db' else None
+    try:
+        if update:
+            if state is None:
+                print(f"Error: No '{STATE_FILE}'. Train with --streaming before using --update.")
+                return
+            with open(CLASSIFIER_FILE, 'rb') as f:
+                model = pickle.load(f)
+            if not is_streaming_model(model):
+                print(f"Error: '{CLASSIFIER_FILE}' is not a streaming (hashing) model and cannot be updated. "
+                      "Train with --streaming first.")
+                return
+            classes = None
+            if isinstance(state.get("db_checkpoint"), list):
+                # Before the watermark: [labeled_at, email_id] of the last row read
+                state["db_checkpoint"] = dict(new_db_checkpoint(), watermark=state["db_checkpoint"][0])
+            state.setdefault("csv_offsets", {})
+            print(f"Updating the model ({state['rows']} records so far) from {source}...")
+        else:
+            model = make_streaming_model()
+            classes = csv_classes(data_file, chunk_size) if source == 'csv' else db_classes(conn)
+            if not classes:
+                print("Error: No labeled records found.")
+                return
+            state = {"classes": classes, "rows": 0, "csv_offsets": {}, "db_checkpoint": new_db_checkpoint()}
+            print(f"Training a streaming model on {len(classes)} categories from {source}...")
+
+        if source == 'csv':
+            chunks = iter_csv_chunks(data_file, chunk_size, state["csv_offsets"])
+        else:
+            chunks = iter_db_chunks(conn, state["db_checkpoint"], chunk_size)
+        rows = partial_fit_chunks(model, chunks, classes)
+        if rows == 0 and update:
+            print("No new labeled records.")
+            return
+        state["rows"] += rows
+        state["updated_at"] = datetime.now().isoformat()
+        report(rows, started)
+        save_model(model, state)
+
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the email category classifier.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--streaming', action='store_true', help="Train out of core with hashing features and partial_fit")
+    mode.add_argument('--update', action='store_true', help="Continue the saved streaming model with newly labeled mail")
+    parser.add_argument('--source', choices=['csv', 'db'], default='csv',
+                        help="csv: --data-file, db: the email_labels table")
+    parser.add_argument('--data-file', default=DATA_FILE,
+                        help="With --update, only the rows added since the file was last read are used")
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    if args.streaming or args.update:
+        train_streaming(args.source, args.data_file, args.chunk_size, update=args.update)
+    else:
+        train_model(args.data_file)
+
 if __name__ == "__main__":
-    train_model()
+    main()
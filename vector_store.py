@@ -0,0 +1,369 @@
+"""
+Memory-mapped copy of the email embeddings, for searching without pgvector on
+single-node deployments and in tests:
+
+    python vector_store.py export                    # full dump
+    python vector_store.py export --dtype float16    # half the size
+    python vector_store.py append                    # add mail embedded since
+
+With SEARCH_BACKEND=mmap, app.py ranks unfiltered vector searches with
+MmapVectorIndex and only fetches the page's rows from the database by id. The
+index appends newly embedded mail itself every VECTOR_STORE_REFRESH seconds,
+on a background thread.
+
+Files, next to each other at VECTOR_STORE_PATH:
+  <path>.v<N>/vectors  row-major matrix of unit-length embeddings (float16/float32)
+  <path>.v<N>/ids      int64 email id of each row
+  <path>.json          the current version N, dtype, dimension, row count and
+                       the append watermark; written last, so readers only
+                       ever map complete rows of one version
+  <path>.lock          serializes writers (exports, appends from several workers)
+
+Every export writes a new version directory and switches to it by replacing
+the metadata; appends extend the current version's files past the recorded
+row count. The previous version is kept for readers that are still opening it.
+
+Appends select by emails.embedded_at (schema migration 10), which holds the
+start time of the transaction that wrote the embedding. The watermark is the
+start of the oldest transaction open just before the last read, so a row
+committed later but written by an older transaction is still picked up; rows
+read again because of that overlap are skipped by id. Needs pg_stat_activity
+to show the writers' sessions (same role, or pg_read_all_stats).
+"""
+import os
+import sys
+import glob
+import json
+import time
+import fcntl
+import shutil
+import argparse
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+from pgvector.psycopg2 import register_vector
+
+from db import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from schema import VECTOR_DIMENSION
+from embedding_backends import EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+
+# --- Configuration ---
+load_dotenv()
+
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "vector_store/emails")
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float32")
+VECTOR_STORE_REFRESH = float(os.getenv("VECTOR_STORE_REFRESH", "30"))  # seconds between appends, 0 disables
+VECTOR_STORE_DTYPES = ("float32", "float16")
+EXPORT_BATCH_SIZE = 10000  # rows per fetch from the database
+SEARCH_CHUNK_ROWS = 65536  # rows scored per step, bounds the float32 scratch memory
+
+SELECT_EMBEDDED_SQL = "SELECT id, embedding FROM emails WHERE embedding IS NOT NULL ORDER BY id"
+SELECT_EMBEDDED_SINCE_SQL = """
+    SELECT id, embedding FROM emails
+    WHERE embedding IS NOT NULL AND embedded_at >= %s
+    ORDER BY id
+"""
+# Taken before the rows are read: any embedding the read does not see was
+# written by a transaction that started at or after this time
+WATERMARK_SQL = """
+    SELECT LEAST(clock_timestamp(), MIN(xact_start)) FROM pg_stat_activity
+    WHERE datname = current_database() AND pid <> pg_backend_pid()
+"""
+
+
+def _paths(path):
+    return {suffix: f"{path}.{suffix}" for suffix in ("json", "lock")}
+
+def _version_dir(path, version):
+    return f"{path}.v{version}"
+
+def _data_paths(path, meta):
+    directory = _version_dir(path, meta["version"])
+    return {name: os.path.join(directory, name) for name in ("vectors", "ids")}
+
+def read_meta(path):
+    """The store's metadata, or None if it was never exported."""
+    try:
+        with open(_paths(path)["json"]) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _write_meta(path, meta):
+    target = _paths(path)["json"]
+    with open(f"{target}.tmp", "w") as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{target}.tmp", target)
+
+@contextmanager
+def _writer_lock(path, blocking=True):
+    """Yields True once the lock is held, or False at once if not `blocking` and another writer holds it."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(_paths(path)["lock"], "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def _normalized(embeddings, dtype):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return (embeddings / np.maximum(norms, 1e-12)).astype(dtype)
+
+def _watermark(conn):
+    with conn.cursor() as cur:
+        cur.execute(WATERMARK_SQL)
+        watermark = cur.fetchone()[0]
+    conn.rollback()  # the rows are read in a later transaction, i.e. a later snapshot
+    return watermark
+
+def _append_rows(cur, path, meta, skip_ids=None):
+    """
+    Streams the rows selected on `cur` to the end of the current version's
+    files, leaving out ids in the sorted array `skip_ids`. Returns the rows written.
+    """
+    paths = _data_paths(path, meta)
+    row_bytes = meta["dimension"] * np.dtype(meta["dtype"]).itemsize
+    written = 0
+    with open(paths["vectors"], "r+b" if os.path.exists(paths["vectors"]) else "w+b") as vectors, \
+            open(paths["ids"], "r+b" if os.path.exists(paths["ids"]) else "w+b") as ids:
+        # Drop anything past the recorded count, left over from an interrupted append
+        vectors.truncate(meta["count"] * row_bytes)
+        ids.truncate(meta["count"] * 8)
+        vectors.seek(0, os.SEEK_END)
+        ids.seek(0, os.SEEK_END)
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            if skip_ids is not None and len(skip_ids):
+                positions = np.searchsorted(skip_ids, [row[0] for row in rows]).clip(max=len(skip_ids) - 1)
+                rows = [row for row, position in zip(rows, positions) if skip_ids[position] != row[0]]
+                if not rows:
+                    continue
+            batch_ids = np.array([row[0] for row in rows], dtype=np.int64)
+            vectors.write(_normalized([row[1] for row in rows], meta["dtype"]).tobytes())
+            ids.write(batch_ids.tobytes())
+            written += len(rows)
+        vectors.flush()
+        ids.flush()
+        os.fsync(vectors.fileno())
+        os.fsync(ids.fileno())
+    meta["count"] += written
+    return written
+
+def _remove_old_versions(path, keep):
+    """Removes the version directories older than `keep`; open maps of them stay valid."""
+    prefix = _version_dir(path, "")
+    for directory in glob.glob(f"{glob.escape(prefix)}*"):
+        suffix = directory[len(prefix):]
+        if suffix.isdigit() and int(suffix) < keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+def export_index(conn, path=VECTOR_STORE_PATH, dtype=VECTOR_STORE_DTYPE):
+    """Writes every embedded email to a new version of the store at `path` and switches to it. Returns the row count."""
+    if dtype not in VECTOR_STORE_DTYPES:
+        raise ValueError(f"Unknown dtype '{dtype}'. Use one of {', '.join(VECTOR_STORE_DTYPES)}.")
+    with _writer_lock(path):
+        previous = read_meta(path)
+        meta = {
+            "version": previous.get("version", 0) + 1 if previous else 1,
+            "dtype": dtype, "dimension": VECTOR_DIMENSION, "count": 0,
+            "model": EMBEDDING_MODEL_NAME, "backend": EMBEDDING_BACKEND,
+        }
+        directory = _version_dir(path, meta["version"])
+        shutil.rmtree(directory, ignore_errors=True)  # left behind by an interrupted export
+        os.makedirs(directory)
+        meta["watermark"] = _watermark(conn).isoformat()
+        with conn.cursor(name="vector_store_export") as cur:
+            cur.itersize = EXPORT_BATCH_SIZE
+            cur.execute(SELECT_EMBEDDED_SQL)
+            _append_rows(cur, path, meta)
+        conn.rollback()
+        meta["exported_at"] = time.time()
+        _write_meta(path, meta)
+        # The previous version stays for readers that read the old metadata a moment ago
+        _remove_old_versions(path, keep=meta["version"] - 1)
+    return meta["count"]
+
+def append_from_db(conn, path=VECTOR_STORE_PATH, blocking=True):
+    """
+    Appends the emails embedded since the watermark of the last export or
+    append (new mail, and old mail the backfill has reached since). Returns
+    the rows appended, or None if not `blocking` and another writer is busy.
+    Re-embedded or deleted emails need an export.
+    """
+    with _writer_lock(path, blocking) as locked:
+        if not locked:
+            return None
+        meta = read_meta(path)
+        if meta is None or "version" not in meta:
+            raise FileNotFoundError(f"No vector store at '{path}'. Run 'python vector_store.py export' first.")
+        existing = np.sort(np.fromfile(_data_paths(path, meta)["ids"], dtype=np.int64, count=meta["count"]))
+        watermark = _watermark(conn)
+        with conn.cursor(name="vector_store_append") as cur:
+            cur.itersize = EXPORT_BATCH_SIZE
+            cur.execute(SELECT_EMBEDDED_SINCE_SQL, (meta["watermark"],))
+            appended = _append_rows(cur, path, meta, skip_ids=existing)
+        conn.rollback()
+        meta["watermark"] = watermark.isoformat()
+        _write_meta(path, meta)
+    return appended
+
+
+class MmapVectorIndex:
+    """
+    Exact cosine top-k over a memory-mapped store, with NumPy. The OS page
+    cache holds the matrix, so every worker of a host shares one copy.
+    search() is thread-safe; refresh() appends new mail from the database
+    and remaps the files, and refresh_if_stale() does so on a background
+    thread.
+    """
+
+    def __init__(self, path=VECTOR_STORE_PATH, refresh_interval=VECTOR_STORE_REFRESH):
+        self.path = path
+        self._refresh_interval = refresh_interval
+        self._refresh_lock = threading.Lock()
+        self._snapshot = None  # (meta, vectors, ids), replaced as a whole
+        self._refreshed_at = time.monotonic()
+        self.load()
+
+    def load(self):
+        """Maps the current version of the files."""
+        for attempt in range(3):
+            meta = read_meta(self.path)
+            if meta is None or "version" not in meta:
+                raise FileNotFoundError(f"No vector store at '{self.path}'. Run 'python vector_store.py export' first.")
+            try:
+                self._map(meta)
+                return
+            except FileNotFoundError:
+                # Two exports replaced the version between reading the metadata and opening it
+                if attempt == 2:
+                    raise
+
+    def _map(self, meta):
+        if meta["dimension"] != VECTOR_DIMENSION or (meta["model"], meta["backend"]) != (EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND):
+            print(f"Warning: Vector store '{self.path}' holds {meta['dimension']}-d vectors of '{meta['model']}' "
+                  f"({meta['backend']} backend); queries use '{EMBEDDING_MODEL_NAME}' ({EMBEDDING_BACKEND}).",
+                  file=sys.stderr)
+        paths = _data_paths(self.path, meta)
+        count, dimension = meta["count"], meta["dimension"]
+        if count:
+            vectors = np.memmap(paths["vectors"], dtype=meta["dtype"], mode="r", shape=(count, dimension))
+            ids = np.memmap(paths["ids"], dtype=np.int64, mode="r", shape=(count,))
+        else:
+            vectors = np.empty((0, dimension), dtype=meta["dtype"])
+            ids = np.empty(0, dtype=np.int64)
+        self._snapshot = (meta, vectors, ids)
+
+    def __len__(self):
+        return self._snapshot[0]["count"]
+
+    def search(self, query_embedding, k):
+        """Returns the k nearest [(email id, cosine distance)], nearest first."""
+        _, vectors, ids = self._snapshot
+        if k <= 0 or not len(ids):
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        best_scores = []
+        best_rows = []
+        for start in range(0, len(ids), SEARCH_CHUNK_ROWS):
+            scores = np.asarray(vectors[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32) @ query
+            top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+            best_scores.append(scores[top])
+            best_rows.append(top + start)
+        scores = np.concatenate(best_scores)
+        rows = np.concatenate(best_rows)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [(int(ids[row]), float(1.0 - score)) for row, score in zip(rows[order], scores[order])]
+
+    def refresh(self, conn, blocking=True):
+        """
+        Appends mail embedded since the last refresh (by any process) and
+        remaps. Returns the rows appended; None if not `blocking` and another
+        process was appending, in which case the files are remapped as they are.
+        """
+        appended = append_from_db(conn, self.path, blocking)
+        self.load()
+        self._refreshed_at = time.monotonic()
+        return appended
+
+    def refresh_if_stale(self, connect):
+        """
+        Starts a refresh on a background thread when the interval has passed,
+        with a connection from `connect()` (a context manager, e.g.
+        db.connection), and returns at once: it is called from web requests,
+        which keep searching the current snapshot. One refresh runs at a
+        time, and it is skipped while another process holds the writer lock.
+        """
+        if not self._refresh_interval or time.monotonic() - self._refreshed_at < self._refresh_interval:
+            return
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            threading.Thread(target=self._refresh_in_background, args=(connect,),
+                             name="vector-store-refresh", daemon=True).start()
+        except Exception:
+            self._refresh_lock.release()
+            raise
+
+    def _refresh_in_background(self, connect):
+        try:
+            with connect() as conn:
+                self.refresh(conn, blocking=False)
+        except Exception as e:
+            # Keep searching the current snapshot; retry after the next interval
+            self._refreshed_at = time.monotonic()
+            print(f"Warning: Vector store refresh failed: {e}", file=sys.stderr)
+        finally:
+            self._refresh_lock.release()
+
+    def stats(self):
+        meta = self._snapshot[0]
+        return {
+            "rows": meta["count"],
+            "dtype": meta["dtype"],
+            "version": meta["version"],
+            "watermark": meta["watermark"],
+            "seconds_since_refresh": round(time.monotonic() - self._refreshed_at, 1),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the email embeddings to a memory-mapped vector store.")
+    parser.add_argument('command', choices=['export', 'append'])
+    parser.add_argument('--path', default=VECTOR_STORE_PATH)
+    parser.add_argument('--dtype', choices=VECTOR_STORE_DTYPES, default=VECTOR_STORE_DTYPE)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT)
+    register_vector(conn)
+    try:
+        started = time.perf_counter()
+        if args.command == 'export':
+            rows = export_index(conn, args.path, args.dtype)
+            size = os.path.getsize(_data_paths(args.path, read_meta(args.path))["vectors"])
+            print(f"Exported {rows} embeddings ({args.dtype}, {size / 2**20:,.1f} MiB) to '{args.path}' "
+                  f"in {time.perf_counter() - started:.1f}s.")
+        else:
+            rows = append_from_db(conn, args.path)
+            print(f"Appended {rows} embeddings to '{args.path}' in {time.perf_counter() - started:.1f}s.")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()